@@ -1,22 +1,34 @@
 import dash
-from dash import dcc, html, Input, Output, State, dash_table
+from dash import dcc, html, Input, Output, State, MATCH
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
-import pandas as pd
-import plotly.express as px
-import io
-import base64
-from datetime import datetime, time, timedelta
+import numpy as np
+import flask
+import os
 
-from imu.align import convertlogs, align
+from imu.align import exportframe, colnameimudata, SAMPLINGRATE
+from imu.downsample import downsample, visiblerange, NBUCKETS
+from imu.pyramid import chooselevel, levelslice, levelminmax, windowstats
+from imu.sessions import getsession
+from imu.resprate import getrates, WINDOWS, WINDOW, THORAX, ABDOMEN
+from imu.profile import Profile, remember, recent, ENABLED as PROFILING
+from imu.live import livemessages, gettail
+from imu.jobs import newjob, jobpath, submitjob, jobstate, canceljob, workerpool, UPLOAD, DONE, ERROR, CANCELLED
+from werkzeug.formparser import parse_form_data
+from werkzeug.exceptions import HTTPException, BadRequest
 
 IMUNAMES = {"01": ["thorax", "tho", "t"], "02": ["abdomen", "abd", "a"], "03": ["reference", "ref", "r"]}
 HMCOLORS = {"collected": [1, "#1e8449"], "missing": [0, "#e0dfdf"]}  # Green/White Heatmap
 TIMESTAMP = "TSTAMP"
-IMUIDS = [x for x in IMUNAMES.keys()]
-HMCOLS = [TIMESTAMP]
-HMCOLS.extend(IMUIDS)
-IMUELEM = "_1"
+HMBUCKETS = 500 #max heatmap columns, whatever the recording length
+JOB_POLL = 500 #ms between progress updates of an upload being ingested
+MAXUPLOAD = int(os.environ.get("IOBDASH_MAXUPLOAD_MB", 2048)) * pow(2,20) #bytes, larger uploads are rejected with 413
+MAXFORMFIELD = pow(2,20) #bytes of a form field other than the log
+PROFILE_POLL = 2000 #ms between updates of the open profiling panel
+
+def imulabel(imu):
+    # name of a sensor, its id if it has no name yet
+    return IMUNAMES.get(imu, [imu])[0]
 
 
 # Initialize Dash app
@@ -26,88 +38,68 @@ app.title = "Respiratory Analysis"
 # Layout
 app.layout = html.Div(style={'display': 'flex'}, children=[
     html.Div(style={'width': '200px', 'padding': '20px', 'borderLeft': '1px solid #ccc'}, children=[
-        dcc.Upload(
-            id='upload-data',
-            children=html.Div([html.Button('Select Log File')]),
-            multiple=False
-        ),
+        # the file is streamed to /upload by assets/upload.js, Dash only gets the job id
+        html.Button('Select Log File', id='btn-upload'),
+        html.Div(id='upload-status'),
         html.Br(),
         html.Div(id='file-info', style={'marginTop': '10px'}),
         html.Br(),
         html.Br(),
         html.Button("Save aligned csv", id="btn_download", n_clicks=0, style={"display": "none"}),
-        dcc.Download(id="save_csv")
+        dcc.Download(id="save_csv"),
+        html.Hr(),
+        # live mode, follows a log while it is being recorded
+        dcc.Input(id="live-path", type="text", placeholder="Log to follow", style={"width": "100%"}),
+        html.Button("Follow log", id="btn-live", n_clicks=0),
+        html.Div(id="live-info", style={"marginTop": "10px"}),
+        # filled by assets/live.js only, no callback outputs to it
+        html.Div(id="live-counters"),
+        # stage timings, see imu/profile.py
+        html.Details(id="profile-details", style={"marginTop": "10px"} if PROFILING else {"display": "none"}, children=[
+            html.Summary("Profiling"),
+            html.Div(id="profile-panel", style={"fontSize": "small"})
+        ])
     ]),
     html.Div(style={'flex': '1', 'padding': '20px'}, children=[
-        dcc.Loading(id="loading-spinner", type="circle", children=[
+        dcc.Loading(id="loading-spinner", type="circle", delay_show=1000, children=[
             dcc.Tabs(id="tabs", value='tab1', children=[
                 dcc.Tab(label='IMU Traces', value='tab1'),
                 dcc.Tab(label='Data Acquisition Analysis', value='tab2'),
                 dcc.Tab(label='Data Analysis', value='tab3')
             ]),
             html.Div(id='tabs-content', style={'marginTop': '20px'})
+        ]),
+        html.Div(id="live-content", style={"display": "none"}, children=[
+            html.H4("Live data loss"),
+            # charts drawn by assets/live.js, no callback outputs to these
+            html.Div(id="live-loss"),
+            html.Div(id="live-traces")
         ])
     ]),
     dcc.Store(id='aligned-df', data={}),
-    dcc.Store(id='quality-df', data={})
+    dcc.Store(id='quality-df', data={}),
+    dcc.Store(id='live-tail', data={}),
+    dcc.Store(id='live-stream', data=""),
+    dcc.Store(id='ingest-job', data={}),
+    dcc.Interval(id='job-poll', interval=JOB_POLL, disabled=True),
+    dcc.Interval(id='profile-poll', interval=PROFILE_POLL, disabled=not PROFILING)
 ])
 
-def parse_content(contents, filename):
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
-    try:
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-        elif filename.endswith('.txt'):
-            payloads = convertlogs(decoded.decode('utf-8'), 3)
-            df, _, _, _ = align(payloads, 3)
-        else:
-            return html.Div("Unsupported file format"), None, None
-
-        ## a few more stats
-        datastats = {}
-
-        if TIMESTAMP in df.columns:            
-            fromtime = datetime.strptime(df.loc[0,TIMESTAMP], '%d:%m:%H:%M:%S:%f')
-            totime = datetime.strptime(df.loc[len(df)-1,TIMESTAMP], '%d:%m:%H:%M:%S:%f')
-            timediff =  totime - fromtime
-            hours, remainder = divmod(timediff.total_seconds(), 3600)
-            minutes, seconds = divmod(remainder, 60)
-            strDuration = f"{int(hours)}hr {int(minutes)}min {int(seconds)}sec"
-        else:
-            strDuration = " -- "
-        datastats["timewindow"] = strDuration
-
-        nstamps = len(df)
-        cnames = []
-        for imu in IMUIDS:
-            cname = imu + IMUELEM
-            cnames.append(cname)
-            num_miss = df[cname].isna().sum()
-            datastats[imu] = [num_miss, num_miss/nstamps]
-        num_imus = len(IMUIDS)
-        stats_miss = [0]*num_imus
-        for i in range(0, num_imus):
-            nocc = ((df[cnames].isna().sum(axis=1) == i)).sum()
-            stats_miss[i] = nocc
-        datastats["num_imus"] = num_imus
-        datastats["total"] = nstamps
-        datastats["empty"] = df[cnames].isna().all(axis=1).sum()
-        datastats["full"] = df[cnames].notna().all(axis=1).sum()
-        datastats["nsamples"] = num_imus * nstamps
-        datastats["stats"] = stats_miss
-        return html.Div([
-            html.H5(filename)
-        ]), df.to_dict('records'), datastats
-    except Exception as e:
-        return html.Div(f"Error processing file: {str(e)}"), None, None
+@app.server.route("/live/<key>")
+def live_stream(key):
+    # server-sent events with the new rows of a followed log, see assets/live.js
+    if gettail(key) is None:
+        flask.abort(404)
+    sent = int(flask.request.headers.get("Last-Event-ID", 0) or 0)
+    return flask.Response(livemessages(key, sent), mimetype="text/event-stream",
+                          headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.callback(
     Output("btn_download", "style"),
-    Input("aligned-df", "data"),
-    State('upload-data', 'filename')
+    Input("aligned-df", "data")
 )
-def toggle_button_visibility(data, filename):
+def toggle_button_visibility(data):
+    filename = data.get("filename") if data else None
     if filename is not None and filename.endswith('.txt'):
         if data is not None and len(data) > 0:
             return {"display": "block"}  # Show button
@@ -117,43 +109,80 @@ def toggle_button_visibility(data, filename):
 @app.callback(
     Output("save_csv", "data"),
     Input("btn_download", "n_clicks"),
-    [State('aligned-df', 'data'),
-    State('upload-data', 'filename')],
+    State('aligned-df', 'data'),
     prevent_initial_call=True
 )
-def generate_csv(n_clicks, data, filename):
+def generate_csv(n_clicks, data):
+    filename = data.get("filename") if data else None
     if filename is None:
         return html.Div("No data to be saved")
     ext = filename[filename.rfind(".")+1:]
     fileout = filename.replace(ext, "csv")
 
-    df = pd.DataFrame(data)
-    return dcc.send_data_frame(df.to_csv, filename=fileout, index=False)
+    stored = getsession(data.get("session")) if data else None
+    if stored is None:
+        return dash.no_update
+    session, datastats, pyramid = stored
+    return dcc.send_data_frame(exportframe(session.toframe(), datastats["epoch"]).to_csv, filename=fileout, index=False)
 
 
 @app.callback(
     [Output('tabs-content', 'children'), 
      Output('file-info', 'children'),
      Output('aligned-df', 'data'),
-     Output('quality-df', 'data')],
-    [Input('upload-data', 'contents')],
-    [State('upload-data', 'filename')]
+     Output('quality-df', 'data'),
+     Output('job-poll', 'disabled')],
+    [Input('ingest-job', 'data')]
 )
-def update_output(contents, filename):
-    if filename is None:
+def update_output(job):
+    if not job or not job.get("job"):
         return html.Div(
             html.H3(children="Upload a file to get started",
                 style={'color':'#00361c','text-align':'center'})
-                    ), "", {}, {}
-    #className="hello"
-    if contents is None:
-        return html.Div("Selected file, but no content loaded."), "No content uploaded", {}, {}
-    
-    file_info, df, dstats = parse_content(contents, filename)
-    if df is None:
-        return file_info, "Error loading file", {}, {}
+                    ), "", {}, {}, True
+    # ingested in the background, see poll_job
+    filename = job["filename"]
+    progress = html.Div([
+        html.P(id="job-stage", children="Queued"),
+        dbc.Progress(id="job-progress", value=0, striped=True, animated=True),
+        html.Br(),
+        html.Button("Cancel", id="btn-cancel", n_clicks=0)
+    ])
+    return progress, html.P([html.B("Filename:"), f" {filename}"]), {}, {}, False
 
-    file_details = html.Div([
+@app.server.route("/upload", methods=["POST"])
+def upload_log():
+    # multipart upload written to the job spool file as it arrives, see assets/upload.js
+    jobid = newjob()
+    spool = jobpath(jobid, UPLOAD)
+    spooled = []
+    def spoolfile(total_content_length, content_type, filename, content_length=None):
+        # one log per upload, another file part would be written over it
+        if spooled:
+            raise BadRequest("Only one file can be uploaded at a time")
+        spooled.append(open(spool, "wb+"))
+        return spooled[0]
+    try:
+        stream, form, files = parse_form_data(flask.request.environ, stream_factory=spoolfile,
+                                              max_content_length=MAXUPLOAD, max_form_memory_size=MAXFORMFIELD)
+    except HTTPException:
+        for fout in spooled:
+            fout.close()
+        spool.unlink(missing_ok=True)
+        raise
+    upload = files.get("file")
+    if upload is None or not upload.filename:
+        spool.unlink(missing_ok=True)
+        flask.abort(400)
+    upload.close()
+    if form.get("replaces"):
+        # a new upload replaces the one being ingested
+        canceljob(form["replaces"])
+    submitjob(jobid, upload.filename)
+    return flask.jsonify(job=jobid, filename=upload.filename)
+
+def file_details(filename, dstats):
+    return html.Div([
         html.P([html.B("Filename:"), f" {filename}"]),
         html.Br(),
         html.P([html.B("Time window:")]),
@@ -161,128 +190,303 @@ def update_output(contents, filename):
         html.P([html.B("Sampled events:")]),
         html.P(dstats["total"])        
     ])
-    return html.Div(id='tab-content', children=[]), file_details, df, dstats
+
+@app.callback(
+    [Output('tabs-content', 'children', allow_duplicate=True),
+     Output('file-info', 'children', allow_duplicate=True),
+     Output('aligned-df', 'data', allow_duplicate=True),
+     Output('quality-df', 'data', allow_duplicate=True),
+     Output('job-poll', 'disabled', allow_duplicate=True)],
+    Input('job-poll', 'n_intervals'),
+    State('ingest-job', 'data'),
+    prevent_initial_call=True
+)
+def poll_job(n_intervals, job):
+    state = jobstate(job.get("job")) if job else None
+    if state is None:
+        return html.Div("Upload a file to see content."), dash.no_update, {}, {}, True
+    if state["status"] == ERROR:
+        return html.Div(f"Error processing file: {state.get('error')}"), "Error loading file", {}, {}, True
+    if state["status"] == CANCELLED:
+        return html.Div("Upload cancelled."), "No content loaded", {}, {}, True
+    if state["status"] != DONE:
+        # only the progress bar changes
+        progress = dash.Patch()
+        progress["props"]["children"][0]["props"]["children"] = state["stage"].title()
+        progress["props"]["children"][1]["props"]["value"] = round(100 * state["progress"])
+        return progress, dash.no_update, dash.no_update, dash.no_update, False
+    # the ingestion was profiled by the worker
+    remember(state.get("profile"))
+    prof = Profile("load", file=state["filename"])
+    try:
+        with prof.stage("session") as st:
+            stored = getsession(state["key"])
+            st["rows"] = len(stored[0]) if stored else 0
+        if stored is None:
+            return html.Div("Error processing file: session not found"), "Error loading file", {}, {}, True
+        session, dstats, pyramid = stored
+        with prof.stage("details"):
+            details = file_details(state["filename"], dstats)
+    finally:
+        prof.finish()
+    return (html.Div(id='tab-content', children=[]), details,
+            {"session": state["key"], "filename": state["filename"]}, dstats, True)
+
+@app.callback(
+    Output('job-stage', 'children'),
+    Input('btn-cancel', 'n_clicks'),
+    State('ingest-job', 'data'),
+    prevent_initial_call=True
+)
+def cancel_job(n_clicks, job):
+    if job and job.get("job"):
+        canceljob(job["job"])
+    return "Cancelling"
+
+@app.callback(
+    Output('profile-panel', 'children'),
+    [Input('profile-poll', 'n_intervals'),
+     Input('profile-details', 'open')]
+)
+def update_profile(n_intervals, isopen):
+    # latest profiles first, only while the panel is open
+    if not isopen:
+        return dash.no_update
+    panel = []
+    for record in recent():
+        title = " ".join(str(record[k]) for k in ("profile", "file", "tab") if k in record)
+        rows = [html.Tr([html.Td(stage["stage"]), html.Td(f"{stage['seconds']:.3f}s"),
+                         html.Td("" if stage.get("rows") is None else stage["rows"]),
+                         html.Td(f"{stage['peakmb']:.1f}MB" if "peakmb" in stage else "")])
+                for stage in record["stages"]]
+        panel.append(html.Div([html.B(f"{title}: {record['seconds']:.3f}s"), html.Table(rows)]))
+    return panel or "No profiles yet"
 
 @app.callback(
     Output('tab-content', 'children'),
     [Input('tabs', 'value'),
      Input('aligned-df', 'data'),
-     Input('quality-df', 'data')],
-    [State('upload-data', 'filename')]
+     Input('quality-df', 'data')]
 )
-def render_tab(tab, df, dfstats, filename):
-    if not df:
-        return html.Div("Upload a file to see content.")
-    df = pd.DataFrame.from_dict(df)
-    if TIMESTAMP in df.columns:
-        df[TIMESTAMP] = df[TIMESTAMP].str.slice(6,)
+def render_tab(tab, data, dfstats):
+    prof = Profile("render", tab=tab)
+    try:
+        with prof.stage("session"):
+            stored = getsession(data.get("session")) if data else None
+        if stored is None:
+            return html.Div("Upload a file to see content.")
+        session, _, pyramid = stored
+        with prof.stage("figures", len(session)):
+            return tabcontent(tab, session, pyramid, dfstats)
+    finally:
+        # also the lookups of unknown sessions
+        prof.finish()
+
+def tabcontent(tab, session, pyramid, dfstats):
+    imuids = dfstats["imuids"]
     
     if tab == 'tab1':
         charts = []
         
-        for i in range(3):
-            imuname = str(i+1).zfill(2)
-            icol = df.columns.get_loc(imuname + "_1")
-            fig = px.line(df, x=df.columns[0], 
-                          y=df.columns[icol:icol+4],
-                          title=f"IMU {IMUNAMES[imuname][0]}")
-            charts.append(dcc.Graph(figure=fig))
+        for imu in imuids:
+            fig = tracefigure(session, pyramid, imu)
+            charts.append(dcc.Graph(id={"type": "imu-trace", "imu": imu}, figure=fig))
         
         return html.Div(style={'display': 'grid', 'gridTemplateColumns': '1fr', 'gap': '20px'}, children=charts)
     
     elif tab == 'tab2':
-        for imu in IMUNAMES:
-            cname = imu + IMUELEM
-            df[imu] = df.get(cname, pd.Series()).notna().astype(int)
-        dfhm = df[HMCOLS]
-        cscale = sorted([elem for elem in HMCOLORS.values()])
-        txtscale = [elem for elem in HMCOLORS.keys()]
-        figHM = go.Figure(data=go.Heatmap(
-            z=dfhm.iloc[:, 1:].T.values,
-            x=dfhm.iloc[:, 0],
-            y=[IMUNAMES[k][0].title() for k in IMUIDS],
-            colorscale=cscale, 
-            colorbar=dict(title="Sample collection outcomes", tickvals=[0, 0.5], ticktext=txtscale))
-        )
-        figHM.update_traces(showscale=False) 
-        figHM.update_layout(xaxis_nticks=36, modebar={"orientation": "v"})
-
-        # data loss
-        nsamples = dfstats["total"]
-        yfill = []
-        yok = []
-        ylabels = []
-        for imu in IMUIDS:
-            yfill.append(int(dfstats[imu][0]))
-            yok.append(nsamples-dfstats[imu][0])
-            ylabels.append(str(round((dfstats[imu][1])*100,2)) + "%") 
-
-        axislabels = [IMUNAMES[k][0].title() for k in IMUIDS]
-        figBC = go.Figure(data=[
-                go.Bar(name='Missing samples', x=yfill, y=axislabels, text=ylabels, textposition="auto", marker_color=HMCOLORS["missing"][1], orientation='h'),
-                go.Bar(name='Collected samples', x=yok, y=axislabels, marker_color=HMCOLORS["collected"][1], orientation='h')
-            ])
-        figBC.update_layout(barmode='stack', showlegend=False, modebar={"orientation": "v"})
+        figHM = heatmapfigure(session, pyramid, imuids)
+
+        # data loss of the whole session, from the coarsest buckets of the pyramid
+        stats = windowstats(pyramid, imuids) if pyramid else dfstats
 
         return html.Div([
             html.Div([
              html.H2("Samples' Acquisition Analysis"),
             ]),
             dbc.Row([
-                dbc.Col(html.Div(generate_stats(dfstats), style={"padding": "20px"}), width=9),
+                dbc.Col(html.Div(generate_stats(stats), id="acq-stats", style={"padding": "20px"}), width=9),
                 dbc.Col(html.Div(generate_sample_legenda(), style={"padding": "20px"}), width=3)
             ]),
             html.Div([
              html.H4("Details"),
             ]),
-            dcc.Graph(figure=figHM),
-            dcc.Graph(figure=figBC)            
+            dcc.Graph(id="acq-heatmap", figure=figHM),
+            dcc.Graph(id="acq-bars", figure=lossfigure(stats, imuids))
         ])
     
     elif tab == 'tab3':
         return html.Div([
-            html.Button("Run Analysis", id="run-analysis"),
-            html.Div(id="analysis-output")
+            html.Div([
+             html.H2("Respiratory Rate"),
+            ]),
+            html.Div([
+                html.Span("Window", style={"marginRight": "10px"}),
+                dcc.RadioItems(id="analysis-window", value=WINDOW, inline=True,
+                               options=[{"label": f" {w}s ", "value": w} for w in WINDOWS]),
+                html.Button("Run Analysis", id="run-analysis", style={"marginLeft": "20px"})
+            ], style={"display": "flex", "alignItems": "center"}),
+            dcc.Loading(html.Div(id="analysis-output"))
+        ])
+
+
+def tracefigure(session, pyramid, imu, x0=None, x1=None):
+    # quaternion traces of one imu, downsampled to the visible window
+    xsec = np.arange(len(session)) / SAMPLINGRATE
+    cols = colnameimudata(imu)[1:]
+    first, last = visiblerange(xsec, x0, x1)
+    seconds = chooselevel(pyramid, first, last, NBUCKETS) if pyramid else None
+    fig = go.Figure()
+    if seconds is not None:
+        # min and max of every bucket from the precomputed aggregates
+        buckets = levelslice(seconds, first, last)
+        qmin, qmax = levelminmax(pyramid[seconds])
+        j = session.imuids.index(imu)
+        x = np.repeat(np.arange(buckets.start, buckets.stop) * seconds, 2)
+        for i, col in enumerate(cols):
+            y = np.column_stack((qmin[buckets, j, i], qmax[buckets, j, i])).ravel()
+            fig.add_trace(go.Scattergl(x=x, y=y, mode="lines", name=col))
+    else:
+        q = session.quaternions(imu)
+        for i, col in enumerate(cols):
+            x, y = downsample(xsec, q[:, i], x0, x1)
+            fig.add_trace(go.Scattergl(x=x, y=y, mode="lines", name=col))
+    fig.update_layout(title=f"IMU {imulabel(imu)}", xaxis_title="Time (s)",
+                      legend_title_text="variable", uirevision=imu)
+    if x0 is not None and x1 is not None:
+        fig.update_xaxes(range=[x0, x1])
+    return fig
+
+@app.callback(
+    Output({"type": "imu-trace", "imu": MATCH}, "figure"),
+    Input({"type": "imu-trace", "imu": MATCH}, "relayoutData"),
+    State('aligned-df', 'data'),
+    prevent_initial_call=True
+)
+def zoom_trace(relayout, data):
+    stored = getsession(data.get("session")) if data else None
+    if stored is None or not relayout:
+        return dash.no_update
+    session, datastats, pyramid = stored
+    imu = dash.ctx.triggered_id["imu"]
+    if "xaxis.range[0]" in relayout:
+        return tracefigure(session, pyramid, imu, relayout["xaxis.range[0]"], relayout["xaxis.range[1]"])
+    if "xaxis.range" in relayout:
+        return tracefigure(session, pyramid, imu, *relayout["xaxis.range"])
+    if relayout.get("xaxis.autorange"):
+        return tracefigure(session, pyramid, imu)
+    return dash.no_update
+
+def lossfigure(stats, imuids):
+    # missing and collected samples of every imu, the mean battery level on hover
+    nsamples = stats["total"]
+    yfill = []
+    yok = []
+    ylabels = []
+    for imu in imuids:
+        yfill.append(int(stats[imu][0]))
+        yok.append(nsamples-stats[imu][0])
+        ylabels.append(str(round((stats[imu][1])*100,2)) + "%")
+    battery = stats.get("battery", [None] * len(imuids))
+    hover = "%{y}: %{x} samples, battery %{customdata:.0f}<extra></extra>" if "battery" in stats else None
+
+    axislabels = [imulabel(k).title() for k in imuids]
+    figBC = go.Figure(data=[
+            go.Bar(name='Missing samples', x=yfill, y=axislabels, text=ylabels, textposition="auto", marker_color=HMCOLORS["missing"][1], orientation='h',
+                   customdata=battery, hovertemplate=hover),
+            go.Bar(name='Collected samples', x=yok, y=axislabels, marker_color=HMCOLORS["collected"][1], orientation='h',
+                   customdata=battery, hovertemplate=hover)
         ])
+    figBC.update_layout(barmode='stack', showlegend=False, modebar={"orientation": "v"})
+    return figBC
+
+
+def heatmapfigure(session, pyramid, imuids, x0=None, x1=None):
+    # collected samples per imu, binned to the visible window
+    xsec = np.arange(len(session)) / SAMPLINGRATE
+    first, last = visiblerange(xsec, x0, x1)
+    seconds = chooselevel(pyramid, first, last, HMBUCKETS) if pyramid else None
+    if seconds is not None:
+        # fraction of collected samples per bucket
+        buckets = levelslice(seconds, first, last)
+        level = pyramid[seconds]
+        z = (level["collected"][buckets] / level["nrows"][buckets][:, None]).T
+        x = (np.arange(buckets.start, buckets.stop) + 0.5) * seconds
+        hover = "%{y} %{x:.0f}s: %{z:.0%} collected<extra></extra>"
+    else:
+        z = [session.present(imu)[first:last].astype(int) for imu in imuids]
+        x = xsec[first:last]
+        hover = "%{y} %{x:.1f}s: %{z}<extra></extra>"
+    cscale = sorted([elem for elem in HMCOLORS.values()])
+    txtscale = [elem for elem in HMCOLORS.keys()]
+    figHM = go.Figure(data=go.Heatmap(
+        z=z,
+        x=x,
+        y=[imulabel(k).title() for k in imuids],
+        zmin=0, zmax=1,
+        hovertemplate=hover,
+        colorscale=cscale, 
+        colorbar=dict(title="Sample collection outcomes", tickvals=[0, 0.5], ticktext=txtscale))
+    )
+    figHM.update_traces(showscale=False) 
+    figHM.update_layout(xaxis_nticks=36, xaxis_title="Time (s)", modebar={"orientation": "v"}, uirevision="heatmap")
+    if x0 is not None and x1 is not None:
+        figHM.update_xaxes(range=[x0, x1])
+    return figHM
+
+@app.callback(
+    [Output("acq-heatmap", "figure"),
+     Output("acq-stats", "children"),
+     Output("acq-bars", "figure")],
+    Input("acq-heatmap", "relayoutData"),
+    State('aligned-df', 'data'),
+    prevent_initial_call=True
+)
+def zoom_heatmap(relayout, data):
+    # heatmap and data loss of the visible window, the statistics from the pyramid
+    stored = getsession(data.get("session")) if data else None
+    if stored is None or not relayout or not stored[2]:
+        return dash.no_update, dash.no_update, dash.no_update
+    session, datastats, pyramid = stored
+    imuids = datastats["imuids"]
+    if "xaxis.range[0]" in relayout:
+        x0, x1 = relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+        stats = windowstats(pyramid, imuids, np.floor(max(x0, 0)), np.ceil(max(x1, 0)))
+        return (heatmapfigure(session, pyramid, imuids, x0, x1), generate_stats(stats),
+                lossfigure(stats, imuids))
+    if relayout.get("xaxis.autorange"):
+        stats = windowstats(pyramid, imuids)
+        return heatmapfigure(session, pyramid, imuids), generate_stats(stats), lossfigure(stats, imuids)
+    return dash.no_update, dash.no_update, dash.no_update
 
 
 def generate_stats(dstats):
     nticks = dstats["total"]
-    return html.Div([
-        html.P("Number of collected samples per event (" + str(nticks) + " total events)"),
-        html.Div([
-            html.Span("From all IMUs", className="boxlegenda"),
-            html.Div(className="boxcollected"),
-            html.Div(className="boxcollected"),
-            html.Div(className="boxcollected"),
-            html.Span(dstats["full"], className="boxnumber"),
-            html.Span(str(round((dstats["full"]*100)/nticks,2)) + "%", className="boxnumber")
-        ], style={"display": "flex", "alignItems": "center"}),
-        html.Div([
-            html.Span("From 2 IMUs out of 3", className="boxlegenda"),
-            html.Div(className="boxcollected"),
-            html.Div(className="boxcollected"),
-            html.Div(className="boxmissing"),
-            html.Span(dstats["stats"][1], className="boxnumber"),
-            html.Span(str(round((dstats["stats"][1]*100)/nticks,2)) + "%", className="boxnumber")
-        ], style={"display": "flex", "alignItems": "center"}),
-        html.Div([
-            html.Span("From 1 IMU out of 3", className="boxlegenda"),
-            html.Div(className="boxcollected"),
-            html.Div(className="boxmissing"),
-            html.Div(className="boxmissing"),
-            html.Span(dstats["stats"][2], className="boxnumber"),
-            html.Span(str(round((dstats["stats"][2]*100)/nticks,2)) + "%", className="boxnumber")
-        ], style={"display": "flex", "alignItems": "center"}),
-        html.Div([
-            html.Span("From 0 IMU", className="boxlegenda"),
-            html.Div(className="boxmissing"),
-            html.Div(className="boxmissing"),
-            html.Div(className="boxmissing"),
-            html.Span(str(dstats["empty"]).rjust(4), className="boxnumber"),
-            html.Span(str(round((dstats["empty"]*100)/nticks,2)) + "%", className="boxnumber")
-        ], style={"display": "flex", "alignItems": "center"}),
-    ])
+    num_imus = dstats["num_imus"]
+    rows = [html.P("Number of collected samples per event (" + str(nticks) + " total events)")]
+    if nticks == 0:
+        return html.Div(rows)
+    # one row per number of missing imus, from none to all of them
+    for nmissing in range(num_imus + 1):
+        ncollected = num_imus - nmissing
+        if nmissing == 0:
+            label = "From all IMUs"
+            count = dstats["full"]
+        elif ncollected == 0:
+            label = "From 0 IMU"
+            count = dstats["empty"]
+        else:
+            label = f"From {ncollected} IMU{'s' if ncollected > 1 else ''} out of {num_imus}"
+            count = dstats["stats"][nmissing]
+        boxes = [html.Div(className="boxcollected") for i in range(ncollected)]
+        boxes.extend([html.Div(className="boxmissing") for i in range(nmissing)])
+        rows.append(html.Div([
+            html.Span(label, className="boxlegenda"),
+            *boxes,
+            html.Span(str(count).rjust(4), className="boxnumber"),
+            html.Span(str(round((count*100)/nticks,2)) + "%", className="boxnumber")
+        ], style={"display": "flex", "alignItems": "center"}))
+    return html.Div(rows)
 
 def generate_sample_legenda():
     return html.Div([
@@ -313,10 +517,52 @@ def generate_sample_legenda():
 @app.callback(
     Output("analysis-output", "children"),
     Input("run-analysis", "n_clicks"),
+    [State("analysis-window", "value"),
+     State('aligned-df', 'data')],
     prevent_initial_call=True
 )
-def run_analysis(n_clicks):
-    return html.Div("Analysis completed!")
+def run_analysis(n_clicks, window, data):
+    prof = Profile("analysis", window=window)
+    try:
+        with prof.stage("session"):
+            stored = getsession(data.get("session")) if data else None
+        if stored is None:
+            return html.Div("Upload a file to run the analysis.")
+        session = stored[0]
+        with prof.stage("rates", len(session)):
+            rates = getrates(data["session"], session, window)
+        with prof.stage("figure"):
+            fig = ratefigure(rates)
+    except ValueError as e:
+        return html.Div(f"Error running the analysis: {str(e)}")
+    finally:
+        prof.finish()
+    rate = rates["rate"]
+    valid = ~np.isnan(rate)
+    if not valid.any():
+        return html.Div("Too few samples collected to estimate the respiratory rate.")
+    summary = "Median {:.1f} breaths/min, {:.1f} to {:.1f} in 90% of the {} windows of {}s".format(
+        np.median(rate[valid]), *np.percentile(rate[valid], [5, 95]), np.count_nonzero(valid), window)
+    return html.Div([html.P(summary), dcc.Graph(figure=fig)])
+
+def ratefigure(rates):
+    # respiratory rate over time, of both imus and of each one
+    fig = go.Figure()
+    for imu in (THORAX, ABDOMEN):
+        if imu in rates:
+            fig.add_trace(go.Scattergl(x=rates["seconds"], y=rates[imu], mode="lines", name=imulabel(imu).title(),
+                                       line={"width": 1}, opacity=0.5))
+    fig.add_trace(go.Scattergl(x=rates["seconds"], y=rates["rate"], mode="lines", name="Combined", line={"width": 2}))
+    fig.update_layout(xaxis_title="Time (s)", yaxis_title="Breaths per minute", modebar={"orientation": "v"},
+                      uirevision="resprate")
+    return fig
+
+# live mode callbacks
+import callbacks
 
 if __name__ == '__main__':
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # the serving process of the debug reloader, not its watcher: jobs
+        # left unfinished by a previous server are queued again right away
+        workerpool()
     app.run_server(debug=True)
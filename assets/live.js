@@ -0,0 +1,112 @@
+// Draws the rows of a followed log as the server pushes them, see
+// livemessages in imu/live.py: only the new points reach the browser and
+// they are appended to the charts already drawn. The charts and counters
+// live in containers no Dash callback outputs to (live-loss, live-traces,
+// live-counters), so they are owned by this script alone.
+
+var liveSource = null;
+var LIVE_CONTAINERS = ["live-loss", "live-traces", "live-counters"];
+
+function liveClear() {
+    // purge the charts of the previous session and empty their containers
+    LIVE_CONTAINERS.forEach(function(id) {
+        var container = document.getElementById(id);
+        if (!container) {
+            return;
+        }
+        container.querySelectorAll(".js-plotly-plot").forEach(function(elem) { Plotly.purge(elem); });
+        while (container.firstChild) {
+            container.removeChild(container.firstChild);
+        }
+    });
+}
+
+function liveChart(containerId, id, data, layout) {
+    // existing chart to extend, or null once created here with the first rows
+    var elem = document.getElementById(id);
+    if (elem) {
+        return elem;
+    }
+    elem = document.createElement("div");
+    elem.id = id;
+    document.getElementById(containerId).appendChild(elem);
+    Plotly.newPlot(elem, data, layout);
+    return null;
+}
+
+function liveLoss(msg) {
+    // data loss bars, one per second
+    var elem = liveChart("live-loss", "live-loss-bars", [
+        {type: "bar", name: "Single IMU data loss", x: msg.loss.x, y: msg.loss.fill,
+         marker: {color: "Orange"}, hoverinfo: "skip", opacity: 0.4},
+        {type: "bar", name: "IMUs data loss", x: msg.loss.x, y: msg.loss.empty,
+         marker: {color: "#EF3E42"}, hoverinfo: "skip", opacity: 0.4}
+    ], {
+        height: 350,
+        font: {color: "#000"},
+        barmode: "stack",
+        showlegend: false,
+        xaxis: {title: {text: "Time (s)"}}
+    });
+    if (elem) {
+        Plotly.extendTraces(elem, {x: [msg.loss.x, msg.loss.x], y: [msg.loss.fill, msg.loss.empty]}, [0, 1], msg.maxbars);
+    }
+}
+
+function liveTrace(imu, msg) {
+    // quaternion chart of one imu
+    var elem = liveChart("live-traces", "live-trace-" + imu, msg.q[imu].map(function(y, i) {
+        return {type: "scattergl", mode: "lines", name: imu + "_" + (i + 1), x: msg.x, y: y};
+    }), {
+        height: 300,
+        title: {text: "IMU " + imu},
+        xaxis: {title: {text: "Time (s)"}},
+        legend: {title: {text: "variable"}}
+    });
+    if (elem) {
+        var x = msg.q[imu].map(function() { return msg.x; });
+        Plotly.extendTraces(elem, {x: x, y: msg.q[imu]}, msg.q[imu].map(function(v, i) { return i; }), msg.maxpoints);
+    }
+}
+
+function liveRows(msg) {
+    liveLoss(msg);
+    msg.imuids.forEach(function(imu) { liveTrace(imu, msg); });
+    var counters = document.getElementById("live-counters");
+    if (counters) {
+        counters.innerHTML = "<p><b>Time window:</b></p><p>" + msg.timewindow +
+            "</p><p><b>Sampled events:</b></p><p>" + msg.total + "</p>";
+    }
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        follow: function(tailstate) {
+            if (liveSource) {
+                liveSource.close();
+                liveSource = null;
+            }
+            // every (re)start draws a new session from scratch
+            liveClear();
+            if (!tailstate || !tailstate.tail) {
+                return "";
+            }
+            var source = new EventSource("live/" + tailstate.tail);
+            source.addEventListener("rows", function(e) {
+                // late events of a closed stream are dropped
+                if (liveSource === source) {
+                    liveRows(JSON.parse(e.data));
+                }
+            });
+            source.addEventListener("end", function() {
+                // no reconnection once the tail is gone
+                source.close();
+                if (liveSource === source) {
+                    liveSource = null;
+                }
+            });
+            liveSource = source;
+            return tailstate.tail;
+        }
+    }
+});
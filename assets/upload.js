@@ -0,0 +1,59 @@
+// Streams the selected log to /upload as a plain multipart POST, instead of
+// the base64 data URL that dcc.Upload hands to a callback. The server spools
+// it to disk and queues its ingestion; Dash only gets the job id back.
+
+var lastJob = null;
+
+function uploadStatus(text) {
+    var status = document.getElementById("upload-status");
+    if (status) {
+        status.textContent = text;
+    }
+}
+
+function uploadLog(file) {
+    var form = new FormData();
+    form.append("file", file);
+    if (lastJob) {
+        // a new upload replaces the one being ingested
+        form.append("replaces", lastJob);
+    }
+    var xhr = new XMLHttpRequest();
+    xhr.open("POST", "upload");
+    xhr.upload.onprogress = function(e) {
+        if (e.lengthComputable) {
+            uploadStatus("Uploading " + Math.round(100 * e.loaded / e.total) + "%");
+        }
+    };
+    xhr.onload = function() {
+        if (xhr.status === 413) {
+            uploadStatus("Upload failed: the file is too large");
+            return;
+        }
+        if (xhr.status !== 200) {
+            uploadStatus("Upload failed (" + xhr.status + ")");
+            return;
+        }
+        var job = JSON.parse(xhr.responseText);
+        lastJob = job.job;
+        uploadStatus("");
+        window.dash_clientside.set_props("ingest-job", {data: job});
+    };
+    xhr.onerror = function() { uploadStatus("Upload failed"); };
+    xhr.send(form);
+}
+
+document.addEventListener("click", function(e) {
+    if (!e.target.closest || !e.target.closest("#btn-upload")) {
+        return;
+    }
+    var input = document.createElement("input");
+    input.type = "file";
+    input.accept = ".txt,.csv";
+    input.addEventListener("change", function() {
+        if (input.files.length > 0) {
+            uploadLog(input.files[0]);
+        }
+    });
+    input.click();
+});
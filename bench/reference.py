@@ -0,0 +1,93 @@
+# Line by line parser of the first dashboard release, kept as the reference
+# the optimized pipeline is checked against. Only the hardcoded three imus
+# and the crashes of the align loop were fixed; do not optimize.
+import numpy as np
+
+DATALINE = "["
+SEP = ","
+BLANK = "FF"
+BYTE_IMUID = 0
+BYTE_BATTERY = 1
+BYTE_CHECK = 2
+BYTE_COUNTER = 3
+BYTE_PAYLOAD_START = 4
+BYTE_PAYLOAD_END = 7
+BYTE_TIMESTAMP = 8
+RESETCOUNTER = 256
+NUM_DATACOL = 5
+
+
+def quatconvert(x):
+    if x > 127 and x != np.nan:
+        x -= 256
+    x /= 127
+    return x
+
+def convertlogs(loadedtext, num_imus):
+    # imuid -> list of [ts, counter, battery, q1..q4] rows
+    txt = loadedtext.strip().split("\n")
+    datain = {}
+    for i in range(num_imus):
+        datain[i+1] = []
+    i = 0
+    nlines = len(txt)
+    while i < nlines:
+        if len(txt[i]) > 0:
+            if txt[i][0] == DATALINE:
+                break
+        i += 1
+    while i < nlines:
+        line = txt[i]
+        line = line.replace("[", "").replace("]", "")
+        items = line.split(SEP)
+        if items[BYTE_CHECK] != BLANK:
+            imuid = int(items[BYTE_IMUID], 16)
+            battery = int(items[BYTE_BATTERY], 16)
+            counter = int(items[BYTE_COUNTER], 16)
+            payload = []
+            for bp in range(BYTE_PAYLOAD_START, BYTE_PAYLOAD_END+1):
+                payload.append(quatconvert(int(items[bp], 16)))
+            ts = items[BYTE_TIMESTAMP]
+            row = [ts, counter, battery]
+            row.extend(payload)
+            if imuid in datain:
+                datain[imuid].append(row)
+            else:
+                datain[imuid] = [row]
+        i += 1
+    return datain
+
+def align(payloads, imuids):
+    # list of [TSTAMP, COUNTER, battery, q1..q4, ...] rows, TSTAMP 0 when all imus miss
+    readings = [payloads[imuid] for imuid in imuids]
+    num_imus = len(imuids)
+    nFields = 2 + num_imus * NUM_DATACOL
+    if any(len(imudata) == 0 for imudata in readings):
+        return []
+    startCounter = min(imudata[0][1] for imudata in readings)
+    counter = startCounter
+    lenData = [len(imudata) for imudata in readings]
+    idxs = [0]*num_imus
+    rows = []
+    while all(idx < n for idx, n in zip(idxs, lenData)):
+        row = []
+        ts = []
+        nth = counter % RESETCOUNTER
+        for imui, imudata in enumerate(readings):
+            rowimu = imudata[idxs[imui]]
+            if rowimu[1] == nth:
+                ts.append(rowimu[0])
+                row.extend(rowimu[2:])
+                idxs[imui] += 1
+            else:
+                row.extend([np.nan]*NUM_DATACOL)
+        if ts:
+            finalrow = [min(ts), nth]
+            finalrow.extend(row)
+        else:
+            finalrow = [np.nan]*(nFields-2)
+            finalrow.insert(0, nth)
+            finalrow.insert(0, 0)
+        rows.append(finalrow)
+        counter += 1
+    return rows
@@ -0,0 +1,307 @@
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# run from anywhere, the imu package lives at the repository root
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# sessions and jobs of the runs never end up in the user cache
+WORKDIR = pathlib.Path(tempfile.mkdtemp(prefix="iobbench"))
+os.environ["IOBDASH_CACHE"] = str(WORKDIR.joinpath("cache"))
+os.environ["IOBDASH_JOBS"] = str(WORKDIR.joinpath("jobs"))
+
+from imu.align import (decodelogs, encodelogs, convertlogs, alignarrays, findimus, formattstamps, colnameimudata,
+                       PLOTCOLS, QSCALE, NUM_DATACOL, MS_IN_SEC)
+from imu.compact import CompactSession
+from imu.pyramid import buildpyramid
+from imu.resprate import respiratoryrate
+from imu import api, cache, jobs
+from imu.sessions import putsession
+from bench import reference
+from imu.synth import synthlog, tstampof, LossModel, START
+
+SIZES = {"1m": 60, "1h": 3600, "24h": 24 * 3600}
+IMUS = [3, 8]
+LOSSES = [0.02, 0.2]
+BURST = 4 #mean samples of a loss burst
+REPEAT = 3 #runs of every stage, the fastest is kept
+TOLERANCE = 0.25 #slowdown or memory growth reported as a regression
+MINDELTA = 0.005 #seconds, smaller slowdowns are noise
+REFMAXSECONDS = 3600 #longer sessions are not checked against the reference, too slow
+LISTMAXSECONDS = 3600 #longer sessions are not converted to lists, too large
+APIQUERIES = 20
+APIWINDOW = 20 #seconds of every get_imu_data query
+RESULTS = "bench_results.json"
+VERSION = 2 #results of other versions ran on different sessions
+
+
+class Case:
+    """
+    One synthetic session and the outputs of the stages run on it
+    """
+
+    def __init__(self, size, nimus, loss):
+        self.size = size
+        self.seconds = SIZES[size]
+        self.nimus = nimus
+        self.loss = loss
+        self.name = f"{size}-{nimus}imus-{round(100*loss)}loss"
+        self.raw = synthlog(self.seconds, nimus, LossModel.bursty(loss, BURST))
+        self.outputs = {}
+        self.stages = {}
+        self.checks = {}
+
+    def result(self):
+        decoded = self.outputs.get("decode", {})
+        return {
+            "seconds": self.seconds,
+            "imus": self.nimus,
+            "loss": self.loss,
+            "logbytes": len(self.raw),
+            "readings": int(sum(len(v) for v in decoded.values())),
+            "rows": len(self.outputs["align"][0]) if "align" in self.outputs else 0,
+            "stages": self.stages,
+            "checks": self.checks,
+        }
+
+
+def measure(run, setup=None, repeat=REPEAT):
+    """
+    Time a stage and its peak of traced memory
+    :params run: called with the output of setup, returns the stage output
+    :params setup: called before every run, not timed
+    :params repeat: timed runs, the fastest is kept
+    :returns: output of the last run, dict with time in seconds and peak in bytes
+    """
+    best = None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        output = run(arg)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+        del output
+    # traced apart, tracemalloc slows python code down
+    arg = setup() if setup else None
+    tracemalloc.start()
+    output = run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return output, {"time": best, "peak": peak}
+
+def spoolupload(case):
+    # a queued job with the log uploaded, as left by the upload route
+    jobs.JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    jobid = uuid.uuid4().hex
+    jobs.jobpath(jobid, jobs.UPLOAD).write_bytes(case.raw)
+    jobs.writestate({"id": jobid, "filename": case.name + ".txt", "status": jobs.QUEUED,
+                     "stage": jobs.QUEUED, "progress": 0.0, "created": time.time()})
+    cache.cachepath(cache.sessionkey(case.raw)).unlink(missing_ok=True)
+    return jobid
+
+def ingestjob(jobid):
+    state = jobs.ingest(jobid)
+    if state["status"] != jobs.DONE:
+        raise RuntimeError(state.get("error", state["status"]))
+    return state
+
+def apisources(case):
+    # per imu files of the first imus, read by get_imu_data
+    decoded = case.outputs["decode"]
+    imuids = case.outputs["imuids"]
+    path = WORKDIR.joinpath("api")
+    path.mkdir(exist_ok=True)
+    for imuid, fname in zip(imuids, api.IMUFILES):
+        path.joinpath(fname).write_bytes(encodelogs(decoded[imuid]))
+    api.DATA_PATH = path
+    api._sources.clear()
+
+def apistarts(case):
+    # start times of the queries, spread over the session past the first reading of every imu
+    decoded = case.outputs["decode"]
+    imuids = case.outputs["imuids"][:len(api.IMUFILES)]
+    first = max(int(decoded[imuid]["TSTAMP"][0]) for imuid in imuids) - tstampof(START)
+    first = first / MS_IN_SEC + 1
+    last = max(case.seconds - APIWINDOW - 2 * api.TOLERANCE, first)
+    return [(START + datetime.timedelta(seconds=s)).time() for s in np.linspace(first, last, APIQUERIES)]
+
+def apiqueries(starts):
+    return [api.get_imu_data(start, APIWINDOW) for start in starts]
+
+def rendertabs(case, tab):
+    import app
+    key = cache.sessionkey(case.raw)
+    putsession(key, case.outputs["compact"], case.outputs["align"][1].todict(), case.outputs["pyramid"])
+    return app.render_tab(tab, {"session": key}, case.outputs["align"][1].todict())
+
+def runstages(case, repeat, progress):
+    def stage(name, run, setup=None, times=repeat):
+        output, case.stages[name] = measure(run, setup, times)
+        case.outputs[name] = output
+        progress(case, name)
+
+    stage("decode", lambda _: decodelogs(case.raw))
+    decoded = case.outputs["decode"]
+    case.outputs["imuids"] = findimus(decoded)
+    if case.seconds <= LISTMAXSECONDS:
+        stage("convertlogs", lambda _: convertlogs(case.raw, case.nimus))
+    stage("align", lambda _: alignarrays(decoded, case.outputs["imuids"]))
+    stage("compact", lambda _: CompactSession.fromframe(case.outputs["align"][0], case.outputs["imuids"]))
+    stage("pyramid", lambda _: buildpyramid(case.outputs["compact"]))
+    stage("ingest", ingestjob, lambda: spoolupload(case))
+    stage("render_traces", lambda _: rendertabs(case, "tab1"))
+    stage("render_quality", lambda _: rendertabs(case, "tab2"))
+    stage("resprate", lambda _: respiratoryrate(case.outputs["compact"]))
+    apisources(case)
+    stage("api_load", lambda _: api.get_imu_data(apistarts(case)[0], APIWINDOW), api._sources.clear)
+    stage("api_query", apiqueries, lambda: apistarts(case))
+    case.stages["api_query"]["time"] /= APIQUERIES
+    if case.seconds <= REFMAXSECONDS:
+        text = case.raw.decode()
+        stage("reference_parse", lambda _: reference.convertlogs(text, case.nimus), times=1)
+        stage("reference_align", lambda _: reference.align(case.outputs["reference_parse"], case.outputs["imuids"]), times=1)
+
+def samereadings(decoded, parsed):
+    # RAWDTYPE arrays against the reference [ts, counter, battery, q1..q4] rows
+    for imuid, rows in parsed.items():
+        readings = decoded.get(imuid, [])
+        if len(readings) != len(rows):
+            return False
+        if len(rows) == 0:
+            continue
+        ts, counter, battery, *q = zip(*rows)
+        if (list(formattstamps(readings["TSTAMP"])) != list(ts) or readings["NTH"].tolist() != list(counter)
+                or readings["BATTERY"].tolist() != list(battery)
+                or not np.array_equal(readings["Q"] / QSCALE, np.array(q).T)):
+            return False
+    return True
+
+def samealigned(df, rows, imuids):
+    # aligned dataframe against the reference rows, TSTAMP of the empty rows aside
+    if len(df) != len(rows):
+        return False
+    if len(rows) == 0:
+        return True
+    cols = [col for imuid in imuids for col in colnameimudata(imuid)]
+    values = np.array([row[2:] for row in rows], dtype=float)
+    if not np.array_equal(df[cols].to_numpy(), values, equal_nan=True):
+        return False
+    if df[PLOTCOLS[1]].tolist() != [row[1] for row in rows]:
+        return False
+    collected = ~np.isnan(values[:, 1::NUM_DATACOL]).all(axis=1)
+    ts = formattstamps(df[PLOTCOLS[0]].to_numpy()[collected], df.attrs["epoch"])
+    return list(ts) == [row[0] for row, keep in zip(rows, collected) if keep]
+
+def runchecks(case):
+    """
+    Outputs of the optimized stages against the reference implementation
+    and against each other, True where equal
+    """
+    df = case.outputs["align"][0]
+    compact = case.outputs["compact"].toframe()
+    case.checks["compact"] = compact.equals(df)
+    key = cache.sessionkey(case.raw)
+    cached = cache.loadsession(key)
+    case.checks["ingest"] = cached is not None and cached[0].toframe().equals(compact)
+    if "reference_parse" in case.outputs:
+        parsed = case.outputs["reference_parse"]
+        case.checks["decode"] = samereadings(case.outputs["decode"], parsed)
+        if "convertlogs" in case.outputs:
+            case.checks["convertlogs"] = case.outputs["convertlogs"] == parsed
+        case.checks["align"] = samealigned(df, case.outputs["reference_align"], case.outputs["imuids"])
+
+def gitcommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Stages slower or using more memory than in the baseline
+    :returns: list of messages, one per regression
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        basecase = baseline.get("cases", {}).get(name)
+        if basecase is None:
+            continue
+        for stage, measures in case["stages"].items():
+            base = basecase["stages"].get(stage)
+            if base is None:
+                continue
+            if measures["time"] > base["time"] * (1 + tolerance) and measures["time"] - base["time"] > MINDELTA:
+                regressions.append(f"{name} {stage}: {base['time']:.4f}s -> {measures['time']:.4f}s")
+            if measures["peak"] > base["peak"] * (1 + tolerance) and measures["peak"] - base["peak"] > pow(2,20):
+                regressions.append(f"{name} {stage}: peak {base['peak']/pow(2,20):.1f}MB -> {measures['peak']/pow(2,20):.1f}MB")
+    return regressions
+
+def printstage(case, name):
+    measures = case.stages[name]
+    print(f"{case.name:<22}{name:<18}{measures['time']:>10.4f}s{measures['peak']/pow(2,20):>10.1f}MB", flush=True)
+
+def parselist(text, convert):
+    return [convert(x) for x in text.split(",") if x]
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="Time and check the ingest, align and render pipeline on synthetic logs")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="session durations among " + ", ".join(SIZES))
+    parser.add_argument("--imus", default=",".join(map(str, IMUS)), help="numbers of imus")
+    parser.add_argument("--loss", default=",".join(map(str, LOSSES)), help="probabilities of a lost sample")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs of every stage")
+    parser.add_argument("--out", default=RESULTS, help="results file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv[1:])
+
+    results = {"version": VERSION, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+               "commit": gitcommit(), "python": platform.python_version(), "numpy": np.__version__,
+               "pandas": pd.__version__, "machine": platform.platform(), "cpus": os.cpu_count(), "cases": {}}
+    failed = []
+    try:
+        for size in parselist(args.sizes, str):
+            for nimus in parselist(args.imus, int):
+                for loss in parselist(args.loss, float):
+                    case = Case(size, nimus, loss)
+                    runstages(case, args.repeat, printstage)
+                    runchecks(case)
+                    failed.extend(f"{case.name} {name}" for name, ok in case.checks.items() if not ok)
+                    results["cases"][case.name] = case.result()
+                    del case
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    with open(args.out, "w") as fout:
+        json.dump(results, fout, indent=1)
+    print("Results saved in file ", args.out)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+        if baseline.get("version") != VERSION:
+            print("Baseline", args.baseline, "is of another benchmark version, not compared")
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            print(len(regressions), "regressions against", args.baseline)
+        for message in regressions:
+            print("  ", message)
+    print(len(failed), "outputs different from the reference")
+    for message in failed:
+        print("  ", message)
+    return 1 if failed or regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
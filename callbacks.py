@@ -1,61 +1,38 @@
 # import dash IO and graph objects
-from dash.dependencies import Input, Output
-
-# Plotly graph objects to render graph plots
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-
-# Import dash html, bootstrap components, and tables for datatables
-import dash_html_components as html
-import dash_bootstrap_components as dbc
-import dash_core_components as dcc
-import dash_table
-
-# Import app
-from app import app
-
-# Call back to OBP Line Graph
-@app.callback(
-    Output("data-loss", "figure"),
-    [Input("imu-reading-update", "n_intervals")], 
-    [
-          State("imu-reading", "figure"),
-    ],
+from dash import callback, clientside_callback, ClientsideFunction, Input, Output, State, no_update
+
+from imu.live import starttail, stoptail
+
+# Call back to follow a log being recorded, the rows are then pushed by the
+# server on /live/<tail key> and drawn by assets/live.js
+@callback(
+    [Output("live-tail", "data"),
+     Output("btn-live", "children"),
+     Output("live-content", "style"),
+     Output("live-info", "children")],
+    Input("btn-live", "n_clicks"),
+    [State("live-path", "value"),
+     State("live-tail", "data")],
+    prevent_initial_call=True
 )
-def update_data_loss(interval):
-
-def gen_data_loss(interval, imu_reading_figure):
+def follow_log(n_clicks, fname, tailstate):
     """
-    Generate data loss chart.
-    :params interval: update the graph based on an interval
+    Start following the log in the path field, or stop if already following
     """
-
-    dfloss.tail(DATALOSS_WINDOW)
-
-    traceFill = dict(
-        type="bar",
-        name="Single IMU data loss",
-        y=dfloss["fill"],
-        line={"color": "Orange"},
-        hoverinfo="skip",
-        opacity=0.4,
-    )
-
-    traceEmpty = dict(
-        type="bar",
-        name="IMUs data loss",
-        y=dfloss["empty"],
-        line={"color": "#EF3E42"},
-        hoverinfo="skip",
-        opacity=0.4,
-    )
-
-    layout = dict(
-        height=350,
-        font={"color": "#000"},
-        barmode="stack",
-        autosize=False,
-        showlegend=False,
-    )
-
-    return dict(data=[traceFill, traceEmpty], layout=layout)
\ No newline at end of file
+    if tailstate and tailstate.get("tail"):
+        stoptail(tailstate["tail"])
+        return {}, "Follow log", {"display": "none"}, "Stopped"
+    if not fname:
+        return no_update, "Follow log", {"display": "none"}, "Type the path of a log to follow"
+    try:
+        key = starttail(fname.strip())
+    except OSError as e:
+        return {}, "Follow log", {"display": "none"}, f"Error following file: {str(e)}"
+    return {"tail": key}, "Stop", {"display": "block"}, f"Following {fname.strip()}"
+
+# opens or closes the stream of the followed log in the browser
+clientside_callback(
+    ClientsideFunction(namespace="live", function_name="follow"),
+    Output("live-stream", "data"),
+    Input("live-tail", "data")
+)
@@ -1,159 +1,79 @@
-from datetime import datetime, time, timedelta
-import pandas as pd
-import numpy as np
-import random
+import argparse
 import pathlib
+import random
 import sys
 import time
 
-PATH = pathlib.Path(__name__).parent
-DATA_PATH = PATH.joinpath(".").resolve()
-COLNAMES = ["IMUID", "BATTERY","CHECK","NTH","1","2","3","4","TSTAMP"]
-COLNAMESMIN = ["IMUID", "BATTERY","NTH","1","2","3","4","TSTAMP"]
-COLHEX = ["IMUID", "BATTERY","CHECK","NTH","1","2","3","4"]
-COLSIG = ["1","2","3","4"]
-COLDATA = ["NTH","1","2","3","4","TSTAMP"]
-MISSING = "FF"
-DELTASAMESIG = 800
-EMPTYDATA = ["[00]","[FF]","[00]","[00]","[00]","[00]","[00]"]
-DUMPFREQ = 4
-NBITS = 8
-RESETCOUNTER = pow(2,NBITS)
-
-def loaddata(srcfiles):
-    datasamples = {
-        "IMU1": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[0])),
-        "IMU2": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[1])),
-        "IMU3": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[2]))
-    }
-    imuids = []
-    for key in datasamples:
-        df = datasamples[key]
-        imuids.append(df.iloc[0,0])
-        df.columns = COLNAMES
-        df["TSTAMP"] = pd.to_datetime(df["TSTAMP"],format="%d:%m:%H:%M:%S:%f").dt.time
-    return datasamples, imuids
-
-def loaddata_convert(srcfiles):
-    datasamples = {
-        "IMU1": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[0])),
-        "IMU2": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[1])),
-        "IMU3": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[2]))
-    }
-    dataready = {}
-    for key in datasamples:
-        df = datasamples[key]
-        df.columns = COLNAMES
-        #drop empty
-        df = df[df.CHECK != MISSING]
-        df = df[COLNAMESMIN]
-        for col in range(0,3):
-            df.iloc[:, col] = df.iloc[:, col].apply(lambda x: convert(x))
-        for col in COLSIG:
-            df[col] = df[col].apply(lambda x: quatconvert(convert(x)))
-        #df.apply(lambda x: quatconvert(convert(x)) if x.name in COLSIG else x)
-        df["TSTAMP"] = pd.to_datetime(df["TSTAMP"],format="%d:%m:%H:%M:%S:%f").dt.time
-        dataready[key] = df
-    return dataready
-
-#int from [hex]
-def convert(s):
-    ss = str(s)
-    return int(ss[1:3],16)
-
-def quatconvert(x):
-    if x > 127 and x != np.nan:
-        x -= 256
-    x /= 127
-    return x
-
-def appendreadingstofile(fnames, nreads, dataout):
-	fps = []
-	for name in fnames:
-		fout = open(DATA_PATH.joinpath(name), "a")
-		fps.append(fout)
-	for datalist in dataout:
-		for index, imudata in enumerate(datalist):
-			strout = ",".join(imudata)
-			fps[index].write(strout+"\n")
-	for fp in fps:
-		fp.close()
-#	except:
-#		print("Error somewhere :(")
-
+# run from anywhere, the imu package lives at the repository root
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from imu.replay import Recording, Replay, replay, nowtstamp, MINSPEED, MAXSPEED
+from imu.align import SAMPLINGRATE
 
-#main 
+OUTPUT = "replay.txt"
+PATIENT = "{patient}"
+IMU = "{imu}"
+REPORT = 10 #seconds between two progress lines
 
-## sample data
-# fnamesin = ["s03_1.csv", "s03_2.csv", "s03_3.csv"]
-fnamesin = sys.argv[1:4]
-# fnamesout = ["imu_1.csv", "imu_2.csv", "imu_3.csv"]
-fnamesout = sys.argv[4:8]
 
-datain, imus = loaddata(fnamesin)
-#minimum internal counter from IMUS
-minCounters = []
-maxCounters = []
-for imu in datain.values():
-	minCounters.append(imu["NTH"].min())
-	maxCounters.append(imu["NTH"].max())
-minTick = min(minCounters)
-maxTick = max(maxCounters)
+def outputnames(pattern, patients, imuids):
+    """
+    Output files of every patient: pattern with {patient} and {imu} filled
+    in, one file per imu if {imu} is in the pattern, one for all otherwise
+    """
+    if patients > 1 and PATIENT not in pattern:
+        path = pathlib.Path(pattern)
+        pattern = str(path.with_name(path.stem + "_" + PATIENT + path.suffix))
+    names = []
+    for patient in range(1, patients + 1):
+        if IMU in pattern:
+            names.append([pattern.format(patient=patient, imu=imuid) for imuid in imuids])
+        else:
+            names.append([pattern.format(patient=patient)])
+    return names
 
-fakedata = []
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="Replay recorded imu sessions as live logs")
+    parser.add_argument("inputs", nargs="+", help="recorded log, or one file per imu")
+    parser.add_argument("--out", default=OUTPUT, help="output file, {imu} for one file per imu (e.g. imu{imu}.csv), "
+                        "{patient} for the patient number")
+    parser.add_argument("--speed", type=float, default=1, help=f"times faster than real time, {MINSPEED} to {MAXSPEED}")
+    parser.add_argument("--patients", type=int, default=1, help="sessions written at the same time, each from a random sample")
+    parser.add_argument("--loop", action="store_true", help="start over at the end of the recording")
+    parser.add_argument("--duration", type=float, help="seconds of recorded time to write")
+    parser.add_argument("--append", action="store_true", help="append to existing outputs")
+    parser.add_argument("--seed", type=int, help="seed of the random first samples")
+    args = parser.parse_args(argv[1:])
+    if not MINSPEED <= args.speed <= MAXSPEED:
+        parser.error(f"speed out of {MINSPEED}..{MAXSPEED}")
 
-#counter = random.randint(minTick, maxTick)
-counter = random.randint(int(minTick[1:3], 16), int(maxTick[1:3],16))
-# the first reading is from IMU1 .. arbitrary
-counter16 = hex(counter % RESETCOUNTER).upper()[2:]
-scounter16 = "[" + counter16 + "]"
-# get first value from IMU1
-df = datain["IMU1"]
-imuid = df.iloc[0,0]
-values = df[df.NTH == scounter16][COLDATA]
-timedev = values.iloc[0]["TSTAMP"]
-dt = datetime.combine(datetime.today(), timedev)
-dtbefore = (dt - timedelta(milliseconds=DELTASAMESIG)).time()
-dtafter = (dt + timedelta(milliseconds=DELTASAMESIG)).time()
-print("starting at " + scounter16 + " with " + str(df.loc[0, COLSIG].tolist()))
-while True:
-	counter16 = hex(counter).upper()[2:]
-	counter16 = str(counter16).zfill(2)
-	scounter16 = "[" + counter16 + "]"
-	sigvalues = []
-	# get first value from IMU1
-	for imu in datain.keys():
-		dfx = datain[imu]
-		values = dfx[(dfx.NTH == scounter16) & (dfx.TSTAMP >= dtbefore) & (dfx.TSTAMP <= dtafter)]
-		if len(values) == 1:
-			realdata = values.iloc[0].tolist()
-			realdatanotime = realdata[:-1]
-			print(scounter16 + " IN " + imu, dtbefore, dtafter)
-			#adjust time frame
-			timedev = values.iloc[0]["TSTAMP"]
-			dt = datetime.combine(datetime.today(), timedev)
-			dtbefore = (dt - timedelta(milliseconds=DELTASAMESIG)).time()
-			dtafter = (dt + timedelta(milliseconds=DELTASAMESIG)).time()
-		else:
-			realdatanotime = [imuid]
-			realdatanotime.extend(EMPTYDATA)
-			print(scounter16 + " NOT IN " + imu, dtbefore, dtafter)
-		fakesignals = realdatanotime
-		ctime = datetime.now().strftime("%d:%m:%H:%M:%S:%f")[:-3]
-		fakesignals.append(ctime)
-#		print(fakesignals)
-		sigvalues.append(fakesignals)
-	fakedata.append(sigvalues)
-	#append to files
-	if counter % DUMPFREQ == 0:
-		appendreadingstofile(fnamesout, DUMPFREQ, fakedata[-DUMPFREQ:])
-	counter += 1
-	counter = counter % RESETCOUNTER
+    recording = Recording.load(args.inputs)
+    print("Loaded", len(recording.readings), "readings of imus", recording.imuids, "-",
+          recording.nsamples / SAMPLINGRATE, "seconds")
+    rng = random.Random(args.seed)
+    mode = "ab" if args.append else "wb"
+    handles = []
+    replays = []
+    tstamp = nowtstamp()
+    try:
+        for patient, names in enumerate(outputnames(args.out, args.patients, recording.imuids)):
+            outputs = [open(name, mode) for name in names]
+            handles.extend(outputs)
+            # the first patient from the first sample, the others from anywhere
+            start = rng.randrange(recording.nsamples) if patient > 0 else 0
+            replays.append(Replay(recording, outputs, start, args.loop, tstamp))
+            print("Patient", patient + 1, "from sample", start, "to", ", ".join(names))
+        reported = [time.monotonic()]
+        def progress(due):
+            if time.monotonic() - reported[0] >= REPORT:
+                reported[0] = time.monotonic()
+                print("Written", due / SAMPLINGRATE, "seconds,", sum(r.lines for r in replays), "lines", flush=True)
+        ticks = replay(replays, args.speed, args.duration, progress)
+        print("Done,", ticks / SAMPLINGRATE, "seconds of recorded time,", sum(r.lines for r in replays), "lines")
+    except KeyboardInterrupt:
+        print("Stopped,", sum(r.lines for r in replays), "lines")
+    finally:
+        for fout in handles:
+            fout.close()
 
-	time.sleep(1)
+if __name__ == "__main__":
+    main(sys.argv)
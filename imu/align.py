@@ -1,8 +1,11 @@
 import pandas as pd
 import numpy as np
-import sys
-#import time
-from datetime import datetime, time, timedelta
+import os
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from calendar import isleap
+from datetime import timedelta
 
 SEC_IN_MIN = 60
 MIN_IN_HR = 60
@@ -36,6 +39,31 @@ OFFSET = len(PLOTCOLS)
 BATTERY_LAB = "BAT"
 NSIGXIMU = 4
 
+# fixed width layout of a data line: [XX],[XX],...,[XX],dd:mm:HH:MM:SS:fff
+FIELDWIDTH = len("[XX],")
+TSTAMP_START = FIELDWIDTH * BYTE_TIMESTAMP
+TSTAMP_LEN = len("dd:mm:HH:MM:SS:fff")
+LINEWIDTH = TSTAMP_START + TSTAMP_LEN
+NEWLINE = ord("\n")
+MINCHUNK = pow(2,22) #bytes, smaller logs are not worth a process pool
+QSCALE = 127
+# timestamps carry no year, sessions are placed from this one on, see calendaryear
+TSYEAR = 2000
+MS_IN_SEC = 1000
+NOTSTAMP = -1
+EPOCH = "epoch" #dataframe attrs key of the session epoch
+# one decoded reading, the payload is kept as the raw signed bytes and the
+# timestamp as ms since TSYEAR-01-01
+RAWDTYPE = np.dtype([("IMUID", np.uint8), ("BATTERY", np.uint8), ("CHECK", np.uint8),
+                     ("NTH", np.uint8), ("Q", np.int8, (NSIGXIMU,)),
+                     ("TSTAMP", np.int64)])
+# ascii code -> value of the hex digit, -1 if not a hex digit
+HEXLUT = np.full(256, -1, dtype=np.int16)
+HEXLUT[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEXLUT[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+HEXLUT[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+HEXCHARS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
 #int from [hex]
 def convert(s):
     ss = str(s)
@@ -61,173 +89,563 @@ def colnameimudata(id):
         coln.append(str(id).zfill(2) + SEP_LAB + str(i+1))
     return coln
 
+def calendaryear(firstmonth, leap):
+    """
+    Year the first timestamps of a session are placed in, the first one
+    from TSYEAR whose February fits the log: a leap one only if a 29:02
+    stamp was logged. Stamps of an earlier month than the first one are in
+    the following year.
+    :params firstmonth: month of the first timestamp of the session
+    :params leap: whether the session has any 29:02 timestamp
+    """
+    year = TSYEAR
+    # the February the session may cross
+    while isleap(year if firstmonth <= 2 else year + 1) != leap:
+        year += 1
+    return year
+
+def tstampcalendar(buf, start=None, end=None):
+    """
+    Calendar of the year-less timestamps of a log, worked out once so that
+    all its chunks are decoded alike, see parsetstamps
+    :params buf: log content (bytes, mmap)
+    :params start: offset of the data section, defaults to datastart(buf)
+    :params end: offset past the last byte to look at, defaults to len(buf)
+    :returns: (month of the first data line, True if any 29:02 stamp), None without data lines
+    """
+    if start is None:
+        start = datastart(buf)
+    if end is None:
+        end = len(buf)
+    pos = start
+    while pos < end:
+        eol = buf.find(b"\n", pos, end)
+        eol = end if eol < 0 else eol
+        if eol - pos >= LINEWIDTH and buf[pos:pos+1] == DATALINE.encode():
+            month = int(buf[pos + TSTAMP_START + 3:pos + TSTAMP_START + 5])
+            leap = buf.find(("]" + SEP + "29:02:").encode(), start, end) >= 0
+            return month, leap
+        pos = eol + 1
+    return None
+
+def parsetstamps(chars, calendar=None):
+    """
+    Vectorized parse of dd:mm:HH:MM:SS:fff timestamps, days and months
+    included so that sessions can run past midnight. Stamps carry no year:
+    they are resolved against the first one of the session, a month before
+    its month being in the following year, see calendaryear.
+    :params chars: uint8 (n, TSTAMP_LEN) array of ascii characters, or
+        array-like of timestamp strings
+    :params calendar: (first month, leap) of the session, see tstampcalendar,
+        by default worked out from chars
+    :returns: int64 array of ms since TSYEAR-01-01
+    """
+    if not (isinstance(chars, np.ndarray) and chars.dtype == np.uint8):
+        chars = np.asarray(chars, dtype="S" + str(TSTAMP_LEN))
+        chars = chars.view(np.uint8).reshape(-1, TSTAMP_LEN)
+    digits = chars.astype(np.int64) - ord("0")
+    def field(pos, ndigits):
+        value = digits[:, pos]
+        for i in range(1, ndigits):
+            value = value * 10 + digits[:, pos + i]
+        return value
+    day = field(0, 2)
+    month = field(3, 2)
+    if calendar is None:
+        calendar = (int(month[0]) if len(month) else 1, bool(((day == 29) & (month == 2)).any()))
+    firstmonth, leap = calendar
+    year = calendaryear(firstmonth, leap) + (month < firstmonth)
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    days = (months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+            - np.datetime64(str(TSYEAR) + "-01-01", "D")).astype(np.int64)
+    seconds = ((days * HR_IN_DAY + field(6, 2)) * MIN_IN_HR + field(9, 2)) * SEC_IN_MIN + field(12, 2)
+    return seconds * MS_IN_SEC + field(15, 3)
+
+def formattstamps(ms, epoch=0):
+    # ms since epoch -> dd:mm:HH:MM:SS:fff strings, NOTSTAMP -> 0
+    ms = np.asarray(ms, dtype=np.int64)
+    chars = np.ascontiguousarray(tstampchars(ms + epoch))
+    strs = chars.view("S" + str(TSTAMP_LEN)).ravel().astype("U" + str(TSTAMP_LEN)).astype(object)
+    strs[ms == NOTSTAMP] = 0
+    return strs
+
+def firstepoch(indices, readings, startCounter):
+    # session epoch: timestamp of the first aligned row
+    return min(int(imudata["TSTAMP"][0]) for idx, imudata in zip(indices, readings)
+               if len(idx) > 0 and idx[0] == startCounter)
+
+def unwrapcounters(nth, after):
+    """
+    Absolute sample index of consecutive readings of one IMU: every reading
+    takes the first index after the previous one whose value modulo
+    RESETCOUNTER is its NTH counter
+    :params nth: array of NTH counters, in arrival order
+    :params after: absolute index preceding the first reading
+    :returns: int64 array of strictly increasing indices
+    """
+    nth = nth.astype(np.int64)
+    prev = np.concatenate(([after], nth[:-1]))
+    steps = (nth - prev - 1) % RESETCOUNTER + 1
+    return after + np.cumsum(steps)
+
+def alignedrows(indices, readings, lo, hi, epoch=0, before=NOTSTAMP):
+    """
+    Scatter per-IMU readings into aligned rows for sample indices lo..hi-1,
+    the payloads kept as the raw bytes
+    :params indices: per IMU absolute sample indices, see unwrapcounters
+    :params readings: per IMU RAWDTYPE arrays matching indices
+    :params epoch: session epoch, TSTAMP is in ms since epoch
+    :params before: TSTAMP of row lo-1, when aligning block by block
+    :returns: int64 (rows,) TSTAMP, uint8 (rows, imus) battery, int8
+              (rows, imus, NSIGXIMU) quaternions, boolean (rows, imus) mask
+              of collected samples
+    """
+    n = max(hi - lo, 0)
+    nimus = len(readings)
+    battery = np.zeros((n, nimus), dtype=np.uint8)
+    q = np.zeros((n, nimus, NSIGXIMU), dtype=np.int8)
+    present = np.zeros((n, nimus), dtype=bool)
+    tstamp = np.full(n, NOTSTAMP, dtype=np.int64)
+    for j in range(nimus):
+        first, last = np.searchsorted(indices[j], [lo, hi])
+        rows = indices[j][first:last] - lo
+        imudata = readings[j][first:last]
+        battery[rows, j] = imudata["BATTERY"]
+        q[rows, j] = imudata["Q"]
+        present[rows, j] = True
+        # the earliest timestamp among the imus is the one of the row
+        ts = imudata["TSTAMP"] - epoch
+        current = tstamp[rows]
+        tstamp[rows] = np.where((current == NOTSTAMP) | (ts < current), ts, current)
+    return filltstamps(tstamp, before), battery, q, present
+
+def alignedframe(imuids, indices, readings, lo, hi, epoch=0, before=NOTSTAMP):
+    """
+    Scatter per-IMU readings into the aligned layout for sample indices lo..hi-1
+    :params imuids: ids of the IMUs, in column order
+    :params indices: per IMU absolute sample indices, see unwrapcounters
+    :params readings: per IMU RAWDTYPE arrays matching indices
+    :params epoch: session epoch, TSTAMP is in ms since epoch
+    :params before: TSTAMP of row lo-1, when aligning block by block
+    :returns: aligned dataframe, boolean (hi-lo, len(imuids)) mask of collected samples
+    """
+    tstamp, battery, q, present = alignedrows(indices, readings, lo, hi, epoch, before)
+    values = np.full((len(tstamp), len(imuids)*NUM_DATACOL), np.nan)
+    cnames = []
+    for j, imuid in enumerate(imuids):
+        cnames.extend(colnameimudata(imuid))
+        rows = present[:, j]
+        values[rows, j*NUM_DATACOL] = battery[rows, j]
+        values[rows, j*NUM_DATACOL+1:(j+1)*NUM_DATACOL] = q[rows, j] / QSCALE
+    df = pd.DataFrame(values, columns=cnames)
+    df.insert(0, PLOTCOLS[1], np.arange(lo, hi) % RESETCOUNTER)
+    df.insert(0, PLOTCOLS[0], tstamp)
+    return df, present
+
+def filltstamps(tstamp, before=NOTSTAMP):
+    """
+    Estimate the timestamps of the rows where no imu was collected from the
+    closest collected row before them (after them at the beginning), one
+    sampling period per row
+    :params tstamp: int64 array, NOTSTAMP where nothing was collected
+    :params before: timestamp of the row preceding the array, if any
+    :returns: int64 array, NOTSTAMP only if nothing was collected at all
+    """
+    if before != NOTSTAMP:
+        return filltstamps(np.concatenate(([before], tstamp)))[1:]
+    stamped = tstamp != NOTSTAMP
+    if stamped.all() or not stamped.any():
+        return tstamp
+    rows = np.arange(len(tstamp))
+    previous = np.maximum.accumulate(np.where(stamped, rows, -1))
+    previous[previous < 0] = np.argmax(stamped)
+    return np.where(stamped, tstamp, tstamp[previous] + (rows - previous) * (MS_IN_SEC // SAMPLINGRATE))
+
+def frametstamps(df):
+    """
+    Turn the dd:mm:HH:MM:SS:fff TSTAMP column of an aligned dataframe saved
+    as csv into ms since the session epoch, in place
+    :params df: aligned dataframe, 0 or NaN TSTAMP for the empty rows
+    """
+    if PLOTCOLS[0] not in df.columns or pd.api.types.is_integer_dtype(df[PLOTCOLS[0]]):
+        return
+    strs = df[PLOTCOLS[0]].astype(str)
+    valid = (strs.str.len() == TSTAMP_LEN).to_numpy()
+    ms = np.full(len(df), NOTSTAMP, dtype=np.int64)
+    ms[valid] = parsetstamps(strs[valid].to_numpy())
+    epoch = int(ms[valid][0]) if valid.any() else 0
+    ms[valid] -= epoch
+    df[PLOTCOLS[0]] = filltstamps(ms)
+    df.attrs[EPOCH] = epoch
+
+def exportframe(df, epoch):
+    # aligned dataframe with dd:mm:HH:MM:SS:fff timestamps, as saved in csv
+    if PLOTCOLS[0] not in df.columns:
+        return df
+    return df.assign(**{PLOTCOLS[0]: formattstamps(df[PLOTCOLS[0]].to_numpy(), epoch)})
+
+@dataclass
+class AlignStats:
+    """
+    Data loss statistics of an aligned session, gathered block by block
+    from the collected samples mask while aligning
+    """
+    imuids: list
+    epoch: int = 0 #ms since TSYEAR-01-01 of the first row
+    total: int = 0
+    missing: np.ndarray = None #per imu
+    outof: np.ndarray = None #rows by number of missing imus, 0..len(imuids)
+    firstTS: int = None #ms since epoch of the first collected row
+    lastTS: int = None
+
+    def __post_init__(self):
+        if self.missing is None:
+            self.missing = np.zeros(len(self.imuids), dtype=np.int64)
+        if self.outof is None:
+            self.outof = np.zeros(len(self.imuids) + 1, dtype=np.int64)
+
+    @classmethod
+    def fromframe(cls, df, imuids):
+        # statistics of an already aligned dataframe, e.g. a saved csv
+        stats = cls(imuids, epoch=df.attrs.get(EPOCH, 0))
+        present = df[[colnameimudata(imu)[1] for imu in imuids]].notna().to_numpy()
+        tstamps = df[PLOTCOLS[0]].to_numpy() if PLOTCOLS[0] in df.columns else None
+        stats.add(present, tstamps)
+        return stats
+
+    def add(self, present, tstamps=None):
+        """
+        Account for a block of aligned rows
+        :params present: boolean (rows, imus) mask of collected samples
+        :params tstamps: TSTAMP column of the block, ms since epoch
+        """
+        nmissing = len(self.imuids) - present.sum(axis=1)
+        self.total += len(present)
+        self.missing += len(present) - present.sum(axis=0)
+        self.outof += np.bincount(nmissing, minlength=len(self.imuids) + 1)
+        if tstamps is not None:
+            stamped = tstamps[nmissing < len(self.imuids)]
+            if len(stamped) > 0:
+                if self.firstTS is None:
+                    self.firstTS = int(stamped[0])
+                self.lastTS = int(stamped[-1])
+
+    @property
+    def nfill(self):
+        # single imu samples missing, including the ones of empty rows
+        return int(self.missing.sum())
+
+    @property
+    def empty(self):
+        return int(self.outof[-1])
+
+    @property
+    def full(self):
+        return int(self.outof[0])
+
+    def timediff(self):
+        # time between the first and the last collected row
+        if self.firstTS is None:
+            return timedelta(0)
+        return timedelta(milliseconds=self.lastTS - self.firstTS)
+
+    def todict(self):
+        # statistics as shown by the dashboard
+        datastats = {}
+        if self.firstTS is not None:
+            hours, remainder = divmod(self.timediff().total_seconds(), SEC_IN_HR)
+            minutes, seconds = divmod(remainder, SEC_IN_MIN)
+            datastats["timewindow"] = f"{int(hours)}hr {int(minutes)}min {int(seconds)}sec"
+        else:
+            datastats["timewindow"] = " -- "
+        imuids = [str(imu).zfill(2) for imu in self.imuids]
+        datastats["imuids"] = imuids
+        datastats["epoch"] = int(self.epoch)
+        datastats["start"] = formattstamps([self.epoch])[0]
+        for imu, num_miss in zip(imuids, self.missing.tolist()):
+            datastats[imu] = [num_miss, num_miss/self.total if self.total else 0]
+        datastats["num_imus"] = len(imuids)
+        datastats["total"] = self.total
+        datastats["empty"] = self.empty
+        datastats["full"] = self.full
+        datastats["nsamples"] = len(imuids) * self.total
+        datastats["stats"] = self.outof[:-1].tolist()
+        return datastats
+
+def payloadarray(rows, imuid):
+    # [ts, counter, battery, payload] rows -> RAWDTYPE array
+    readings = np.zeros(len(rows), dtype=RAWDTYPE)
+    if len(rows) == 0:
+        return readings
+    readings["IMUID"] = imuid
+    readings["TSTAMP"] = parsetstamps([row[0] for row in rows])
+    readings["NTH"] = [row[1] for row in rows]
+    readings["BATTERY"] = [row[2] for row in rows]
+    readings["Q"] = np.rint(np.array([row[3:] for row in rows], dtype=float) * QSCALE)
+    return readings
+
+def alignarrays(decoded, imuids):
+    """
+    Align the readings of the IMUs on their NTH counters, working on whole
+    arrays: each counter sequence is unwrapped into absolute sample indices
+    and the payloads are scattered in a single preallocated array.
+    Alignment starts from the lowest first counter and stops at the last
+    reading of the IMU that runs out of data first.
+    :params decoded: dict imuid -> RAWDTYPE array, see decodelogs
+    :params imuids: ids of the IMUs to align, in column order
+    :returns: aligned dataframe, AlignStats of the session
+    """
+    readings, indices, startCounter, endCounter, epoch = alignment(decoded, imuids)
+    df, present = alignedframe(imuids, indices, readings, startCounter, endCounter, epoch or 0)
+    if epoch is None:
+        return df, AlignStats(imuids)
+    df.attrs[EPOCH] = epoch
+    stats = AlignStats(imuids, epoch)
+    stats.add(present, df[PLOTCOLS[0]].to_numpy())
+    return df, stats
+
+def alignment(decoded, imuids):
+    """
+    Sample indices of the readings of a session, see alignarrays
+    :params decoded: dict imuid -> RAWDTYPE array, see decodelogs
+    :params imuids: ids of the IMUs to align, in column order
+    :returns: per IMU RAWDTYPE arrays, per IMU absolute sample indices, first
+              and past the last index aligned, session epoch; no index and
+              a None epoch if an IMU has no readings
+    """
+    readings = [decoded.get(imuid, np.empty(0, dtype=RAWDTYPE)) for imuid in imuids]
+    if any(len(imudata) == 0 for imudata in readings):
+        return readings, [np.empty(0, dtype=np.int64) for imudata in readings], 0, 0, None
+    startCounter = min(int(imudata["NTH"][0]) for imudata in readings)
+    indices = [unwrapcounters(imudata["NTH"], startCounter-1) for imudata in readings]
+    endCounter = min(int(idx[-1]) for idx in indices) + 1
+    return readings, indices, startCounter, endCounter, firstepoch(indices, readings, startCounter)
+
+def findimus(decoded):
+    # ids of the sensors found in the data, DISCARD ids excluded
+    discard = [convert(x) for x in DISCARD]
+    return sorted(imuid for imuid in decoded if imuid not in discard)
+
 def align(payloads, num_imus):
     imus = [x+1 for x in range(num_imus)]
-    cnames = ["TSTAMP", "COUNTER"]
+    decoded = {}
     for id in imus:
-        cnames.extend(colnameimudata(str(id).zfill(2)))
-    nFields = len(cnames)
-    #print(cnames)
-    #[ts, counter, battery, payload]
+        decoded[id] = payloadarray(payloads[id], id)
+    df, stats = alignarrays(decoded, imus)
+    return df, stats.outof.tolist(), stats.total, stats.timediff()
+
+
+def datastart(buf):
+    """
+    Offset of the first data line, i.e. the first line starting with DATALINE
+    :params buf: bytes-like log content (bytes, mmap)
+    :returns: offset in bytes, len(buf) if there is no data line
+    """
+    if buf[:1] == DATALINE.encode():
+        return 0
+    pos = buf.find(("\n" + DATALINE).encode())
+    if pos < 0:
+        return len(buf)
+    return pos + 1
+
+def decodelogs(buf, start=None, end=None, calendar=None):
+    """
+    Decode the data lines of a log as a whole, without a per-line loop.
+    Every [XX] field is at a fixed offset from the start of its line, hex
+    digits are translated through HEXLUT and readings with a BLANK check
+    byte are dropped with a mask.
+    :params buf: log content (str, bytes, mmap)
+    :params start: offset of the first byte to decode, defaults to datastart(buf)
+    :params end: offset past the last byte to decode, defaults to len(buf)
+    :params calendar: calendar of the timestamps of the whole log when decoding
+        a chunk, see tstampcalendar, by default the one of the decoded lines
+    :returns: dict imuid -> RAWDTYPE array, readings in file order
+    """
+    if isinstance(buf, str):
+        buf = buf.encode()
+    if start is None:
+        start = datastart(buf)
+    if end is None:
+        end = len(buf)
+    raw = np.frombuffer(buf, dtype=np.uint8, count=max(end - start, 0), offset=start)
+    nl = np.flatnonzero(raw == NEWLINE)
+    starts = np.concatenate(([0], nl + 1))
+    ends = np.append(nl, len(raw))
+    # blank, truncated and non data lines
+    keep = (ends - starts) >= LINEWIDTH
+    starts = starts[keep]
+    keep = raw[starts] == ord(DATALINE)
+    starts = starts[keep]
+
+    hexpos = starts[:, None] + (np.arange(BYTE_TIMESTAMP) * FIELDWIDTH + 1)
+    values = HEXLUT[raw[hexpos]] * 16 + HEXLUT[raw[hexpos + 1]]
+    valid = (values >= 0).all(axis=1) & (values[:, BYTE_CHECK] != int(BLANK, 16))
+    values = values[valid]
+    starts = starts[valid]
+
+    readings = np.empty(len(starts), dtype=RAWDTYPE)
+    readings["IMUID"] = values[:, BYTE_IMUID]
+    readings["BATTERY"] = values[:, BYTE_BATTERY]
+    readings["CHECK"] = values[:, BYTE_CHECK]
+    readings["NTH"] = values[:, BYTE_COUNTER]
+    readings["Q"] = values[:, BYTE_PAYLOAD_START:BYTE_PAYLOAD_END+1].astype(np.uint8).view(np.int8)
+    tspos = starts[:, None] + (TSTAMP_START + np.arange(TSTAMP_LEN))
+    readings["TSTAMP"] = parsetstamps(raw[tspos], calendar)
 
-    readings = []
-    keys = []
+    datain = {}
+    for imuid in np.unique(readings["IMUID"]):
+        datain[int(imuid)] = readings[readings["IMUID"] == imuid]
+    return datain
+
+def tstampchars(ms):
+    # ms since TSYEAR-01-01 -> uint8 (n, TSTAMP_LEN) dd:mm:HH:MM:SS:fff characters, see parsetstamps
+    when = np.datetime64(str(TSYEAR) + "-01-01", "ms") + np.asarray(ms, dtype=np.int64).astype("timedelta64[ms]")
+    days = when.astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    msofday = (when - days).astype(np.int64)
+    fields = [(days - months.astype("datetime64[D]")).astype(np.int64) + 1,
+              (months - months.astype("datetime64[Y]")).astype(np.int64) + 1,
+              msofday // (SEC_IN_HR * MS_IN_SEC), msofday // (SEC_IN_MIN * MS_IN_SEC) % MIN_IN_HR,
+              msofday // MS_IN_SEC % SEC_IN_MIN]
+    chars = np.full((len(msofday), TSTAMP_LEN), ord(":"), dtype=np.uint8)
+    for i, value in enumerate(fields):
+        chars[:, 3*i] = ord("0") + value // 10
+        chars[:, 3*i+1] = ord("0") + value % 10
+    millis = msofday % MS_IN_SEC
+    chars[:, -3] = ord("0") + millis // 100
+    chars[:, -2] = ord("0") + millis // 10 % 10
+    chars[:, -1] = ord("0") + millis % 10
+    return chars
+
+def encodelogs(readings):
+    """
+    Data lines of readings in the log format, the inverse of decodelogs
+    :params readings: RAWDTYPE array, written in the given order
+    :returns: bytes, LINEWIDTH characters and a newline per reading
+    """
+    n = len(readings)
+    fields = np.empty((n, BYTE_TIMESTAMP), dtype=np.uint8)
+    fields[:, BYTE_IMUID] = readings["IMUID"]
+    fields[:, BYTE_BATTERY] = readings["BATTERY"]
+    fields[:, BYTE_CHECK] = readings["CHECK"]
+    fields[:, BYTE_COUNTER] = readings["NTH"]
+    fields[:, BYTE_PAYLOAD_START:BYTE_PAYLOAD_END+1] = readings["Q"].view(np.uint8)
+    lines = np.empty((n, LINEWIDTH + 1), dtype=np.uint8)
+    fieldchars = lines[:, :TSTAMP_START].reshape(n, BYTE_TIMESTAMP, FIELDWIDTH)
+    fieldchars[:, :, 0] = ord(DATALINE)
+    fieldchars[:, :, 1] = HEXCHARS[fields >> 4]
+    fieldchars[:, :, 2] = HEXCHARS[fields & 15]
+    fieldchars[:, :, 3] = ord("]")
+    fieldchars[:, :, 4] = ord(SEP)
+    lines[:, TSTAMP_START:LINEWIDTH] = tstampchars(readings["TSTAMP"])
+    lines[:, LINEWIDTH] = NEWLINE
+    return lines.tobytes()
+
+def chunkranges(buf, nchunks, start=None):
+    """
+    Split the data section of a log into byte ranges ending on line boundaries
+    :params buf: log content (bytes, mmap)
+    :params nchunks: number of ranges to aim for
+    :params start: offset of the data section, defaults to datastart(buf)
+    :returns: list of (start, end) offsets, in file order
+    """
+    if start is None:
+        start = datastart(buf)
+    size = len(buf) - start
+    nchunks = max(1, min(nchunks, size // MINCHUNK))
+    ranges = []
+    for i in range(1, nchunks):
+        end = buf.find(b"\n", start + size * i // nchunks)
+        if end < 0:
+            break
+        end += 1
+        if ranges and end <= ranges[-1][1]:
+            continue
+        ranges.append((ranges[-1][1] if ranges else start, end))
+    ranges.append((ranges[-1][1] if ranges else start, len(buf)))
+    return ranges
+
+def mergedecoded(parts):
+    # per chunk decoded dicts -> one dict, chunks concatenated in order
+    datain = {}
+    for part in parts:
+        for imuid, readings in part.items():
+            datain.setdefault(imuid, []).append(readings)
+    for imuid in datain:
+        datain[imuid] = np.concatenate(datain[imuid])
+    return datain
+
+def decodefilerange(fnamein, start, end, calendar=None):
+    # worker side of loadlogs, returns compact RAWDTYPE arrays only
+    with open(fnamein, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            datain = decodelogs(buf, start, end, calendar)
+    return datain
+
+def loadlogs(fnamein, nworkers=1):
+    """
+    Decode a log file, see decodelogs
+    :params fnamein: name of the log file
+    :params nworkers: number of processes parsing the file, None for all cores
+    :returns: dict imuid -> RAWDTYPE array
+    """
+    with open(fnamein, "rb") as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            nworkers = nworkers or os.cpu_count()
+            ranges = chunkranges(buf, nworkers)
+            if len(ranges) == 1:
+                return decodelogs(buf, *ranges[0])
+            calendar = tstampcalendar(buf, ranges[0][0])
+    # each worker maps the file on its own, only offsets are sent out
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        parts = list(pool.map(decodefilerange, [fnamein]*len(ranges),
+                              [r[0] for r in ranges], [r[1] for r in ranges], [calendar]*len(ranges)))
+    return mergedecoded(parts)
+
+def decodelogs_parallel(buf, nworkers=None):
+    """
+    Decode in-memory log content with a process pool, see decodelogs
+    :params buf: log content (str, bytes)
+    :params nworkers: number of processes, None for all cores
+    :returns: dict imuid -> RAWDTYPE array
+    """
+    if isinstance(buf, str):
+        buf = buf.encode()
+    nworkers = nworkers or os.cpu_count()
+    ranges = chunkranges(buf, nworkers)
+    if len(ranges) == 1:
+        return decodelogs(buf, *ranges[0])
+    calendar = tstampcalendar(buf, ranges[0][0])
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        parts = list(pool.map(decodelogs, [buf[s:e] for s, e in ranges],
+                              [0]*len(ranges), [None]*len(ranges), [calendar]*len(ranges)))
+    return mergedecoded(parts)
+
+def payloadrows(readings):
+    # RAWDTYPE array -> [ts, counter, battery, payload] rows
+    q = readings["Q"] / QSCALE
+    # filled column-wise, tolist then builds the rows without a python loop
+    rows = np.empty((len(readings), 3 + q.shape[1]), dtype=object)
+    rows[:, 0] = formattstamps(readings["TSTAMP"])
+    rows[:, 1] = readings["NTH"]
+    rows[:, 2] = readings["BATTERY"]
+    rows[:, 3:] = q
+    return rows.tolist()
+
+def payloadlists(decoded, num_imus):
+    datain = {}
     for i in range(num_imus):
-        keys.append(i+1)
-        readings.append(payloads[i+1])
-
-    firstData = []
-    lenData = []
-    for imuid in range(num_imus):
-        imudata = readings[i]
-        lenData.append(len(imudata))
-        firstData.append([imudata[0][0], imudata[0][1]])
-    firstData_sorted = sorted(firstData, key=lambda x: x[1])
-    firstTS = firstData_sorted[0][0]
-    firstTS = firstTS[6:]
-    startCounter = firstData_sorted[0][1]
-    counter = startCounter
-    nmiss = 0
-    nfill = 0
-    nmisscounter = 0
-    noutof = [0]*num_imus
-    # while you have data in one of the num_imus queues
-#    print("... aligning samples")
-    df = pd.DataFrame(columns=cnames)
-    idxs = [0]*num_imus
-    ns = 0
-    while idxs[0] < lenData[0] and idxs[1] < lenData[1] and idxs[2] < lenData[2]:
-        row = []
-        ts = []    
-        counternsamp = 0
-        for imui, imudata in enumerate(readings):
-            rowimu = imudata[idxs[imui]]
-             #[ts, counter, battery, payload]
-            nth = (counter % RESETCOUNTER)
-            if rowimu[1] == nth:
-                ts.append(rowimu[0])
-                row.extend(rowimu[2:])
-                idxs[imui] += 1
-                counternsamp += 1
-            else:
-                row.extend([np.nan]*NUM_DATACOL)
-                nfill += 1
-        if counternsamp >= 1:
-            minTS = min(ts)
-            finalrow = [minTS, nth]
-            finalrow.extend(row)
-        else:
-            nmiss += 1
-            finalrow = [np.nan]*(nFields-2)
-            finalrow.insert(0, nth)
-            finalrow.insert(0, 0)
-        noutof[num_imus-countensamp] += 1
-        df.loc[ns] = finalrow
-        counter += 1
-        ns += 1
-    lastTS = minTS[6:]
-    start_time = datetime.strptime(firstTS, TIME_FORMAT)
-    end_time = datetime.strptime(lastTS, TIME_FORMAT)
-    time_diff = end_time - start_time
-    return df, noutof, ns, time_diff
-
-
-def loaddata_convert(fnamein, num_imus):
-#   print("... loading data ")
-   fin = open(fnamein, "r")
-   txt = fin.read().strip().split("\n")
-   fin.close()
-
-   datain = {}
-   for i in range(num_imus):
-       datain[i+1] = []
-       
-   i = 0
-   nlines = len(txt)
-   while i < nlines:
-      if len(txt[i]) > 0:
-         if txt[i][0] == DATALINE:
-             break
-      i += 1
-   
-   #line = txt[i]
-   #data line, possibly the one with ID 04
-   #if line[0:4] in DISCARD:
-   #   i += 1      
-   firstDataRow = i
-   firstReading = txt[i]
-   firstTS = firstReading.strip().split(SEP)[-1]
-   #normal data lines
-   while i < nlines:
-      line = txt[i]
-      line = line.replace("[", "").replace("]", "")
-      items = line.split(SEP)
-      # ["IMUID", "BATTERY","CHECK","NTH","1","2","3","4","TSTAMP"]
-      row = []
-      if items[BYTE_CHECK] != BLANK:
-          imuid = int(items[BYTE_IMUID], 16)
-          battery = int(items[BYTE_BATTERY], 16)
-          counter = int(items[BYTE_COUNTER], 16)
-          payload = []
-          for bp in range(BYTE_PAYLOAD_START, BYTE_PAYLOAD_END+1):
-              payload.append(quatconvert(int(items[bp], 16)))
-          ts = items[BYTE_TIMESTAMP]
-          row = [ts, counter, battery]
-          row.extend(payload)
-          if imuid in datain:
-             datain[imuid].append(row)
-          else:
-             datain[imuid] = [row]
-      i += 1
-
-   lastTS = ts
-   return datain
-
-def convertlogs(loadedtext, num_imus):
-   txt = loadedtext.strip().split("\n")
-   datain = {}
-   for i in range(num_imus):
-       datain[i+1] = []
-       
-   i = 0
-   nlines = len(txt)
-   while i < nlines:
-      if len(txt[i]) > 0:
-         if txt[i][0] == DATALINE:
-             break
-      i += 1
-   
-   #line = txt[i]
-   #data line, possibly the one with ID 04
-   #if line[0:4] in DISCARD:
-   #   i += 1      
-   firstDataRow = i
-   firstReading = txt[i]
-   firstTS = firstReading.strip().split(SEP)[-1]
-   #normal data lines
-   while i < nlines:
-      line = txt[i]
-      line = line.replace("[", "").replace("]", "")
-      items = line.split(SEP)
-      # ["IMUID", "BATTERY","CHECK","NTH","1","2","3","4","TSTAMP"]
-      row = []
-      if items[BYTE_CHECK] != BLANK:
-          imuid = int(items[BYTE_IMUID], 16)
-          battery = int(items[BYTE_BATTERY], 16)
-          counter = int(items[BYTE_COUNTER], 16)
-          payload = []
-          for bp in range(BYTE_PAYLOAD_START, BYTE_PAYLOAD_END+1):
-              payload.append(quatconvert(int(items[bp], 16)))
-          ts = items[BYTE_TIMESTAMP]
-          row = [ts, counter, battery]
-          row.extend(payload)
-          if imuid in datain:
-             datain[imuid].append(row)
-          else:
-             datain[imuid] = [row]
-      i += 1
-
-   lastTS = ts
-   return datain
+        datain[i+1] = []
+    for imuid, readings in decoded.items():
+        datain[imuid] = payloadrows(readings)
+    return datain
 
+def loaddata_convert(fnamein, num_imus, nworkers=1):
+    return payloadlists(loadlogs(fnamein, nworkers), num_imus)
 
+def convertlogs(loadedtext, num_imus, nworkers=1):
+    if nworkers == 1:
+        return payloadlists(decodelogs(loadedtext), num_imus)
+    return payloadlists(decodelogs_parallel(loadedtext, nworkers), num_imus)
@@ -1,9 +1,10 @@
-from datetime import datetime, time, timedelta
 import pandas as pd
 import numpy as np
+import os
 import pathlib
-import sys
-import json
+import threading
+
+from imu.align import RAWDTYPE, QSCALE, EPOCH, RESETCOUNTER, decodelogs, tstampcalendar, datastart, mergedecoded
 
 PATH = pathlib.Path(__name__).parent
 DATA_PATH = PATH.joinpath("data").resolve()
@@ -17,15 +18,18 @@ MISSING = "[FF]"
 IMUDATA_COL = ["BATTERY","1","2","3","4"]
 IMUDATA_LEN = len(IMUDATA_COL)
 #read from json in the future
-#let user associate from the UI in the future 
+#let user associate from the UI in the future
 IMUREF = "IMU3"
 IMUNAMES = {"01": "thorax", "02": "abdomen", "03": "reference"}
 READINGNAMES = {"1": "q1", "2": "q2", "3": "q3", "4": "q4"}
 BATTERY_LAB = "BAT"
 NSIG4IMU = 4
 NBITS = 8
-RESETCOUNTER = pow(2,NBITS)
-SAMPLES4SEC = 10 #samples per second 
+SAMPLES4SEC = 10 #samples per second
+MS_IN_SEC = 1000
+MS_IN_DAY = 24 * 60 * 60 * MS_IN_SEC
+MS_IN_SAMPLE = MS_IN_SEC // SAMPLES4SEC
+TOLERANCE = 2 #seconds, readings are looked for this far outside the window
 
 ELAB_FILE = DATA_PATH.joinpath("log.csv")
 IMUFILES = ["imu1.csv", "imu2.csv", "imu3.csv"]
@@ -34,31 +38,88 @@ IMUFILES = ["imu1.csv", "imu2.csv", "imu3.csv"]
 PLOTCOLS = ["TSTAMP", "COUNTER"]
 SEP = "_"
 
+
+class ImuSource:
+    """
+    Readings of one imu file kept in memory as a RAWDTYPE array sorted by
+    timestamp. The file is only read again when it changes: appended lines
+    are decoded on their own, anything else reloads it.
+    """
+
+    def __init__(self, fname):
+        self.fname = pathlib.Path(fname)
+        self.readings = np.empty(0, dtype=RAWDTYPE)
+        self.tstamps = self.readings["TSTAMP"]
+        self.signature = None
+        self.offset = 0
+        self.calendar = None
+        self.lock = threading.Lock()
+
+    @property
+    def imuid(self):
+        return int(self.readings["IMUID"][0]) if len(self.readings) > 0 else None
+
+    def refresh(self):
+        # reload or extend the readings if the file changed since last time
+        st = os.stat(self.fname)
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if signature == self.signature:
+                return self
+            appended = (self.signature is not None and st.st_ino == self.signature[0]
+                        and st.st_size >= self.offset)
+            with open(self.fname, "rb") as fin:
+                if appended:
+                    fin.seek(self.offset)
+                buf = fin.read()
+            # partial last line left for the next refresh
+            cut = buf.rfind(b"\n") + 1
+            start = 0 if appended else datastart(buf)
+            if not appended or self.calendar is None:
+                self.calendar = tstampcalendar(buf, min(start, cut), cut)
+            new = mergedecoded([decodelogs(buf, min(start, cut), cut, self.calendar)])
+            new = np.concatenate(list(new.values())) if new else np.empty(0, dtype=RAWDTYPE)
+            readings = np.concatenate((self.readings, new)) if appended else new
+            if (np.diff(readings["TSTAMP"]) < 0).any():
+                readings = readings[np.argsort(readings["TSTAMP"], kind="stable")]
+            self.readings = readings
+            self.tstamps = readings["TSTAMP"]
+            self.offset = (self.offset if appended else 0) + cut
+            self.signature = signature
+        return self
+
+    def window(self, first, last):
+        # readings with first <= TSTAMP <= last, a view on the sorted array
+        lo = np.searchsorted(self.tstamps, first, side="left")
+        hi = np.searchsorted(self.tstamps, last, side="right")
+        return self.readings[lo:hi]
+
+
+_sources = {}
+_sourceslock = threading.Lock()
+
+def imusources(srcfiles):
+    # one ImuSource per file, shared by all queries and up to date
+    sources = []
+    for fname in srcfiles:
+        path = DATA_PATH.joinpath(fname)
+        with _sourceslock:
+            source = _sources.setdefault(path, ImuSource(path))
+        sources.append(source.refresh())
+    return sources
+
 def loaddata_convert(srcfiles):
-    datasamples = {
-        "IMU1": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[0])),
-        "IMU2": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[1])),
-        "IMU3": pd.read_csv(
-            DATA_PATH.joinpath(srcfiles[2]))
-    }
     dataready = {}
     imuids = []
-    for key in datasamples:
-        df = datasamples[key]
-        df.columns = COLNAMES
-        imuids.append(convert(df.iloc[0,0]))
-        #drop empty
-        df = df[df.CHECK != MISSING]
-        df = df[COLNAMESMIN]
-        for col in range(0,3):
-            df.iloc[:, col] = df.iloc[:, col].apply(lambda x: convert(x))
-        for col in COLSIG:
-            df[col] = df[col].apply(lambda x: quatconvert(convert(x)))
-        #df.apply(lambda x: quatconvert(convert(x)) if x.name in COLSIG else x)
-        df["TSTAMP"] = pd.to_datetime(df["TSTAMP"],format="%d:%m:%H:%M:%S:%f").dt.time
-        dataready[key] = df
+    for i, source in enumerate(imusources(srcfiles)):
+        readings = source.readings
+        imuids.append(source.imuid)
+        df = pd.DataFrame({"IMUID": readings["IMUID"], "BATTERY": readings["BATTERY"],
+                           "NTH": readings["NTH"]})
+        for j, col in enumerate(COLSIG):
+            df[col] = readings["Q"][:, j] / QSCALE
+        df["TSTAMP"] = readings["TSTAMP"]
+        dataready["IMU" + str(i+1)] = df
     return dataready, imuids
 
 def colnamesplotdata(imuids):
@@ -86,73 +147,94 @@ def quatconvert(x):
     x /= 127
     return x
 
+def msofday(start, first, last):
+    """
+    Timestamp of a time of day within a session, in ms. A time earlier in the
+    day than the first reading is the next day's only if the session runs
+    past midnight up to it, otherwise it is clamped to the session start.
+    :params start: time of day
+    :params first: timestamp of the first reading of the session
+    :params last: timestamp of the last reading of the session
+    """
+    ms = ((start.hour * 60 + start.minute) * 60 + start.second) * MS_IN_SEC + start.microsecond // 1000
+    when = first - first % MS_IN_DAY + ms
+    if when < first:
+        when = when + MS_IN_DAY if when + MS_IN_DAY <= last else first
+    return when
+
+def sampleoffsets(readings, firstTS, firstCounter):
+    """
+    Sample offset of readings from the one with counter firstCounter at
+    firstTS: the offset congruent to the NTH counter modulo RESETCOUNTER
+    closest to the time elapsed, so that the counter wraps are told apart
+    """
+    wrapped = (readings["NTH"].astype(np.int64) - firstCounter) % RESETCOUNTER
+    elapsed = (readings["TSTAMP"] - firstTS) / MS_IN_SAMPLE
+    return wrapped + RESETCOUNTER * np.rint((elapsed - wrapped) / RESETCOUNTER).astype(np.int64)
+
 def get_imu_data(start, deltatime):
     """
-    Query imu data starting from a certain time stamp 
-    and collecting a certain amount of data corresponding 
+    Query imu data starting from a certain time stamp
+    and collecting a certain amount of data corresponding
     to some seconds
     :params start: start time
     :params deltatime: in seconds, such that deltatime * SAMPLES4SEC < RESETCOUNTER
     :returns: pandas dataframe object
     """
-    datain, imus = loaddata_convert(IMUFILES)
-#    print(datain)
-    dfref = datain[IMUREF]
-    minTS = dfref[(dfref.TSTAMP >= start)]["TSTAMP"].min()
-    ## POLICY
-    # + 2 for tolerance w.r.t. missing data
-    dt = datetime.combine(datetime.today(), minTS) + timedelta(seconds=deltatime+2)
-    maxTS = dt.time()
-    # collect data of interest in the specified window
-    firstimu = list(datain.keys())[0]
-    dftmp = datain[firstimu]
-    dftmp = dftmp[(dftmp.TSTAMP >= minTS) & (dftmp.TSTAMP <= maxTS)]
-    for imu in list(datain.keys())[1:]:
-        dfimu = datain[imu]
-        dftmp = pd.concat([dftmp, dfimu[(dfimu.TSTAMP >= minTS) & (dfimu.TSTAMP <= maxTS)]], ignore_index=True)
-    minCounter = dfref.loc[dfref.TSTAMP >= start,"NTH"].iloc[0]
+    sources = imusources(IMUFILES)
+    imus = [source.imuid for source in sources]
+    ref = sources[int(IMUREF[len("IMU"):]) - 1]
+    if len(ref.readings) == 0:
+        raise ValueError("No readings of the reference imu in " + str(ref.fname))
+    epoch = int(ref.tstamps[0])
+    start = msofday(start, epoch, int(ref.tstamps[-1]))
+    first = np.searchsorted(ref.tstamps, start, side="left")
+    if first == len(ref.tstamps):
+        raise ValueError("No readings of the reference imu after the start time")
+    minTS = int(ref.tstamps[first])
+    minCounter = int(ref.readings["NTH"][first])
     nsamples = deltatime * SAMPLES4SEC
-    selnth = [x % RESETCOUNTER for x in range(minCounter, minCounter+nsamples)]
-    #selorder = list(range(nsamples))
-    #d = dict(zip(selnth, selorder))
-    #dftmp["COUNTER"] = dftmp["NTH"].map(d)
-    #dftmp = dftmp.dropna()
-    #dftmp["COUNTER"].astype(int)
-    #print(dftmp)
-    # create resulting df
-    colnames = colnamesplotdata(imus)
-    df = pd.DataFrame(columns=colnames)
-    emptysample = [np.nan]*len(colnames)
-    prevsample = [np.nan]*IMUDATA_LEN*len(imus)
-    nfill = 0
-    nempty = 0
-    for it in selnth:
-        # get the info from the three imus
-        selrows = dftmp[dftmp.NTH == it]
-        row = [selrows["TSTAMP"].min(), it]
-        nok = 0
-        for imuid in imus:
-            valueimu = selrows[selrows.IMUID == imuid]
-            if len(valueimu) > 0:
-                imudata = list(valueimu[IMUDATA_COL].values[0])
-                prevsample[0+(imuid-1)*IMUDATA_LEN:0+imuid*IMUDATA_LEN] = imudata
-                nok += 1
-            else:
-                ## POLICY
-                # if one or more are missing, fill with previous
-                imudata = prevsample[0+(imuid-1)*IMUDATA_LEN:0+imuid*IMUDATA_LEN]
-                nfill += 1
-            row.extend(imudata)
-        ## POLICY
-        # if all are missing, use NAN
-        if nok == 0:
-            row = emptysample
-            nempty += 1
-            nfill -= 3
-        # store in new df
-        df.loc[len(df)] = row
+    ## POLICY
+    # tolerance w.r.t. missing data and clock jitter
+    maxTS = minTS + (deltatime+TOLERANCE) * MS_IN_SEC
+    # scatter the readings of interest on the sample grid
+    nimus = len(imus)
+    values = np.full((nsamples, nimus*IMUDATA_LEN), np.nan)
+    present = np.zeros((nsamples, nimus), dtype=bool)
+    tstamp = np.full(nsamples, np.inf)
+    for j, source in enumerate(sources):
+        readings = source.window(minTS - TOLERANCE * MS_IN_SEC, maxTS)
+        rows = sampleoffsets(readings, minTS, minCounter)
+        inside = (rows >= 0) & (rows < nsamples)
+        readings = readings[inside]
+        rows, keep = np.unique(rows[inside], return_index=True)
+        readings = readings[keep]
+        values[rows, j*IMUDATA_LEN] = readings["BATTERY"]
+        values[rows, j*IMUDATA_LEN+1:(j+1)*IMUDATA_LEN] = readings["Q"] / QSCALE
+        present[rows, j] = True
+        tstamp[rows] = np.minimum(tstamp[rows], readings["TSTAMP"])
+    ## POLICY
+    # if one or more are missing, fill with previous
+    samples = np.arange(nsamples)
+    for j in range(nimus):
+        previous = np.maximum.accumulate(np.where(present[:, j], samples, -1))
+        filled = previous >= 0
+        values[filled, j*IMUDATA_LEN:(j+1)*IMUDATA_LEN] = values[previous[filled], j*IMUDATA_LEN:(j+1)*IMUDATA_LEN]
+    ## POLICY
+    # if all are missing, use NAN
+    empty = ~present.any(axis=1)
+    values[empty] = np.nan
+    nempty = int(empty.sum())
+    nfill = int((~present[~empty]).sum())
+    df = pd.DataFrame(values, columns=colnamesplotdata(imus)[len(PLOTCOLS):])
+    counters = ((minCounter + samples) % RESETCOUNTER).astype(float)
+    counters[empty] = np.nan
+    df.insert(0, PLOTCOLS[1], counters)
+    # ms since the first reading of the reference imu
+    df.insert(0, PLOTCOLS[0], np.where(empty, np.nan, tstamp - epoch))
+    df.attrs[EPOCH] = epoch
     return df, minCounter, minCounter+nsamples, nfill, nempty
 
 #dt = datetime.now() - timedelta(seconds=10)
 #df, fromTH, toTH, nmiss, nempty = get_imu_data(dt.time(), 5)
-#print(df, "\n", fromTH, toTH, nmiss, nempty)
\ No newline at end of file
+#print(df, "\n", fromTH, toTH, nmiss, nempty)
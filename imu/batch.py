@@ -0,0 +1,185 @@
+import csv
+import glob
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+from imu.align import loadlogs, alignarrays, findimus, exportframe, frametstamps, AlignStats
+from imu.stream import StreamAligner, streamalign, firstimus
+from imu import cache
+from imu.compact import CompactSession, alignsession
+from imu.pyramid import buildpyramid, PyramidBuilder
+from imu.profile import Profile
+
+LOGEXT = ".txt"
+OUTEXT = ".csv"
+SUMMARY = "summary.csv"
+IMUELEM = "_1"
+SUMMARYCOLS = ["file", "output", "duration", "samples", "fill_pct", "empty_pct", "status"]
+STREAMBYTES = pow(2,28) #larger logs are aligned in bounded memory, a block of rows at a time
+
+
+def batchinputs(pattern):
+    # logs of a directory, or the files matching a glob pattern
+    if os.path.isdir(pattern):
+        return sorted(str(p) for p in pathlib.Path(pattern).glob("*" + LOGEXT))
+    return sorted(f for f in glob.glob(pattern) if os.path.isfile(f))
+
+def outputname(fnamein, outdir):
+    return str(pathlib.Path(outdir).joinpath(pathlib.Path(fnamein).stem + OUTEXT))
+
+def uptodate(fnamein, fnameout):
+    # the output exists and is not older than its log
+    return os.path.exists(fnameout) and os.path.getmtime(fnameout) >= os.path.getmtime(fnamein)
+
+def summaryrow(fnamein, fnameout, stats, status):
+    nsamples = stats.total * len(stats.imuids)
+    return {
+        "file": fnamein,
+        "output": fnameout,
+        "duration": "{:0>8}".format(str(stats.timediff())),
+        "samples": stats.total,
+        "fill_pct": round(100 * stats.nfill / nsamples, 2) if nsamples else 0,
+        "empty_pct": round(100 * stats.empty / stats.total, 2) if stats.total else 0,
+        "status": status,
+    }
+
+def alignfile(fnamein, nimus, fnameout, tocache=True, prof=None, nworkers=1):
+    """
+    Parse, align and save a log as csv. Logs larger than STREAMBYTES are
+    streamed, see streamfile, the others decoded as a whole.
+    :params fnamein: name of the log file
+    :params nimus: number of imus to align, the first ones found in the log
+    :params fnameout: name of the aligned csv
+    :params tocache: also store the session where the dashboard looks it up
+    :params prof: Profile recording the stages, see imu/profile.py
+    :params nworkers: number of processes decoding a large log, None for all cores
+    :returns: AlignStats of the session
+    """
+    prof = prof or Profile("alignfile", file=fnamein)
+    if os.path.getsize(fnamein) > STREAMBYTES:
+        return streamfile(fnamein, nimus, fnameout, tocache, prof)
+    with prof.stage("parse") as st:
+        payloads = loadlogs(fnamein, nworkers)
+        st["rows"] = sum(len(readings) for readings in payloads.values())
+    found = findimus(payloads)
+    imuids = found[:nimus]
+    with prof.stage("align") as st:
+        session, stats = alignsession(payloads, imuids)
+        st["rows"] = len(session)
+    with prof.stage("export", len(session)):
+        exportframe(session.toframe(), stats.epoch).to_csv(fnameout)
+    if tocache and imuids == found:
+        # same entry the dashboard looks up when the log is uploaded
+        with prof.stage("cache", len(session)):
+            cache.savesession(cache.filekey(fnamein), session, stats.todict(), buildpyramid(session))
+    return stats
+
+def streamfile(fnamein, nimus, fnameout, tocache=True, prof=None):
+    """
+    alignfile in bounded memory, however long the recording: the log is read
+    and aligned a block at a time by streamalign and every block is appended
+    to the csv as soon as it is aligned. Only the compact blocks are kept
+    for the cache, their pyramid built as they come. The imus are the ones
+    found at the beginning of the log.
+    :returns: AlignStats of the session
+    """
+    prof = prof or Profile("alignfile", file=fnamein)
+    found = firstimus(fnamein)
+    imuids = found[:nimus]
+    tocache = tocache and imuids == found
+    aligner = StreamAligner(imuids)
+    blocks = []
+    builder = PyramidBuilder()
+    with prof.stage("stream") as st, open(fnameout, "w", newline="") as fout:
+        nrows = 0
+        for df in streamalign(fnamein, imuids, aligner=aligner):
+            df.index = pd.RangeIndex(nrows, nrows + len(df))
+            exportframe(df, aligner.epoch).to_csv(fout, header=nrows == 0)
+            nrows += len(df)
+            if tocache:
+                blocks.append(CompactSession.fromframe(df, imuids))
+                builder.add(blocks[-1])
+        if nrows == 0:
+            alignarrays({}, imuids)[0].to_csv(fout)
+        st["rows"] = nrows
+    stats = aligner.stats
+    if blocks:
+        # same entry the dashboard looks up when the log is uploaded
+        with prof.stage("cache", nrows):
+            cache.savesession(cache.filekey(fnamein), CompactSession.concat(blocks), stats.todict(), builder.finish())
+    return stats
+
+def batchfile(fnamein, nimus, fnameout):
+    # worker side of alignbatch
+    prof = Profile("alignfile", file=fnamein)
+    try:
+        stats = alignfile(fnamein, nimus, fnameout, prof=prof)
+    except Exception as e:
+        return {"file": fnamein, "output": fnameout, "status": "error: " + str(e)}
+    finally:
+        prof.finish()
+    return summaryrow(fnamein, fnameout, stats, "aligned")
+
+def outputsummary(fnamein, fnameout, previous):
+    # summary of an up to date output, from the last summary if listed there
+    row = previous.get(fnamein)
+    if row is not None and row.get("output") == fnameout and row.get("status") in ("aligned", "up to date"):
+        return dict(row, status="up to date")
+    df = pd.read_csv(fnameout, index_col=0)
+    frametstamps(df)
+    imuids = [c[:-len(IMUELEM)] for c in df.columns if c.endswith(IMUELEM)]
+    return summaryrow(fnamein, fnameout, AlignStats.fromframe(df, imuids), "up to date")
+
+def readsummary(fname):
+    if not os.path.exists(fname):
+        return {}
+    with open(fname, newline="") as fin:
+        return {row["file"]: row for row in csv.DictReader(fin)}
+
+def writesummary(fname, rows):
+    with open(fname, "w", newline="") as fout:
+        writer = csv.DictWriter(fout, fieldnames=SUMMARYCOLS, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+def alignbatch(fnames, nimus, outdir, nworkers=None, force=False, progress=None):
+    """
+    Align many logs with a process pool, one log per worker at a time,
+    skipping the ones whose csv is already up to date, and write the summary
+    of all of them in outdir/SUMMARY
+    :params fnames: names of the log files
+    :params nimus: number of imus to align in every log
+    :params outdir: directory of the aligned csv files
+    :params nworkers: number of processes, None for all cores
+    :params force: align again logs with an up to date output
+    :params progress: called with every summary row as soon as it is ready
+    :returns: list of summary rows, dicts with SUMMARYCOLS keys, in fnames order
+    """
+    os.makedirs(outdir, exist_ok=True)
+    summaryname = os.path.join(outdir, SUMMARY)
+    previous = readsummary(summaryname)
+    rows = {}
+    todo = []
+    for fnamein in fnames:
+        fnameout = outputname(fnamein, outdir)
+        if not force and uptodate(fnamein, fnameout):
+            rows[fnamein] = outputsummary(fnamein, fnameout, previous)
+            if progress:
+                progress(rows[fnamein])
+        else:
+            todo.append((fnamein, fnameout))
+    if todo:
+        with ProcessPoolExecutor(max_workers=nworkers or os.cpu_count()) as pool:
+            futures = [pool.submit(batchfile, fnamein, nimus, fnameout) for fnamein, fnameout in todo]
+            for future in as_completed(futures):
+                row = future.result()
+                rows[row["file"]] = row
+                if progress:
+                    progress(row)
+    # logs of earlier batches in the same directory stay listed
+    others = [row for fnamein, row in previous.items() if fnamein not in rows]
+    rows = [rows[fnamein] for fnamein in fnames]
+    writesummary(summaryname, others + rows)
+    return rows
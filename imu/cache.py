@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import pathlib
+import numpy as np
+
+from imu.compact import CompactSession
+
+# shared by the dashboard and the standalone aligner
+CACHE_DIR = pathlib.Path(os.environ.get("IOBDASH_CACHE", pathlib.Path.home().joinpath(".cache", "iobdash")))
+CACHE_MAXBYTES = int(os.environ.get("IOBDASH_CACHE_MB", 2048)) * pow(2,20)
+CACHE_EXT = ".npz"
+META = "__meta__"
+CACHE_VERSION = 3 #entries of other versions are ignored
+PYRAMID = "p"
+SEP = "_"
+HASHBLOCK = pow(2,20)
+
+
+def sessionkey(raw):
+    # content address of a log: sha256 of its raw bytes
+    return hashlib.sha256(raw).hexdigest()
+
+def filekey(fnamein):
+    # same as sessionkey, without loading the whole file
+    h = hashlib.sha256()
+    with open(fnamein, "rb") as fin:
+        for block in iter(lambda: fin.read(HASHBLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cachepath(key, cachedir=None):
+    return pathlib.Path(cachedir or CACHE_DIR).joinpath(key + CACHE_EXT)
+
+def jsonable(x):
+    # numpy scalars found in the stats dicts
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError(f"{type(x)} is not JSON serializable")
+
+def savesession(key, session, datastats, pyramid=None, cachedir=None, maxbytes=None):
+    """
+    Store an aligned session, its compact arrays uncompressed
+    :params key: content address of the log, see sessionkey
+    :params session: aligned session, see compact.CompactSession
+    :params datastats: statistics dict of the session
+    :params pyramid: aggregates of the session, see pyramid.buildpyramid
+    :params cachedir: cache directory, defaults to CACHE_DIR
+    :params maxbytes: cache size cap, defaults to CACHE_MAXBYTES
+    """
+    fname = cachepath(key, cachedir)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    columns = dict(session.arrays())
+    for seconds, level in (pyramid or {}).items():
+        for name, values in level.items():
+            columns[PYRAMID + str(seconds) + SEP + name] = values
+    meta = {"version": CACHE_VERSION, "imuids": session.imuids, "epoch": session.epoch,
+            "datastats": datastats}
+    columns[META] = np.array(json.dumps(meta, default=jsonable))
+    # write aside and rename, readers never see a partial file
+    tmpname = fname.with_suffix(".tmp" + str(os.getpid()))
+    with open(tmpname, "wb") as fout:
+        np.savez(fout, **columns)
+    os.replace(tmpname, fname)
+    evict(cachedir, maxbytes)
+
+def loadsession(key, cachedir=None):
+    """
+    Fetch an aligned session stored by savesession
+    :params key: content address of the log, see sessionkey
+    :params cachedir: cache directory, defaults to CACHE_DIR
+    :returns: (CompactSession, statistics dict, pyramid), None if not cached
+    """
+    fname = cachepath(key, cachedir)
+    try:
+        with np.load(fname, allow_pickle=False) as data:
+            meta = json.loads(str(data[META]))
+            if meta.get("version") != CACHE_VERSION:
+                return None
+            session = CompactSession.fromarrays(meta["imuids"], meta["epoch"], data)
+            pyramid = {}
+            for member in data.files:
+                if member.startswith(PYRAMID):
+                    seconds, name = member[len(PYRAMID):].split(SEP, 1)
+                    pyramid.setdefault(int(seconds), {})[name] = data[member]
+        # recently used for the LRU eviction, unless evicted meanwhile
+        os.utime(fname)
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+    return session, meta["datastats"], pyramid
+
+def evict(cachedir=None, maxbytes=None):
+    # drop the least recently used sessions until the cache fits maxbytes
+    maxbytes = CACHE_MAXBYTES if maxbytes is None else maxbytes
+    entries = []
+    for fname in pathlib.Path(cachedir or CACHE_DIR).glob("*" + CACHE_EXT):
+        try:
+            st = fname.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, fname))
+    total = sum(e[1] for e in entries)
+    for mtime, size, fname in sorted(entries, key=lambda e: e[0]):
+        if total <= maxbytes:
+            break
+        try:
+            fname.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,57 @@
+import numpy as np
+
+NBUCKETS = 1000 #about one bucket per horizontal pixel of a trace
+
+
+def minmaxindices(y, nbuckets=NBUCKETS):
+    """
+    Indices of the points to plot so that a trace looks the same at a given
+    width: the minimum and the maximum of every bucket of consecutive
+    samples. Buckets that are all NaN keep one NaN, so gaps stay visible.
+    :params y: array of values, samples evenly spaced in time
+    :params nbuckets: number of buckets, i.e. at most 2*nbuckets points
+    :returns: sorted array of indices into y
+    """
+    n = len(y)
+    if n <= 2*nbuckets:
+        return np.arange(n)
+    size = n // nbuckets
+    nfull = nbuckets * size
+    buckets = np.asarray(y[:nfull], dtype=float).reshape(nbuckets, size)
+    empty = np.isnan(buckets)
+    imin = np.where(empty, np.inf, buckets).argmin(axis=1)
+    imax = np.where(empty, -np.inf, buckets).argmax(axis=1)
+    offsets = np.arange(nbuckets) * size
+    keep = [imin + offsets, imax + offsets]
+    if nfull < n:
+        tail = np.asarray(y[nfull:], dtype=float)
+        if np.isnan(tail).all():
+            keep.append([nfull])
+        else:
+            keep.append([nfull + np.nanargmin(tail), nfull + np.nanargmax(tail)])
+    return np.unique(np.concatenate(keep))
+
+def visiblerange(x, x0=None, x1=None):
+    """
+    Rows of a trace in the visible window, plus one on each side so lines
+    reach the borders
+    :params x: sorted array of x values
+    :params x0: left border, None for the beginning
+    :params x1: right border, None for the end
+    :returns: (first, last) row slice bounds
+    """
+    first = 0 if x0 is None else max(np.searchsorted(x, x0, side="left") - 1, 0)
+    last = len(x) if x1 is None else min(np.searchsorted(x, x1, side="right") + 1, len(x))
+    return first, last
+
+def downsample(x, y, x0=None, x1=None, nbuckets=NBUCKETS):
+    """
+    Points of a trace to plot for the window [x0, x1], at full resolution
+    once the window holds less than 2*nbuckets samples
+    :returns: (x, y) arrays
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    first, last = visiblerange(x, x0, x1)
+    idx = minmaxindices(y[first:last], nbuckets) + first
+    return x[idx], y[idx]
@@ -0,0 +1,266 @@
+import json
+import mmap
+import multiprocessing
+import os
+import pathlib
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from imu.align import (decodelogs, decodefilerange, tstampcalendar, chunkranges, mergedecoded, findimus,
+                       frametstamps, AlignStats, MINCHUNK)
+from imu import cache
+from imu.compact import CompactSession, alignsession
+from imu.pyramid import buildpyramid
+from imu.profile import Profile
+
+# uploads are ingested by a pool of local processes, jobs are kept on disk
+JOBS_DIR = pathlib.Path(os.environ.get("IOBDASH_JOBS", cache.CACHE_DIR.joinpath("jobs")))
+MAXJOBS = int(os.environ.get("IOBDASH_MAXJOBS", 2)) #jobs running at the same time
+JOB_TTL = 24 * 60 * 60 #seconds a finished job is kept
+PARSECHUNKS = 16 #progress steps while parsing a large log
+# processes decoding a log larger than 2 * MINCHUNK, the cores are shared by the jobs
+PARSEWORKERS = int(os.environ.get("IOBDASH_PARSEWORKERS", max(1, (os.cpu_count() or 1) // MAXJOBS)))
+STAGES = ["decode", "parse", "align", "stats"]
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+FINISHED = [DONE, ERROR, CANCELLED]
+STATE = ".json"
+UPLOAD = ".upload"
+CANCEL = ".cancel"
+IMUELEM = "_1"
+
+_pool = None
+_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    pass
+
+
+def jobpath(jobid, ext, jobsdir=None):
+    return pathlib.Path(jobsdir or JOBS_DIR).joinpath(jobid + ext)
+
+def writeatomic(fname, text):
+    # write aside and rename, readers never see a partial file
+    tmpname = fname.with_suffix(fname.suffix + ".tmp" + str(os.getpid()))
+    tmpname.write_text(text)
+    os.replace(tmpname, fname)
+
+def writestate(state, jobsdir=None):
+    writeatomic(jobpath(state["id"], STATE, jobsdir), json.dumps(state))
+
+def jobstate(jobid, jobsdir=None):
+    """
+    State of a job
+    :returns: dict with id, filename, status, stage, progress in 0..1 and,
+        once done, the session key; None if the job is unknown
+    """
+    try:
+        return json.loads(jobpath(jobid, STATE, jobsdir).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def report(state, stage, done=0.0, jobsdir=None):
+    # progress of a running job, the stage done fraction in 0..1
+    if jobpath(state["id"], CANCEL, jobsdir).exists():
+        raise Cancelled()
+    state["stage"] = stage
+    state["progress"] = (STAGES.index(stage) + done) / len(STAGES)
+    writestate(state, jobsdir)
+
+def parselog(buf, state, jobsdir=None):
+    # decodelogs a chunk at a time, reporting the progress in between
+    ranges = chunkranges(buf, PARSECHUNKS)
+    calendar = tstampcalendar(buf, ranges[0][0])
+    parts = []
+    for i, (start, end) in enumerate(ranges):
+        parts.append(decodelogs(buf, start, end, calendar))
+        report(state, "parse", (i + 1) / len(ranges), jobsdir)
+    return mergedecoded(parts)
+
+def parallelparse(fname, ranges, calendar, state, nworkers, jobsdir=None):
+    # chunks decoded by a process pool, the progress reported in file order
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        futures = [pool.submit(decodefilerange, fname, start, end, calendar) for start, end in ranges]
+        parts = []
+        try:
+            for i, future in enumerate(futures):
+                parts.append(future.result())
+                report(state, "parse", (i + 1) / len(ranges), jobsdir)
+        except Cancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    return mergedecoded(parts)
+
+def parsefile(fname, state, jobsdir=None, nworkers=None):
+    """
+    parselog on the mapped file, the log is never read in memory as a whole.
+    Logs larger than 2 * MINCHUNK are decoded by nworkers processes.
+    :params nworkers: number of processes, defaults to PARSEWORKERS
+    """
+    nworkers = nworkers or PARSEWORKERS
+    with open(fname, "rb") as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size == 0:
+            return {}
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if nworkers == 1 or size <= 2 * MINCHUNK:
+                return parselog(buf, state, jobsdir)
+            ranges = chunkranges(buf, max(nworkers, PARSECHUNKS))
+            calendar = tstampcalendar(buf, ranges[0][0])
+    return parallelparse(fname, ranges, calendar, state, nworkers, jobsdir)
+
+def ingest(jobid, jobsdir=None):
+    """
+    Hash, parse, align and store in the cache an uploaded log, worker side
+    of submitjob. The cancel marker is checked at every step.
+    :params jobid: id returned by submitjob
+    :params jobsdir: job directory, defaults to JOBS_DIR
+    :returns: final state of the job
+    """
+    state = jobstate(jobid, jobsdir)
+    if state is None or state["status"] in FINISHED:
+        return state
+    state["status"] = RUNNING
+    fname = jobpath(jobid, UPLOAD, jobsdir)
+    filename = state["filename"]
+    prof = Profile("ingest", file=filename, job=jobid)
+    try:
+        report(state, "decode", 0, jobsdir)
+        prof.info["bytes"] = os.path.getsize(fname)
+        with prof.stage("hash"):
+            # same content address as the logs hashed in memory
+            key = cache.filekey(fname)
+        if cache.loadsession(key) is None:
+            report(state, "parse", 0, jobsdir)
+            if filename.endswith('.csv'):
+                with prof.stage("parse") as st:
+                    df = pd.read_csv(fname)
+                    imuids = [c[:-len(IMUELEM)] for c in df.columns if c.endswith(IMUELEM)]
+                    frametstamps(df)
+                    st["rows"] = len(df)
+                report(state, "align", 0, jobsdir)
+                with prof.stage("align", len(df)):
+                    stats = AlignStats.fromframe(df, imuids)
+                with prof.stage("compact", len(df)):
+                    session = CompactSession.fromframe(df, imuids)
+                    del df
+            elif filename.endswith('.txt'):
+                with prof.stage("parse") as st:
+                    payloads = parsefile(fname, state, jobsdir)
+                    st["rows"] = sum(len(readings) for readings in payloads.values())
+                report(state, "align", 0, jobsdir)
+                found = findimus(payloads)
+                if not found:
+                    raise ValueError("No IMU readings in the log")
+                with prof.stage("align") as st:
+                    # aligned straight into the compact arrays
+                    session, stats = alignsession(payloads, found)
+                    st["rows"] = len(session)
+                del payloads
+            else:
+                raise ValueError("Unsupported file format")
+            report(state, "stats", 0, jobsdir)
+            with prof.stage("stats", len(session)):
+                datastats = stats.todict()
+            with prof.stage("pyramid", len(session)):
+                pyramid = buildpyramid(session)
+            report(state, "stats", 0.5, jobsdir)
+            with prof.stage("cache", len(session)):
+                cache.savesession(key, session, datastats, pyramid)
+        state.update(status=DONE, stage=DONE, progress=1.0, key=key)
+    except Cancelled:
+        state.update(status=CANCELLED, stage=CANCELLED)
+    except Exception as e:
+        if jobpath(jobid, CANCEL, jobsdir).exists():
+            # cancelled while queued, its upload removed as it started
+            state.update(status=CANCELLED, stage=CANCELLED)
+        else:
+            state.update(status=ERROR, stage=ERROR, error=str(e))
+    profile = prof.finish()
+    if profile is not None:
+        # shown by the dashboard, that runs in another process
+        state["profile"] = profile
+    state["finished"] = time.time()
+    writestate(state, jobsdir)
+    jobpath(jobid, UPLOAD, jobsdir).unlink(missing_ok=True)
+    return state
+
+def workerpool():
+    # started with the server, or else the first job, resuming the ones left by a previous server
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAXJOBS, mp_context=multiprocessing.get_context("spawn"))
+            resume = True
+        else:
+            resume = False
+    if resume:
+        resumejobs()
+    return _pool
+
+def newjob(jobsdir=None):
+    """
+    Id of a new job, the upload is to be written in jobpath(jobid, UPLOAD)
+    before submitjob
+    """
+    pathlib.Path(jobsdir or JOBS_DIR).mkdir(parents=True, exist_ok=True)
+    # before any job is queued, not to resume the new ones too
+    workerpool()
+    return uuid.uuid4().hex
+
+def submitjob(jobid, filename, jobsdir=None):
+    """
+    Queue the ingestion of an upload, at most MAXJOBS run at the same time
+    :params jobid: id from newjob, with the uploaded file in place
+    :params filename: name of the uploaded file
+    :params jobsdir: job directory, defaults to JOBS_DIR
+    """
+    writestate({"id": jobid, "filename": filename, "status": QUEUED, "stage": QUEUED,
+                "progress": 0.0, "created": time.time()}, jobsdir)
+    workerpool().submit(ingest, jobid, jobsdir)
+    purgejobs(jobsdir)
+
+def canceljob(jobid, jobsdir=None):
+    # a running job stops at its next step, a queued one never starts and its upload goes
+    state = jobstate(jobid, jobsdir)
+    if state is None or state["status"] in FINISHED:
+        return state
+    jobpath(jobid, CANCEL, jobsdir).touch()
+    if state["status"] == QUEUED:
+        state.update(status=CANCELLED, stage=CANCELLED, finished=time.time())
+        writestate(state, jobsdir)
+        jobpath(jobid, UPLOAD, jobsdir).unlink(missing_ok=True)
+    return state
+
+def resumejobs(jobsdir=None):
+    # queue again the jobs that did not finish, e.g. before a restart
+    for fname in pathlib.Path(jobsdir or JOBS_DIR).glob("*" + STATE):
+        state = jobstate(fname.stem, jobsdir)
+        if state is not None and state["status"] not in FINISHED and \
+           jobpath(state["id"], UPLOAD, jobsdir).exists():
+            _pool.submit(ingest, state["id"], jobsdir)
+
+def purgejobs(jobsdir=None):
+    # drop the files of the jobs finished more than JOB_TTL seconds ago
+    now = time.time()
+    for fname in pathlib.Path(jobsdir or JOBS_DIR).glob("*" + STATE):
+        state = jobstate(fname.stem, jobsdir)
+        if state is not None and state["status"] in FINISHED and now - state.get("finished", now) > JOB_TTL:
+            for ext in (STATE, UPLOAD, CANCEL):
+                jobpath(state["id"], ext, jobsdir).unlink(missing_ok=True)
+    # uploads that never made it to a job
+    for fname in pathlib.Path(jobsdir or JOBS_DIR).glob("*" + UPLOAD):
+        try:
+            if not fname.with_suffix(STATE).exists() and now - fname.stat().st_mtime > JOB_TTL:
+                fname.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,243 @@
+import os
+import pathlib
+import threading
+import time
+import uuid
+import json
+from collections import deque
+
+import numpy as np
+
+import pandas as pd
+
+from imu.align import SAMPLINGRATE, decodelogs, tstampcalendar, findimus, colnameimudata
+from imu.stream import StreamAligner
+
+LIVEQUEUE = 5 * SAMPLINGRATE #readings a silent imu can hold rows back, about 5 seconds
+LIVE_TTL = int(os.environ.get("IOBDASH_LIVE_TTL", 600)) #seconds since last poll
+LIVEWINDOW = 60 #seconds kept by the live charts
+LIVEPOINTS = LIVEWINDOW * SAMPLINGRATE #points kept in the browser per live trace
+LIVEROWS = LIVEPOINTS + SAMPLINGRATE #aligned rows kept by a tail, the live window and the second filling up
+LIVE_DIR = pathlib.Path(os.environ.get("IOBDASH_LIVE_DIR", pathlib.Path(__file__).resolve().parents[1].joinpath("data"))) #logs that can be followed
+STREAM_POLL = 0.2 #seconds between reads of a followed log while streaming
+STREAM_KEEPALIVE = 15 #seconds of silence before a keepalive comment
+
+
+class LiveTail:
+    """
+    Follows a log while it is being written. Every poll decodes only the
+    lines appended since the previous one, from the saved file offset, and
+    pushes them to a StreamAligner that keeps the per imu cursors and the
+    counter epoch between polls, so the cost of a poll depends on the new
+    data only. Rows are numbered from the start of the session, only the
+    last LIVEROWS are held.
+    """
+
+    def __init__(self, fname, imuids=None, offset=0, maxqueue=LIVEQUEUE):
+        self.fname = fname
+        self.imuids = imuids
+        self.maxqueue = maxqueue
+        self.lock = threading.Lock()
+        self.reset(offset)
+
+    def reset(self, offset=0):
+        self.offset = offset
+        self.aligner = None if self.imuids is None else StreamAligner(self.imuids, self.maxqueue)
+        self.blocks = deque()
+        self.nrows = 0
+        # timestamps resolved against the first lines polled, see tstampcalendar
+        self.calendar = None
+
+    @property
+    def stats(self):
+        return self.aligner.stats if self.aligner is not None else None
+
+    def poll(self):
+        """
+        Align what was appended to the log since the last poll
+        :returns: list of aligned dataframes with the new rows, indexed by row number
+        """
+        with self.lock:
+            size = os.stat(self.fname).st_size
+            if size < self.offset:
+                # truncated or replaced, start over
+                self.reset()
+            if size == self.offset:
+                return []
+            with open(self.fname, "rb") as fin:
+                fin.seek(self.offset)
+                buf = fin.read(size - self.offset)
+            # a partial last line is read again at the next poll
+            cut = buf.rfind(b"\n") + 1
+            if cut == 0:
+                return []
+            start = None if self.offset == 0 else 0
+            self.calendar = self.calendar or tstampcalendar(buf, start, cut)
+            decoded = decodelogs(buf, start, cut, self.calendar)
+            self.offset += cut
+            if self.aligner is None:
+                # imus found in the first lines polled
+                if not findimus(decoded):
+                    return []
+                self.imuids = findimus(decoded)
+                self.aligner = StreamAligner(self.imuids, self.maxqueue)
+            return self.append(self.aligner.push(decoded))
+
+    def flush(self):
+        # the log is complete, emit the rows still waiting for silent imus
+        with self.lock:
+            if self.aligner is None:
+                return []
+            return self.append(self.aligner.flush())
+
+    def append(self, blocks):
+        for df in blocks:
+            df.index = pd.RangeIndex(self.nrows, self.nrows + len(df))
+            self.nrows += len(df)
+        self.blocks.extend(df for df in blocks if len(df) > 0)
+        # drop the blocks past the rows the live charts can ask for
+        while self.blocks and self.nrows - self.blocks[0].index[-1] > LIVEROWS:
+            self.blocks.popleft()
+        return blocks
+
+    def rows(self, first, last):
+        # aligned rows first..last-1, only the blocks holding them are copied
+        with self.lock:
+            held = []
+            for df in reversed(self.blocks):
+                if df.index[0] >= last:
+                    continue
+                if df.index[-1] < first:
+                    break
+                held.append(df)
+            if not held:
+                return None
+            df = pd.concat(held[::-1])
+            return df.loc[max(first, df.index[0]):last - 1]
+
+
+_tails = {}
+_lock = threading.Lock()
+
+def livepath(fname):
+    # path of a log within LIVE_DIR, relative names are taken from there
+    path = LIVE_DIR.joinpath(fname).resolve()
+    if not path.is_relative_to(LIVE_DIR.resolve()):
+        raise PermissionError("Only logs in " + str(LIVE_DIR) + " can be followed")
+    if not path.is_file():
+        raise FileNotFoundError(fname)
+    return path
+
+def starttail(fname, imuids=None):
+    """
+    Start following a log
+    :params fname: name of the log file within LIVE_DIR, it may not hold any data yet
+    :params imuids: ids of the IMUs to align, by default the ones in the first data
+    :returns: key of the tail, see gettail
+    """
+    path = livepath(fname)
+    key = uuid.uuid4().hex
+    with _lock:
+        _tails[key] = [LiveTail(str(path), imuids), time.monotonic() + LIVE_TTL]
+    purgetails()
+    return key
+
+def gettail(key):
+    # LiveTail of a key returned by starttail, None if unknown or expired
+    if not key:
+        return None
+    with _lock:
+        entry = _tails.get(key)
+        if entry is None:
+            return None
+        entry[-1] = time.monotonic() + LIVE_TTL
+        return entry[0]
+
+def stoptail(key):
+    with _lock:
+        entry = _tails.pop(key, None)
+    return entry[0] if entry is not None else None
+
+def purgetails():
+    # drop the tails nobody polled for LIVE_TTL seconds
+    now = time.monotonic()
+    with _lock:
+        for key in [k for k, entry in _tails.items() if entry[-1] < now]:
+            del _tails[key]
+
+def lossbars(df, imuids):
+    # single imu and all imus data loss of whole seconds of aligned rows, one bar per second
+    present = df[[colnameimudata(imu)[1] for imu in imuids]].notna().to_numpy()
+    ncollected = present.sum(axis=1)
+    nimus = present.shape[1]
+    seconds = df.index.to_numpy() // SAMPLINGRATE
+    first = seconds[0]
+    fill = np.bincount(seconds - first, weights=np.where(ncollected > 0, nimus - ncollected, 0))
+    empty = np.bincount(seconds - first, weights=ncollected == 0)
+    return np.arange(first, first + len(fill)), fill.astype(int), empty.astype(int)
+
+def jsonlist(values):
+    # float array -> list, NaN -> None
+    values = np.round(values, 4)
+    return np.where(np.isnan(values), None, values).tolist()
+
+def liverows(tail, first, last):
+    """
+    Message with the aligned rows first..last-1 of a tail
+    :returns: dict with the quaternions per imu, the data loss bars and the session counters
+    """
+    df = tail.rows(first, last)
+    imuids = [str(imu).zfill(2) for imu in tail.imuids]
+    x, fill, empty = lossbars(df, imuids)
+    stats = tail.stats
+    return {
+        "imuids": imuids,
+        "maxpoints": LIVEPOINTS,
+        "maxbars": LIVEWINDOW,
+        "x": (df.index.to_numpy() / SAMPLINGRATE).tolist(),
+        "q": {imu: [jsonlist(df[col].to_numpy()) for col in colnameimudata(imu)[1:]] for imu in imuids},
+        "loss": {"x": x.tolist(), "fill": fill.tolist(), "empty": empty.tolist()},
+        "total": stats.total,
+        "timewindow": "{:0>8}".format(str(stats.timediff())),
+    }
+
+def sseevent(event, data, eventid=None):
+    msg = "event: " + event + "\n"
+    if eventid is not None:
+        msg += "id: " + str(eventid) + "\n"
+    return msg + "data: " + json.dumps(data) + "\n\n"
+
+def livemessages(key, sent=0, poll=STREAM_POLL, keepalive=STREAM_KEEPALIVE):
+    """
+    Server-sent events of a followed log: a rows event as soon as new whole
+    seconds are aligned, with the row number reached as event id so that a
+    reconnecting client resumes from there, and an end event once the tail
+    is stopped or expired
+    :params key: key of the tail, see starttail
+    :params sent: rows the client already has, from the Last-Event-ID header
+    :returns: generator of text/event-stream chunks
+    """
+    idle = 0
+    while True:
+        tail = gettail(key)
+        if tail is None:
+            yield sseevent("end", {})
+            return
+        try:
+            tail.poll()
+        except OSError as e:
+            yield sseevent("end", {"error": str(e)})
+            return
+        # whole seconds only, the last one may still be filling up
+        upto = tail.nrows - tail.nrows % SAMPLINGRATE
+        first = max(sent, upto - LIVEPOINTS)
+        if upto > first:
+            yield sseevent("rows", liverows(tail, first, upto), upto)
+            sent = upto
+            idle = 0
+            continue
+        if idle >= keepalive:
+            yield ": keepalive\n\n"
+            idle = 0
+        time.sleep(poll)
+        idle += poll
@@ -0,0 +1,106 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# IOBDASH_PROFILE=1 times the stages of uploads, tabs and the standalone
+# aligner, IOBDASH_PROFILE=mem also traces their peak of allocated memory
+PROFILE = os.environ.get("IOBDASH_PROFILE", "").lower()
+ENABLED = PROFILE not in ("", "0", "no", "off")
+TRACEMEM = PROFILE == "mem"
+RECENT = 20 #profiles kept for the dashboard panel
+MB = pow(2,20)
+
+logger = logging.getLogger("iobdash.profile")
+if ENABLED and not logger.handlers:
+    # one json line per profile, also from the worker processes
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_recent = deque(maxlen=RECENT)
+_lock = threading.Lock()
+
+
+class Profile:
+    """
+    Wall time, rows and, with TRACEMEM, peak traced memory of the stages of
+    one operation, e.g. the ingestion of an upload. Stages are recorded only
+    when ENABLED, otherwise they cost a dict and a generator.
+    """
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.stages = []
+        self.start = time.perf_counter()
+        if ENABLED and TRACEMEM and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time a block, the rows handled can also be set on the yielded dict
+        :params name: name of the stage
+        :params rows: number of rows handled by the stage, if known in advance
+        """
+        record = {"stage": name, "rows": rows}
+        if not ENABLED:
+            yield record
+            return
+        if TRACEMEM:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - t0, 6)
+            if TRACEMEM:
+                record["peakmb"] = round(tracemalloc.get_traced_memory()[1] / MB, 3)
+            self.stages.append(record)
+
+    def todict(self):
+        return {"profile": self.name, **self.info,
+                "seconds": round(time.perf_counter() - self.start, 6), "stages": self.stages}
+
+    def finish(self):
+        """
+        Log the profile as a json line and list it in the dashboard panel
+        :returns: dict of the profile, None if not ENABLED
+        """
+        if not ENABLED:
+            return None
+        record = self.todict()
+        logger.info(json.dumps(record))
+        remember(record)
+        return record
+
+def remember(record):
+    # list a profile in the dashboard panel, e.g. one from a worker process
+    if record:
+        with _lock:
+            if record not in _recent:
+                _recent.appendleft(record)
+
+def recent():
+    # latest profiles first
+    with _lock:
+        return list(_recent)
+
+def formatprofile(record):
+    # profile as a text table, for the command line
+    lines = ["Profile {}: {:.3f}s".format(record["profile"], record["seconds"])]
+    for stage in record["stages"]:
+        line = "  {:<12}{:>10.3f}s".format(stage["stage"], stage["seconds"])
+        if stage.get("rows") is not None:
+            line += "{:>12} rows".format(stage["rows"])
+        if "peakmb" in stage:
+            line += "{:>10.1f}MB".format(stage["peakmb"])
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+import numpy as np
+
+from imu.align import SAMPLINGRATE
+
+# bucket widths in seconds, each one a multiple of the previous
+LEVELS = [1, 10, 60, 600]
+COUNTS = ["collected", "outof", "nrows"]
+SUMS = ["qsum", "batsum"]
+
+
+def bucketed(values, rows, fill):
+    # (n, ...) -> (nbuckets, rows, ...), the last bucket padded with fill
+    n = len(values)
+    nbuckets = -(-n // rows)
+    padded = np.full((nbuckets * rows,) + values.shape[1:], fill, dtype=values.dtype)
+    padded[:n] = values
+    return padded.reshape((nbuckets, rows) + values.shape[1:])
+
+def finestlevel(present, q, battery, rows):
+    real = bucketed(np.ones(len(present), dtype=bool), rows, False)
+    present = bucketed(present, rows, False)
+    q = bucketed(q, rows, np.nan)
+    battery = bucketed(battery, rows, np.nan)
+    qpresent = present[..., None]
+    # rows by number of missing imus, as AlignStats.outof
+    nmissing = present.shape[2] - present.sum(axis=2)
+    outof = (nmissing[..., None] == np.arange(present.shape[2] + 1)) & real[..., None]
+    level = {
+        "nrows": real.sum(axis=1).astype(np.int32),
+        "collected": present.sum(axis=1).astype(np.int32),
+        "outof": outof.sum(axis=1).astype(np.int32),
+        "qmin": np.where(qpresent, q, np.inf).min(axis=1).astype(np.float32),
+        "qmax": np.where(qpresent, q, -np.inf).max(axis=1).astype(np.float32),
+        "qsum": np.where(qpresent, q, 0).sum(axis=1),
+        "batsum": np.where(present, battery, 0).sum(axis=1),
+    }
+    return level
+
+def coarserlevel(level, factor):
+    coarse = {}
+    for name in COUNTS:
+        coarse[name] = bucketed(level[name], factor, 0).sum(axis=1).astype(np.int32)
+    for name in SUMS:
+        coarse[name] = bucketed(level[name], factor, 0).sum(axis=1)
+    coarse["qmin"] = bucketed(level["qmin"], factor, np.inf).min(axis=1)
+    coarse["qmax"] = bucketed(level["qmax"], factor, -np.inf).max(axis=1)
+    return coarse
+
+class PyramidBuilder:
+    """
+    buildpyramid of a session aligned a block at a time, see batch.streamfile:
+    the finest buckets are aggregated as the blocks come, the rows of the
+    last unfinished bucket carried over to the next block, and the coarser
+    levels are computed once the session ends
+    """
+
+    def __init__(self, levels=LEVELS):
+        self.levels = levels
+        self.rows = levels[0] * SAMPLINGRATE
+        self.buckets = [] #finest levels of the blocks so far
+        self.carried = None #(present, q, battery) of the unfinished bucket
+
+    def add(self, session):
+        """
+        Aggregate the next rows of the session
+        :params session: aligned block, see compact.CompactSession
+        """
+        rows = (session.present(), session.quaternions(dtype=np.float64), session.batteries(dtype=np.float64))
+        if self.carried is not None:
+            rows = [np.concatenate(pair) for pair in zip(self.carried, rows)]
+        nfull = len(rows[0]) // self.rows * self.rows
+        if nfull > 0:
+            self.buckets.append(finestlevel(*[values[:nfull] for values in rows], self.rows))
+        self.carried = [values[nfull:] for values in rows]
+
+    def finish(self):
+        """
+        Aggregates of all the rows added, see buildpyramid
+        :returns: dict seconds -> dict name -> array with one row per bucket
+        """
+        buckets = list(self.buckets)
+        if self.carried is not None and (len(self.carried[0]) > 0 or not buckets):
+            buckets.append(finestlevel(*self.carried, self.rows))
+        if not buckets:
+            return {}
+        level = {name: np.concatenate([bucket[name] for bucket in buckets]) for name in buckets[0]}
+        pyramid = {self.levels[0]: level}
+        for finer, seconds in zip(self.levels, self.levels[1:]):
+            level = coarserlevel(level, seconds // finer)
+            pyramid[seconds] = level
+        return pyramid
+
+def buildpyramid(session, levels=LEVELS):
+    """
+    Aggregate an aligned session over buckets of increasing width: per imu
+    quaternion min/max/sum, battery sum and collected samples, per bucket
+    rows by number of missing imus. Each level is computed from the previous one.
+    :params session: aligned session, see compact.CompactSession
+    :params levels: bucket widths in seconds
+    :returns: dict seconds -> dict name -> array with one row per bucket
+    """
+    builder = PyramidBuilder(levels)
+    builder.add(session)
+    return builder.finish()
+
+def levelmean(level):
+    # mean quaternions and battery of the buckets, or of windowcounts totals, NaN where nothing was collected
+    with np.errstate(invalid="ignore", divide="ignore"):
+        qmean = level["qsum"] / level["collected"][..., None]
+        batmean = level["batsum"] / level["collected"]
+    return qmean, batmean
+
+def levelminmax(level):
+    # min/max of the buckets, NaN where nothing was collected
+    empty = level["collected"][..., None] == 0
+    return np.where(empty, np.nan, level["qmin"]), np.where(empty, np.nan, level["qmax"])
+
+def chooselevel(pyramid, first, last, maxbuckets):
+    """
+    Coarsest detail needed to show rows first..last-1 with maxbuckets buckets
+    :returns: seconds of the finest level with at most maxbuckets buckets in
+        the window, None if the raw rows fit, the coarsest level otherwise
+    """
+    if last - first <= 2 * maxbuckets:
+        return None
+    for seconds in sorted(pyramid):
+        rows = seconds * SAMPLINGRATE
+        if (last - 1) // rows - first // rows + 1 <= maxbuckets:
+            return seconds
+    return max(pyramid)
+
+def levelslice(seconds, first, last):
+    # buckets of a level covering rows first..last-1
+    rows = seconds * SAMPLINGRATE
+    return slice(first // rows, -(-last // rows))
+
+def windowcounts(pyramid, start, stop):
+    """
+    Data loss counts and sums over the seconds start..stop-1 of a session,
+    adding up the coarsest buckets that fit in the window and finer ones at
+    its borders, so that the cost depends on the number of buckets only
+    :params pyramid: see buildpyramid
+    :params start: first second of the window
+    :params stop: second past the end of the window
+    :returns: dict name -> total of COUNTS and SUMS, plus missing, full and empty
+    """
+    levels = sorted(pyramid)
+    finest = pyramid[levels[0]]
+    totals = {name: np.zeros(finest[name].shape[1:], dtype=finest[name].dtype) for name in COUNTS + SUMS}
+
+    def add(ilevel, a, b):
+        # a, b in seconds, multiples of levels[0]
+        if a >= b:
+            return
+        seconds = levels[ilevel]
+        lo = -(-a // seconds)
+        hi = b // seconds
+        if ilevel > 0 and lo >= hi:
+            add(ilevel - 1, a, b)
+            return
+        level = pyramid[seconds]
+        for name in COUNTS + SUMS:
+            totals[name] = totals[name] + level[name][lo:hi].sum(axis=0)
+        if ilevel > 0:
+            add(ilevel - 1, a, lo * seconds)
+            add(ilevel - 1, hi * seconds, b)
+
+    add(len(levels) - 1, start, stop)
+    totals["missing"] = totals["nrows"] - totals["collected"]
+    totals["full"] = totals["outof"][0]
+    totals["empty"] = totals["outof"][-1]
+    return totals
+
+def windowstats(pyramid, imuids, start=0, stop=None):
+    """
+    Data loss statistics of the seconds start..stop-1 of a session, the
+    same as AlignStats.todict gives for the whole session, plus the mean
+    battery level of every imu
+    :params pyramid: see buildpyramid
+    :params imuids: two digit ids of the imus, in column order
+    :params stop: second past the end of the window, None for the end of the session
+    """
+    nseconds = len(pyramid[min(pyramid)]["nrows"]) * min(pyramid)
+    start = max(int(start), 0)
+    stop = nseconds if stop is None else min(int(stop), nseconds)
+    totals = windowcounts(pyramid, start, max(start, stop))
+    total = int(totals["nrows"])
+    qmean, batmean = levelmean(totals)
+    datastats = {"imuids": imuids, "num_imus": len(imuids), "total": total, "start": start,
+                 "stop": max(start, stop), "full": int(totals["full"]), "empty": int(totals["empty"]),
+                 "nsamples": len(imuids) * total, "stats": totals["outof"][:-1].tolist()}
+    for j, imu in enumerate(imuids):
+        missing = int(totals["missing"][j])
+        datastats[imu] = [missing, missing / total if total else 0]
+    datastats["battery"] = batmean.tolist()
+    return datastats
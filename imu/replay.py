@@ -0,0 +1,179 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from imu.align import (RAWDTYPE, RESETCOUNTER, SAMPLINGRATE, MS_IN_SEC, TSYEAR, BLANK, decodelogs,
+                       mergedecoded, findimus, unwrapcounters, firstepoch, encodelogs)
+
+MS_IN_SAMPLE = MS_IN_SEC // SAMPLINGRATE
+MINSPEED = 1
+MAXSPEED = 1000
+MINWAKE = 0.02 #seconds between two writes at high speed, ticks due meanwhile are written together
+
+
+def loadrecorded(fnames):
+    """
+    Readings of a recorded session, from a whole log or from one file per imu
+    :params fnames: names of the recorded files, lines in the log format
+    :returns: dict imuid -> RAWDTYPE array, see decodelogs
+    """
+    parts = []
+    for fname in fnames:
+        with open(fname, "rb") as fin:
+            parts.append(decodelogs(fin.read()))
+    return mergedecoded(parts)
+
+def nowtstamp():
+    # wall clock as ms since TSYEAR-01-01, the TSTAMP of the logs
+    return (datetime.now() - datetime(TSYEAR, 1, 1)) // timedelta(milliseconds=1)
+
+
+class Recording:
+    """
+    Recorded session indexed by counter epoch: the NTH counters of every imu
+    are unwrapped into sample indices from 0, shared by all the imus, and
+    the readings sorted by index. The samples an imu missed become BLANK
+    readings, as the receiver logs them. Loaded once, replayed by any number
+    of Replay objects.
+    """
+
+    def __init__(self, decoded, imuids=None):
+        self.imuids = findimus(decoded) if imuids is None else imuids
+        readings = [decoded.get(imuid, np.empty(0, dtype=RAWDTYPE)) for imuid in self.imuids]
+        if not readings or any(len(imudata) == 0 for imudata in readings):
+            raise ValueError("No readings of some imus in the recorded session")
+        startCounter = min(int(imudata["NTH"][0]) for imudata in readings)
+        indices = [unwrapcounters(imudata["NTH"], startCounter-1) for imudata in readings]
+        epoch = firstepoch(indices, readings, startCounter)
+        allreadings = []
+        allindices = []
+        for imuid, idx, imudata in zip(self.imuids, indices, readings):
+            idx = idx - startCounter
+            missing = np.setdiff1d(np.arange(idx[0], idx[-1] + 1), idx, assume_unique=True)
+            blanks = np.zeros(len(missing), dtype=RAWDTYPE)
+            blanks["IMUID"] = imuid
+            blanks["CHECK"] = int(BLANK, 16)
+            blanks["TSTAMP"] = epoch + missing * MS_IN_SAMPLE
+            allreadings.extend([imudata, blanks])
+            allindices.extend([idx, missing])
+        readings = np.concatenate(allreadings)
+        index = np.concatenate(allindices)
+        order = np.lexsort((readings["TSTAMP"], index))
+        self.readings = readings[order]
+        self.index = index[order]
+        # ms since the first sample, the replay moves them to its own clock
+        self.offsets = self.readings["TSTAMP"] - epoch
+        self.blank = self.readings["CHECK"] == int(BLANK, 16)
+        self.nsamples = int(self.index[-1]) + 1
+
+    @classmethod
+    def load(cls, fnames, imuids=None):
+        return cls(loadrecorded(fnames), imuids)
+
+    def segment(self, first, last):
+        # readings of samples first..last-1, one pass of the session
+        lo, hi = np.searchsorted(self.index, [first, last])
+        return slice(lo, hi)
+
+
+class Replay:
+    """
+    One patient: a Recording written again sample by sample, in the log
+    format, as if it was being received now. Timestamps keep the recorded
+    jitter, moved to start at the replay start; counters keep running when
+    the session is replayed again in a loop.
+    """
+
+    def __init__(self, recording, outputs, start=0, loop=False, tstamp=None):
+        """
+        :params recording: session to replay, see Recording
+        :params outputs: open binary files, one for all the readings or one per imu in recording.imuids order
+        :params start: first sample to replay
+        :params loop: start over at the end of the session, otherwise stop there
+        :params tstamp: TSTAMP of the first sample, defaults to now
+        """
+        self.recording = recording
+        self.outputs = outputs
+        self.start = start % recording.nsamples
+        self.loop = loop
+        self.tstamp = nowtstamp() if tstamp is None else tstamp
+        self.ticks = 0 #samples written
+        self.lines = 0
+
+    @property
+    def done(self):
+        return not self.loop and self.start + self.ticks >= self.recording.nsamples
+
+    def readings(self, first, last):
+        # readings of the replay samples first..last-1, ready to be written
+        rec = self.recording
+        parts = []
+        sample = self.start + first
+        end = self.start + last
+        while sample < end:
+            npass, offset = divmod(sample, rec.nsamples)
+            stop = min(end - npass * rec.nsamples, rec.nsamples)
+            rows = rec.segment(offset, stop)
+            part = rec.readings[rows].copy()
+            shift = npass * rec.nsamples - self.start
+            part["TSTAMP"] = self.tstamp + rec.offsets[rows] + shift * MS_IN_SAMPLE
+            # counters of the later passes go on from where the previous ended
+            nth = (part["NTH"].astype(np.int64) + npass * rec.nsamples) % RESETCOUNTER
+            part["NTH"] = np.where(rec.blank[rows], 0, nth)
+            parts.append(part)
+            sample = (npass * rec.nsamples) + stop
+        return np.concatenate(parts) if parts else np.empty(0, dtype=RAWDTYPE)
+
+    def write(self, due):
+        """
+        Write the samples due and not written yet
+        :params due: samples due since the replay start
+        """
+        if not self.loop:
+            due = min(due, self.recording.nsamples - self.start)
+        if due <= self.ticks:
+            return
+        readings = self.readings(self.ticks, due)
+        if len(self.outputs) == 1:
+            self.outputs[0].write(encodelogs(readings))
+        else:
+            for imuid, fout in zip(self.recording.imuids, self.outputs):
+                fout.write(encodelogs(readings[readings["IMUID"] == imuid]))
+        for fout in self.outputs:
+            fout.flush()
+        self.lines += len(readings)
+        self.ticks = due
+
+
+def replay(replays, speed=1, duration=None, progress=None):
+    """
+    Write the replays in real time, speed times faster. The samples due are
+    computed from the start time, never from the previous write, so that
+    the replay does not drift however long it runs; when a write falls
+    behind, the next one catches up.
+    :params replays: Replay objects, written in turn
+    :params speed: MINSPEED..MAXSPEED, samples written per sampling period
+    :params duration: seconds of recorded time to replay, None until all the replays are done
+    :params progress: called with the samples written after every write
+    :returns: samples written by the longest replay
+    """
+    if not MINSPEED <= speed <= MAXSPEED:
+        raise ValueError(f"Speed out of {MINSPEED}..{MAXSPEED}")
+    period = 1 / (SAMPLINGRATE * speed)
+    last = None if duration is None else int(duration * SAMPLINGRATE)
+    start = time.monotonic()
+    due = 0
+    while True:
+        due = int((time.monotonic() - start) / period) + 1
+        if last is not None:
+            due = min(due, last)
+        for r in replays:
+            r.write(due)
+        if progress:
+            progress(due)
+        if due == last or all(r.done for r in replays):
+            return max(r.ticks for r in replays)
+        # next sample, or a few of them at high speed
+        wake = max(start + due * period, time.monotonic() + MINWAKE)
+        time.sleep(max(wake - time.monotonic(), 0))
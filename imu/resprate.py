@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from imu.align import SAMPLINGRATE, SEC_IN_MIN
+
+THORAX = "01"
+ABDOMEN = "02"
+WINDOWS = [30, 60, 120] #seconds, window sizes offered by the analysis tab
+WINDOW = 60
+STEPS = 4 #windows overlapping at any time, the step is a fraction of the window
+DECIMATE = 4 #samples averaged before the analysis, breathing is well under the 1.25Hz left
+RATEBAND = (6, 60) #breaths per minute looked for
+ZEROPAD = 2 #spectra points per window sample, at least: the next power of two is used
+MINCOLLECTED = 0.6 #fraction of the samples of a window needed to estimate its rate
+RATECACHE = 16 #estimates kept, one per session and window size
+
+_rates = OrderedDict()
+_lock = threading.Lock()
+
+
+def decimated(q):
+    """
+    Average of every DECIMATE samples, the missing ones left out
+    :params q: (rows, NSIGXIMU) quaternions, NaN where not collected
+    :returns: (rows // DECIMATE, NSIGXIMU) float32 array, NaN where no sample was collected
+    """
+    n = len(q) // DECIMATE * DECIMATE
+    blocks = q[:n].reshape(-1, DECIMATE, q.shape[1])
+    present = ~np.isnan(blocks)
+    count = present.sum(axis=1)
+    total = np.where(present, blocks, 0).sum(axis=1, dtype=np.float32)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan).astype(np.float32)
+
+def filled(values):
+    # gaps bridged by straight lines between the collected samples around them
+    present = ~np.isnan(values[:, 0])
+    if present.all() or not present.any():
+        return np.nan_to_num(values), present
+    rows = np.flatnonzero(present)
+    gaps = np.flatnonzero(~present)
+    values = values.copy()
+    for i in range(values.shape[1]):
+        values[gaps, i] = np.interp(gaps, rows, values[rows, i])
+    return values, present
+
+def nfft(size):
+    # points of the spectra of windows of size samples, zero padded
+    return 1 << int(np.ceil(np.log2(size * ZEROPAD)))
+
+def detrender(size):
+    # matrix removing the least squares line of a window row and tapering it
+    t = np.arange(size) - (size - 1) / 2
+    basis = np.column_stack((np.ones(size), t))
+    residual = np.eye(size) - basis @ np.linalg.pinv(basis)
+    return (residual * np.hanning(size)).astype(np.float32)
+
+def windowspectra(values, size, step):
+    """
+    Power spectra of all the sliding windows at once: every quaternion
+    component linearly detrended, Hann tapered and zero padded to nfft(size)
+    points, the gaps bridged beforehand. The spectra of the components are
+    summed, so that the rotation axis of the sensor does not matter.
+    :params values: (rows, NSIGXIMU) decimated quaternions, NaN where not collected
+    :params size: samples of a window
+    :params step: samples between two windows
+    :returns: (windows, nfft(size)//2+1) spectra, (windows,) fraction of collected samples
+    """
+    values, present = filled(values)
+    # (windows, NSIGXIMU, size) view, no copy until detrended
+    x = np.lib.stride_tricks.sliding_window_view(values, size, axis=0)[::step]
+    x = x @ detrender(size)
+    power = np.abs(np.fft.rfft(x, nfft(size), axis=2)) ** 2
+    counts = np.concatenate(([0], np.cumsum(present)))
+    starts = np.arange(len(x)) * step
+    return power.sum(axis=1), (counts[starts + size] - counts[starts]) / size
+
+def peakrates(power, fs, npoints):
+    """
+    Frequency of the highest peak of every spectrum within RATEBAND,
+    refined by a parabola through the peak bin and its neighbours
+    :params power: (windows, npoints//2+1) spectra
+    :params fs: sampling rate of the spectra, Hz
+    :params npoints: points of the spectra, see nfft
+    :returns: (windows,) breaths per minute
+    """
+    bins = np.fft.rfftfreq(npoints, 1 / fs) * SEC_IN_MIN
+    lo, hi = np.searchsorted(bins, RATEBAND)
+    lo = max(lo, 1)
+    hi = min(hi, len(bins) - 1)
+    peak = lo + np.argmax(power[:, lo:hi], axis=1)
+    rows = np.arange(len(power))
+    logp = np.log(power[rows[:, None], peak[:, None] + [-1, 0, 1]] + 1e-12)
+    a, b, c = logp.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = np.nan_to_num(0.5 * (a - c) / (a - 2 * b + c))
+    delta = np.clip(delta, -0.5, 0.5)
+    return (peak + delta) * fs / npoints * SEC_IN_MIN
+
+def respiratoryrate(session, window=WINDOW):
+    """
+    Breathing rate over sliding windows of the thorax and abdomen quaternions.
+    Every window of the session is handled in one batch: a spectrum per
+    window and imu, the rate at its highest peak. The combined rate sums the
+    spectra of both imus, each normalized to its power in RATEBAND.
+    :params session: aligned session, see compact.CompactSession
+    :params window: seconds of a window, the step is window / STEPS
+    :returns: dict with the window centers in "seconds", the "rate" combined
+              and the rate of each imu by its id, breaths per minute, NaN
+              where too few samples were collected
+    """
+    fs = SAMPLINGRATE / DECIMATE
+    size = int(window * fs)
+    step = max(size // STEPS, 1)
+    imus = [imu for imu in (THORAX, ABDOMEN) if imu in session.imuids]
+    if not imus:
+        raise ValueError("No thorax or abdomen imu in the session")
+    if len(session) // DECIMATE < size:
+        raise ValueError(f"Session shorter than the {window}s window")
+    npoints = nfft(size)
+    bins = np.fft.rfftfreq(npoints, 1 / fs) * SEC_IN_MIN
+    band = (bins >= RATEBAND[0]) & (bins <= RATEBAND[1])
+    result = {}
+    combined = 0
+    collected = None
+    for imu in imus:
+        power, imucollected = windowspectra(decimated(session.quaternions(imu)), size, step)
+        rate = peakrates(power, fs, npoints)
+        rate[imucollected < MINCOLLECTED] = np.nan
+        result[imu] = rate
+        bandpower = power[:, band].sum(axis=1, keepdims=True)
+        combined = combined + np.where(imucollected[:, None] >= MINCOLLECTED, power / np.maximum(bandpower, 1e-12), 0)
+        collected = imucollected if collected is None else np.maximum(collected, imucollected)
+    rate = peakrates(combined, fs, npoints)
+    rate[collected < MINCOLLECTED] = np.nan
+    result["rate"] = rate
+    # middle of the rows a window averages, row 0 at 0s
+    result["seconds"] = ((np.arange(len(rate)) * step + size / 2) * DECIMATE - 0.5) / SAMPLINGRATE
+    return result
+
+def getrates(key, session, window=WINDOW):
+    """
+    respiratoryrate of a session, computed once per session and window size
+    :params key: content address of the session, see cache.sessionkey
+    """
+    with _lock:
+        rates = _rates.get((key, window))
+        if rates is not None:
+            _rates.move_to_end((key, window))
+            return rates
+    rates = respiratoryrate(session, window)
+    with _lock:
+        _rates[(key, window)] = rates
+        while len(_rates) > RATECACHE:
+            _rates.popitem(last=False)
+    return rates
@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+
+from imu import cache
+from imu.pyramid import buildpyramid
+
+# aligned sessions kept in the server memory, the browser only holds the key
+SESSION_TTL = int(os.environ.get("IOBDASH_SESSION_TTL", 3600)) #seconds since last use
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def putsession(key, session, datastats, pyramid):
+    """
+    Keep an aligned session in memory for SESSION_TTL seconds since last use
+    :params key: content address of the log, see cache.sessionkey
+    :params session: aligned session, see compact.CompactSession
+    :params datastats: statistics dict of the session
+    :params pyramid: aggregates of the session, see pyramid.buildpyramid
+    """
+    with _lock:
+        _sessions[key] = [session, datastats, pyramid, time.monotonic() + SESSION_TTL]
+    purgesessions()
+
+def getsession(key):
+    """
+    Fetch a session stored by putsession, from the disk cache once expired
+    or when stored by another server process
+    :params key: content address of the log
+    :returns: (CompactSession, statistics dict, pyramid), None if unknown
+    """
+    if not key:
+        return None
+    with _lock:
+        entry = _sessions.get(key)
+        if entry is not None:
+            entry[-1] = time.monotonic() + SESSION_TTL
+            return entry[0], entry[1], entry[2]
+    cached = cache.loadsession(key)
+    if cached is None:
+        return None
+    session, datastats, pyramid = cached
+    if not pyramid:
+        # cached before aggregates were stored
+        pyramid = buildpyramid(session)
+    putsession(key, session, datastats, pyramid)
+    return session, datastats, pyramid
+
+def purgesessions():
+    # drop the sessions not used for SESSION_TTL seconds
+    now = time.monotonic()
+    with _lock:
+        for key in [k for k, entry in _sessions.items() if entry[-1] < now]:
+            del _sessions[key]
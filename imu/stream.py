@@ -0,0 +1,166 @@
+import numpy as np
+
+from imu.align import (RAWDTYPE, RESETCOUNTER, PLOTCOLS, LINEWIDTH, EPOCH, NOTSTAMP, AlignStats, decodelogs,
+                       tstampcalendar, unwrapcounters, alignedframe, firstepoch, findimus)
+
+BLOCKSIZE = pow(2,20) #bytes read from the log at a time
+BLOCKROWS = 10 * RESETCOUNTER #max aligned rows per yielded block
+QUEUEBLOCKS = 4 #blocks of readings a single imu queue holds while another imu is silent
+MAXQUEUE = QUEUEBLOCKS * (BLOCKSIZE // LINEWIDTH + 1) #max readings waiting in a single imu queue
+
+
+def queuesize(blocksize):
+    # MAXQUEUE when reading blocksize bytes at a time
+    return QUEUEBLOCKS * (blocksize // LINEWIDTH + 1)
+
+def readblocks(fin, blocksize=BLOCKSIZE):
+    """
+    Read a log incrementally and decode it one block of whole lines at a time
+    :params fin: log file opened in binary mode
+    :params blocksize: number of bytes read at a time
+    :returns: generator of dict imuid -> RAWDTYPE array
+    """
+    carry = b""
+    # the first lines set the calendar of the whole log, see tstampcalendar
+    calendar = None
+    while True:
+        block = fin.read(blocksize)
+        if not block:
+            break
+        buf = carry + block
+        cut = buf.rfind(b"\n") + 1
+        carry = buf[cut:]
+        if cut > 0:
+            calendar = calendar or tstampcalendar(buf, 0, cut)
+            yield decodelogs(buf, 0, cut, calendar)
+    if carry:
+        calendar = calendar or tstampcalendar(carry, 0, len(carry))
+        yield decodelogs(carry, 0, len(carry), calendar)
+
+def firstimus(fnamein, blocksize=BLOCKSIZE):
+    # ids of the imus found in the first blocks of a log with any, see findimus
+    with open(fnamein, "rb") as fin:
+        for decoded in readblocks(fin, blocksize):
+            found = findimus(decoded)
+            if found:
+                return found
+    return []
+
+
+class StreamAligner:
+    """
+    Aligns readings pushed a block at a time, holding at most maxqueue
+    readings per IMU. A sample index is emitted once every IMU has moved past
+    it, as align does on the whole session; if an IMU stays silent while
+    another queue is full, the rows are emitted anyway with that IMU missing.
+    """
+
+    def __init__(self, imuids, maxqueue=MAXQUEUE, blockrows=BLOCKROWS):
+        self.imuids = list(imuids)
+        self.maxqueue = maxqueue
+        self.blockrows = blockrows
+        nimus = len(self.imuids)
+        self.pending = [np.empty(0, dtype=RAWDTYPE) for _ in range(nimus)]
+        self.pendidx = [np.empty(0, dtype=np.int64) for _ in range(nimus)]
+        self.last = [None]*nimus
+        self.start = None
+        self.cursor = None
+        self.epoch = None
+        self.lastts = NOTSTAMP
+        self.stats = AlignStats(self.imuids)
+
+    def push(self, decoded):
+        """
+        Queue newly decoded readings
+        :params decoded: dict imuid -> RAWDTYPE array, e.g. from decodelogs
+        :returns: list of aligned dataframes ready to be consumed
+        """
+        for j, imuid in enumerate(self.imuids):
+            readings = decoded.get(imuid)
+            if readings is None or len(readings) == 0:
+                continue
+            if self.start is not None:
+                readings, idx = self.unwrap(j, readings)
+                self.pendidx[j] = np.concatenate((self.pendidx[j], idx))
+            self.pending[j] = np.concatenate((self.pending[j], readings))
+        full = max(len(p) for p in self.pending) > self.maxqueue
+        if self.start is None:
+            if all(len(p) > 0 for p in self.pending) or full:
+                self.begin()
+            else:
+                return []
+        bound = self.bound(self.last)
+        if full:
+            bound = self.bound([self.last[j] for j in range(len(self.imuids))
+                                if len(self.pending[j]) > 0])
+        return self.emit(bound)
+
+    def flush(self):
+        # end of data, emit what the whole session align would have
+        if self.start is None:
+            if not any(len(p) > 0 for p in self.pending):
+                return []
+            self.begin()
+        return self.emit(self.bound(self.last))
+
+    def begin(self):
+        firsts = [int(p["NTH"][0]) for p in self.pending if len(p) > 0]
+        self.start = min(firsts)
+        self.cursor = self.start
+        for j in range(len(self.imuids)):
+            if len(self.pending[j]) > 0:
+                self.pending[j], self.pendidx[j] = self.unwrap(j, self.pending[j])
+        self.epoch = firstepoch(self.pendidx, self.pending, self.start)
+        self.stats.epoch = self.epoch
+
+    def unwrap(self, j, readings):
+        after = self.cursor - 1
+        if self.last[j] is not None:
+            after = max(after, self.last[j])
+        idx = unwrapcounters(readings["NTH"], after)
+        self.last[j] = int(idx[-1])
+        return readings, idx
+
+    def bound(self, lasts):
+        if len(lasts) == 0 or any(x is None for x in lasts):
+            return None
+        return min(lasts)
+
+    def emit(self, bound):
+        blocks = []
+        if bound is None:
+            return blocks
+        while self.cursor <= bound:
+            hi = min(bound + 1, self.cursor + self.blockrows)
+            df, present = alignedframe(self.imuids, self.pendidx, self.pending, self.cursor, hi,
+                                       self.epoch, self.lastts)
+            df.attrs[EPOCH] = self.epoch
+            for j in range(len(self.imuids)):
+                consumed = np.searchsorted(self.pendidx[j], hi)
+                self.pending[j] = self.pending[j][consumed:]
+                self.pendidx[j] = self.pendidx[j][consumed:]
+            self.stats.add(present, df[PLOTCOLS[0]].to_numpy())
+            if len(df) > 0:
+                self.lastts = int(df[PLOTCOLS[0]].iloc[-1])
+            blocks.append(df)
+            self.cursor = hi
+        return blocks
+
+
+def streamalign(fnamein, imuids, blocksize=BLOCKSIZE, maxqueue=None, blockrows=BLOCKROWS, aligner=None):
+    """
+    Parse and align a log in bounded memory, however long the recording is
+    :params fnamein: name of the log file
+    :params imuids: ids of the IMUs to align, in column order
+    :params blocksize: number of bytes read at a time
+    :params maxqueue: max readings waiting in a single imu queue, defaults to queuesize(blocksize)
+    :params blockrows: max rows in a yielded dataframe
+    :params aligner: StreamAligner to use, to read its stats once done
+    :returns: generator of aligned dataframes, in sample order
+    """
+    if aligner is None:
+        aligner = StreamAligner(imuids, maxqueue or queuesize(blocksize), blockrows)
+    with open(fnamein, "rb") as fin:
+        for decoded in readblocks(fin, blocksize):
+            yield from aligner.push(decoded)
+    yield from aligner.flush()
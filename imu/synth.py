@@ -0,0 +1,240 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from imu.align import (RAWDTYPE, RESETCOUNTER, SAMPLINGRATE, MS_IN_SEC, SEC_IN_MIN, SEC_IN_HR, TSYEAR,
+                       QSCALE, BLANK, DISCARD, TSTAMP_START, LINEWIDTH, encodelogs)
+
+START = datetime(TSYEAR, 6, 29, 10, 37, 11, 706000) #first timestamp of the generated sessions
+MS_IN_SAMPLE = MS_IN_SEC // SAMPLINGRATE
+RESPRATE = (12, 20) #breaths per minute, the mean rate of a session is drawn in this range
+RATESWING = 0.15 #slow relative swing of the breathing rate
+BREATHDEPTH = 0.12 #radians the chest rotates with a breath
+COUPLING = [1.0, 0.8, 0.05] #breathing seen by imus 1 (thorax), 2 (abdomen), 3 (reference); others random
+ABDOMENLAG = 0.4 #radians of breathing phase the abdomen lags the thorax
+ANGLENOISE = 0.01 #radians
+POSTURES = ["rest", "sitting", "standing", "walking", "recovery"]
+POSTUREMINUTES = 10 #mean minutes between two posture changes
+BATTERYSTART = (0x58, 0x5F) #battery level of a fresh imu
+BATTERYDRAIN = (1, 4) #battery units lost per hour
+IMULAG = 33 #ms between the readings of two imus of the same sample
+JITTER = 10 #ms, upper bound of the timestamp jitter
+CLOCKPPM = 50 #bound of the clock drift of an imu, parts per million
+BLANKSHARE = 0.5 #lost samples logged as BLANK readings, the others are not in the log
+CHUNK = pow(2,20) #readings encoded at a time when writing
+HEADER = """ID Patient: {patient}
+Info recording: synthetic, seed {seed}
+Device body location: chest left side (1st lead)
+Real time postures and extra info recording:
+{events}
+
+Recording started at: {start}
+
+START:
+"""
+
+
+@dataclass
+class LossModel:
+    """
+    Gilbert-Elliott packet loss of one imu: a good and a bad state, with
+    their own loss probabilities, and the per sample transition
+    probabilities between them. Losses come in bursts of mean length 1/r.
+    """
+    p: float = 0.005 #good -> bad
+    r: float = 0.25 #bad -> good
+    goodloss: float = 0.0
+    badloss: float = 1.0
+
+    @classmethod
+    def bursty(cls, rate, burst=4):
+        """
+        All the samples of the bad state lost, none of the good one
+        :params rate: long run fraction of lost samples, 0 <= rate < 1
+        :params burst: mean length of a burst, in samples, at least 1
+        """
+        if not 0 <= rate < 1:
+            raise ValueError(f"Loss rate {rate} out of [0, 1)")
+        if burst < 1:
+            raise ValueError(f"Burst length {burst} shorter than a sample")
+        r = 1 / burst
+        return cls(p=rate * r / (1 - rate), r=r)
+
+    @property
+    def rate(self):
+        # long run fraction of lost samples
+        bad = self.p / (self.p + self.r) if self.p + self.r > 0 else 0
+        return (1 - bad) * self.goodloss + bad * self.badloss
+
+    def states(self, n, rng):
+        """
+        Bad state of n samples, drawn as alternating runs of geometric length
+        :returns: bool array, True in the bad state
+        """
+        if self.p == 0:
+            return np.zeros(n, dtype=bool)
+        if self.r == 0:
+            # the bad state is never left
+            return np.arange(n) >= rng.geometric(self.p)
+        bad = rng.random() < self.p / (self.p + self.r)
+        states = []
+        total = 0
+        while total < n:
+            # enough runs for the expected length and then some
+            nruns = int((n - total) * self.p * self.r / (self.p + self.r)) + 16
+            good = rng.geometric(self.p, nruns)
+            badruns = rng.geometric(self.r, nruns)
+            runs = np.column_stack((badruns, good) if bad else (good, badruns)).ravel()
+            states.append(np.repeat(np.tile([bad, not bad], nruns), runs))
+            total += int(runs.sum())
+        return np.concatenate(states)[:n]
+
+    def lost(self, n, rng):
+        # lost samples out of n
+        lossprob = np.where(self.states(n, rng), self.badloss, self.goodloss)
+        return rng.random(n) < lossprob
+
+
+def breathing(n, rng):
+    """
+    Breathing pattern of a session, shared by its imus: a rate swinging
+    slowly around a random mean and a depth changing over the minutes
+    :returns: phase in radians, relative depth, per sample
+    """
+    t = np.arange(n) / SAMPLINGRATE
+    mean = rng.uniform(*RESPRATE) / SEC_IN_MIN
+    periods = rng.uniform([180, 40], [600, 90])
+    offsets = rng.uniform(0, 2*np.pi, 2)
+    rate = mean * (1 + RATESWING * (0.6 * np.sin(2*np.pi*t/periods[0] + offsets[0])
+                                    + 0.4 * np.sin(2*np.pi*t/periods[1] + offsets[1])))
+    phase = 2*np.pi * np.cumsum(rate) / SAMPLINGRATE
+    depth = 1 + 0.2 * np.sin(2*np.pi*t/rng.uniform(60, 300) + rng.uniform(0, 2*np.pi))
+    return phase, depth
+
+def postures(n, rng):
+    """
+    Posture changes of a session, at exponential intervals
+    :returns: list of (sample, label), the first at sample 0
+    """
+    mean = POSTUREMINUTES * SEC_IN_MIN * SAMPLINGRATE
+    starts = np.cumsum(rng.exponential(mean, int(n / mean) + 8)).astype(np.int64)
+    starts = np.concatenate(([0], starts[starts < n]))
+    labels = rng.choice(POSTURES, len(starts))
+    return list(zip(starts.tolist(), labels.tolist()))
+
+def imuangles(j, n, phase, depth, events, rng):
+    # rotation angle of imu j: posture plus breathing plus noise
+    coupling = COUPLING[j] if j < len(COUPLING) else rng.uniform(0.3, 1.0)
+    lag = ABDOMENLAG if j == 1 else 0
+    # the chest moves faster in than out
+    breath = np.sin(phase - lag) + 0.25 * np.sin(2 * (phase - lag))
+    starts = np.array([sample for sample, label in events])
+    posture = rng.uniform(0.2, 1.2, len(starts))[np.searchsorted(starts, np.arange(n), side="right") - 1]
+    return posture + coupling * BREATHDEPTH * depth * breath + rng.normal(0, ANGLENOISE, n)
+
+def quaternions(angle, axis):
+    # int8 quaternions of rotations by angle about a fixed unit axis
+    q = np.empty((len(angle), 4))
+    q[:, 0] = np.cos(angle / 2)
+    q[:, 1:] = np.sin(angle / 2)[:, None] * axis
+    return np.clip(np.rint(q * QSCALE), -QSCALE, QSCALE).astype(np.int8)
+
+def synthimuids(nimus):
+    # 1, 2, 3, 5, ...: DISCARD ids are not imus
+    discard = [int(x[1:3], 16) for x in DISCARD]
+    imuids = []
+    imuid = 1
+    while len(imuids) < nimus:
+        if imuid not in discard:
+            imuids.append(imuid)
+        imuid += 1
+    return imuids
+
+def tstampof(when):
+    # datetime -> ms since TSYEAR-01-01, the TSTAMP of the logs
+    return (when - datetime(TSYEAR, 1, 1)) // timedelta(milliseconds=1)
+
+def synthsession(seconds, nimus, loss=None, seed=0, start=START):
+    """
+    Readings of a synthetic session, with whole arrays: breathing-like
+    quaternions, slowly draining batteries, counters wrapping every
+    RESETCOUNTER samples, jittered and drifting timestamps, and burst loss
+    :params seconds: duration of the session
+    :params nimus: number of imus, see synthimuids
+    :params loss: LossModel of all the imus, or a list with one per imu, None for no loss
+    :params seed: seed of the random generator, same seed same session
+    :params start: datetime of the first sample
+    :returns: RAWDTYPE array in log order, list of (ms, posture) events
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLINGRATE)
+    if loss is None or isinstance(loss, LossModel):
+        loss = [loss] * nimus
+    first = tstampof(start)
+    firstCounter = int(rng.integers(RESETCOUNTER))
+    samples = np.arange(n)
+    phase, depth = breathing(n, rng)
+    events = postures(n, rng)
+    parts = []
+    for j, imuid in enumerate(synthimuids(nimus)):
+        readings = np.zeros(n, dtype=RAWDTYPE)
+        readings["IMUID"] = imuid
+        readings["NTH"] = (firstCounter + samples) % RESETCOUNTER
+        level = rng.uniform(*BATTERYSTART) - rng.uniform(*BATTERYDRAIN) * samples / (SEC_IN_HR * SAMPLINGRATE)
+        readings["BATTERY"] = np.clip(level, 0, None)
+        axis = rng.normal(size=3)
+        readings["Q"] = quaternions(imuangles(j, n, phase, depth, events, rng), axis / np.linalg.norm(axis))
+        drift = 1 + rng.uniform(-CLOCKPPM, CLOCKPPM) * 1e-6
+        readings["TSTAMP"] = (first + np.rint(samples * MS_IN_SAMPLE * drift).astype(np.int64)
+                              + j * IMULAG + rng.integers(0, JITTER, n))
+        if loss[j] is not None:
+            lost = loss[j].lost(n, rng)
+            blank = lost & (rng.random(n) < BLANKSHARE)
+            readings["CHECK"][blank] = int(BLANK, 16)
+            readings["BATTERY"][blank] = 0
+            readings["NTH"][blank] = 0
+            readings["Q"][blank] = 0
+            readings = readings[~lost | blank]
+        parts.append(readings)
+    readings = np.concatenate(parts)
+    readings = readings[np.argsort(readings["TSTAMP"], kind="stable")]
+    return readings, [(first + sample * MS_IN_SAMPLE, label) for sample, label in events]
+
+def synthheader(readings, events, seed=0, patient="Synthetic"):
+    """
+    Header block of a synthetic log, the posture changes as extra info and
+    a DISCARD reading opening the data section, as in the recorded logs
+    :returns: bytes up to the first reading of readings
+    """
+    first = np.zeros(1, dtype=RAWDTYPE)
+    first["IMUID"] = int(DISCARD[0][1:3], 16)
+    first["TSTAMP"] = readings["TSTAMP"][0] - JITTER if len(readings) else tstampof(START)
+    line = encodelogs(first)
+    lines = []
+    for ms, label in events:
+        when = datetime(TSYEAR, 1, 1) + timedelta(milliseconds=ms)
+        lines.append(f"- Additional info: {label} ({when:%H:%M:%S})")
+    header = HEADER.format(patient=patient, seed=seed, events="\n".join(lines),
+                           start=line[TSTAMP_START:LINEWIDTH].decode())
+    return header.encode() + line
+
+def synthlog(seconds, nimus, loss=None, seed=0, start=START):
+    """
+    Synthetic log in the S12_*.txt format, header block included
+    :returns: bytes of the log, see synthsession
+    """
+    readings, events = synthsession(seconds, nimus, loss, seed, start)
+    return synthheader(readings, events, seed) + encodelogs(readings)
+
+def writesynth(fname, seconds, nimus, loss=None, seed=0, start=START):
+    """
+    Write a synthetic log, CHUNK readings at a time
+    :returns: RAWDTYPE readings written, see synthsession
+    """
+    readings, events = synthsession(seconds, nimus, loss, seed, start)
+    with open(fname, "wb") as fout:
+        fout.write(synthheader(readings, events, seed))
+        for first in range(0, len(readings), CHUNK):
+            fout.write(encodelogs(readings[first:first+CHUNK]))
+    return readings
@@ -0,0 +1,58 @@
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+# run from anywhere, the imu package lives at the repository root
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from imu.synth import LossModel, writesynth, synthimuids
+from imu.align import SAMPLINGRATE, SEC_IN_HR, BLANK
+
+
+def floats(text):
+    return [float(x) for x in text.split(",") if x]
+
+def pick(values, j):
+    # value of imu j, the last one repeated for the imus past the list
+    return values[min(j, len(values) - 1)]
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="Write a synthetic imu log in the recorded format")
+    parser.add_argument("output", help="name of the log to write")
+    parser.add_argument("--hours", type=float, default=1, help="duration of the session")
+    parser.add_argument("--imus", type=int, default=3, help="number of imus")
+    parser.add_argument("--loss", type=floats, default=[0.02], help="fraction of lost samples, comma separated per imu")
+    parser.add_argument("--burst", type=floats, default=[4], help="mean samples of a loss burst, comma separated per imu")
+    parser.add_argument("--goodloss", type=floats, help="Gilbert-Elliott loss probability of the good state, per imu; "
+                        "with --p and --r instead of --loss and --burst")
+    parser.add_argument("--badloss", type=floats, default=[1.0], help="Gilbert-Elliott loss probability of the bad state, per imu")
+    parser.add_argument("--p", type=floats, help="Gilbert-Elliott good to bad probability, per imu")
+    parser.add_argument("--r", type=floats, help="Gilbert-Elliott bad to good probability, per imu")
+    parser.add_argument("--seed", type=int, default=0, help="same seed, same session")
+    args = parser.parse_args(argv[1:])
+
+    models = []
+    for j in range(args.imus):
+        if args.p is not None and args.r is not None:
+            models.append(LossModel(pick(args.p, j), pick(args.r, j), pick(args.goodloss or [0.0], j), pick(args.badloss, j)))
+        else:
+            try:
+                models.append(LossModel.bursty(pick(args.loss, j), pick(args.burst, j)))
+            except ValueError as e:
+                parser.error(str(e))
+    t0 = time.perf_counter()
+    readings = writesynth(args.output, args.hours * SEC_IN_HR, args.imus, models, args.seed)
+    elapsed = time.perf_counter() - t0
+    nsamples = int(args.hours * SEC_IN_HR * SAMPLINGRATE)
+    print("Synthetic log saved in file ", args.output, "in {:.1f}s".format(elapsed))
+    print("Size:\t\t\t", "{:.1f}MB".format(pathlib.Path(args.output).stat().st_size / pow(2,20)))
+    print("Samples per imu:\t", nsamples)
+    collected = readings["CHECK"] != int(BLANK, 16)
+    for imuid, model in zip(synthimuids(args.imus), models):
+        received = np.count_nonzero(collected & (readings["IMUID"] == imuid))
+        print("IMU {:02d} lost:\t\t {:.2f}% (model {:.2f}%)".format(imuid, 100 * (1 - received / nsamples), 100 * model.rate))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,12 @@
+import os
+import pathlib
+import sys
+import tempfile
+
+# run from anywhere, the imu package lives at the repository root
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# sessions and jobs of the tests never end up in the user cache
+WORKDIR = pathlib.Path(tempfile.mkdtemp(prefix="iobtests"))
+os.environ["IOBDASH_CACHE"] = str(WORKDIR.joinpath("cache"))
+os.environ["IOBDASH_JOBS"] = str(WORKDIR.joinpath("jobs"))
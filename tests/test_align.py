@@ -0,0 +1,65 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from imu.align import (decodelogs, convertlogs, alignarrays, align, findimus, colnameimudata, formattstamps,
+                       PLOTCOLS, AlignStats)
+from bench import reference
+
+DATA = pathlib.Path(__file__).resolve().parent.parent.joinpath("data")
+LOGS = sorted(DATA.glob("S12_*.txt"))
+IMUIDS = [1, 2, 3]
+
+
+@pytest.fixture(scope="module", params=LOGS, ids=lambda f: f.name)
+def session(request):
+    raw = request.param.read_bytes()
+    rows = reference.align(reference.convertlogs(raw.decode(), len(IMUIDS)), IMUIDS)
+    return raw, rows
+
+def assert_matches(df, stats, rows, imuids):
+    assert len(df) == stats.total == len(rows)
+    assert df[PLOTCOLS[1]].tolist() == [row[1] for row in rows]
+    cols = [col for imuid in imuids for col in colnameimudata(imuid)]
+    values = np.array([row[2:] for row in rows], dtype=float)
+    assert np.array_equal(df[cols].to_numpy(), values, equal_nan=True)
+    # the timestamps of the empty rows are estimated, the reference leaves them out
+    collected = ~np.isnan(values[:, 1::5]).all(axis=1)
+    ts = formattstamps(df[PLOTCOLS[0]].to_numpy()[collected], stats.epoch)
+    assert list(ts) == [row[0] for row, keep in zip(rows, collected) if keep]
+    assert stats.nfill == int(np.isnan(values[:, 1::5]).sum())
+    assert stats.empty == sum(row[0] == 0 for row in rows)
+    nmissing = np.isnan(values[:, 1::5]).sum(axis=1)
+    assert stats.outof.tolist() == np.bincount(nmissing, minlength=len(imuids) + 1).tolist()
+    assert stats.todict() == AlignStats.fromframe(df, imuids).todict()
+
+def test_alignarrays_matches_reference(session):
+    raw, rows = session
+    df, stats = alignarrays(decodelogs(raw), IMUIDS)
+    assert_matches(df, stats, rows, IMUIDS)
+
+def test_more_imus(session):
+    # a fourth sensor sending what the first one does, one sample later
+    raw, _ = session
+    lines = raw.rstrip().split(b"\n")
+    extra = [b"[06]" + line[4:16] + b"%02X" % ((int(line[16:18], 16) + 1) % 256) + line[18:]
+             for line in lines if line.startswith(b"[01]") and line[11:13] != b"FF"]
+    raw = b"\n".join(lines + extra)
+    decoded = decodelogs(raw)
+    imuids = findimus(decoded)
+    assert imuids == [1, 2, 3, 6]
+    rows = reference.align(reference.convertlogs(raw.decode(), len(imuids)), imuids)
+    df, stats = alignarrays(decoded, imuids)
+    assert_matches(df, stats, rows, imuids)
+
+def test_align_counts(session):
+    raw, rows = session
+    df, noutof, ns, timediff = align(convertlogs(raw.decode(), len(IMUIDS)), len(IMUIDS))
+    assert sum(noutof) == ns == len(rows)
+    assert noutof[-1] == sum(row[0] == 0 for row in rows)
+
+def test_missing_imu():
+    raw = LOGS[0].read_bytes()
+    df, stats = alignarrays(decodelogs(raw), [1, 2, 3, 5])
+    assert stats.total == 0 and len(df.columns) == len(PLOTCOLS) + 4 * 5
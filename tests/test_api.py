@@ -0,0 +1,59 @@
+from datetime import datetime, time
+
+import numpy as np
+import pytest
+
+from imu import api
+from imu.align import formattstamps, MS_IN_SEC, TSYEAR
+
+MS_IN_HR = 3600 * MS_IN_SEC
+START = datetime(TSYEAR, 6, 29, 23, 58, 0)
+SECONDS = 300 #of the session
+WINDOW = 5 #seconds
+
+
+def tstampof(when):
+    # ms since TSYEAR-01-01, as decoded
+    return int((np.datetime64(when, "ms") - np.datetime64(str(TSYEAR) + "-01-01", "ms")).astype(np.int64))
+
+def test_msofday_same_day():
+    assert api.msofday(time(11), 10 * MS_IN_HR, 12 * MS_IN_HR) == 11 * MS_IN_HR
+
+def test_msofday_clamped_to_start():
+    assert api.msofday(time(9), 10 * MS_IN_HR, 12 * MS_IN_HR) == 10 * MS_IN_HR
+
+def test_msofday_past_midnight():
+    assert api.msofday(time(1), 10 * MS_IN_HR, api.MS_IN_DAY + 2 * MS_IN_HR) == api.MS_IN_DAY + MS_IN_HR
+
+def test_msofday_before_start_not_reached():
+    # the next day's time is after the session, the start is used
+    assert api.msofday(time(9), 10 * MS_IN_HR, api.MS_IN_DAY + 2 * MS_IN_HR) == 10 * MS_IN_HR
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    # per imu files of a session running past midnight, the clocks a few ms apart
+    nsamples = SECONDS * api.SAMPLES4SEC
+    for j, fname in enumerate(api.IMUFILES):
+        tstamps = formattstamps(tstampof(START) + np.arange(nsamples) * 100 + 7 * j)
+        lines = ["[%02X],[5C],[00],[%02X],[3F],[12],[94],[FF],%s\n" % (j + 1, i % api.RESETCOUNTER, ts)
+                 for i, ts in enumerate(tstamps)]
+        tmp_path.joinpath(fname).write_text("".join(lines))
+    monkeypatch.setattr(api, "DATA_PATH", tmp_path)
+    api._sources.clear()
+    yield
+    api._sources.clear()
+
+def firstreading(df):
+    return df.attrs["epoch"] + int(np.nanmin(df["TSTAMP"]))
+
+def test_window_after_midnight(sources):
+    df = api.get_imu_data(time(0, 1, 0), WINDOW)[0]
+    assert len(df) == WINDOW * api.SAMPLES4SEC
+    first = firstreading(df)
+    assert tstampof(datetime(TSYEAR, 6, 30, 0, 1)) <= first < tstampof(datetime(TSYEAR, 6, 30, 0, 1, 1))
+
+def test_window_before_session(sources):
+    # a start before the session is clamped to its first reading
+    df = api.get_imu_data(time(23, 50), WINDOW)[0]
+    assert firstreading(df) - tstampof(START) < MS_IN_SEC
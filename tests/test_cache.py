@@ -0,0 +1,45 @@
+import os
+import pathlib
+
+import numpy as np
+
+from imu import cache
+from imu.align import decodelogs, alignarrays
+from imu.compact import CompactSession
+from imu.pyramid import buildpyramid
+
+LOG = pathlib.Path(__file__).resolve().parent.parent.joinpath("data", "S12_cammino.txt")
+IMUS = ["01", "02", "03"]
+
+
+def aligned():
+    df, stats = alignarrays(decodelogs(LOG.read_bytes()), [1, 2, 3])
+    return CompactSession.fromframe(df, IMUS), stats.todict()
+
+def test_roundtrip(tmp_path):
+    session, datastats = aligned()
+    key = cache.filekey(str(LOG))
+    assert key == cache.sessionkey(LOG.read_bytes())
+    pyramid = buildpyramid(session)
+    cache.savesession(key, session, datastats, pyramid, cachedir=tmp_path)
+    loaded, loadedstats, loadedpyramid = cache.loadsession(key, cachedir=tmp_path)
+    assert loaded.toframe().equals(session.toframe())
+    assert loadedstats == datastats
+    assert loadedpyramid.keys() == pyramid.keys()
+    for seconds, level in pyramid.items():
+        for name, values in level.items():
+            assert np.array_equal(loadedpyramid[seconds][name], values)
+
+def test_missing_entry(tmp_path):
+    assert cache.loadsession("0" * 64, cachedir=tmp_path) is None
+
+def test_evict_least_recently_used(tmp_path):
+    session, datastats = aligned()
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.savesession(key, session, datastats, cachedir=tmp_path)
+        os.utime(cache.cachepath(key, tmp_path), (i, i))
+    # reading b makes it the most recently used
+    assert cache.loadsession("b", cachedir=tmp_path) is not None
+    size = cache.cachepath("a", tmp_path).stat().st_size
+    cache.evict(tmp_path, maxbytes=2 * size)
+    assert sorted(p.stem for p in tmp_path.glob("*" + cache.CACHE_EXT)) == ["b", "c"]
@@ -0,0 +1,56 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from imu.align import decodelogs, alignarrays, SAMPLINGRATE
+from imu.compact import CompactSession, alignsession
+from imu.pyramid import buildpyramid, PyramidBuilder
+
+LOG = pathlib.Path(__file__).resolve().parent.parent.joinpath("data", "S12_cammino.txt")
+IMUIDS = [1, 2, 3]
+
+
+@pytest.fixture(scope="module")
+def aligned():
+    decoded = decodelogs(LOG.read_bytes())
+    df, stats = alignarrays(decoded, IMUIDS)
+    return decoded, df, stats
+
+def test_toframe_roundtrip(aligned):
+    decoded, df, stats = aligned
+    session = CompactSession.fromframe(df, IMUIDS)
+    assert session.toframe().equals(df)
+    assert session.epoch == df.attrs["epoch"]
+    # the float64 frame is several times larger than the raw bytes
+    assert session.nbytes * 5 < df.memory_usage(index=False).sum()
+
+def test_alignsession_matches_alignarrays(aligned):
+    decoded, df, stats = aligned
+    session, sessionstats = alignsession(decoded, IMUIDS)
+    assert session.toframe().equals(df)
+    assert sessionstats.todict() == stats.todict()
+
+def test_lazy_values(aligned):
+    decoded, df, stats = aligned
+    session = CompactSession.fromframe(df, IMUIDS)
+    q = session.quaternions("02")
+    assert q.dtype == np.float32
+    assert np.array_equal(np.isnan(q[:, 0]), df["02_1"].isna().to_numpy())
+    assert np.allclose(q, df[["02_1", "02_2", "02_3", "02_4"]].to_numpy(), equal_nan=True)
+
+@pytest.mark.parametrize("rows", [7 * SAMPLINGRATE + 3, 1000])
+def test_blocks_match_whole(aligned, rows):
+    # as the streamed aligner builds the cache entry
+    decoded, df, stats = aligned
+    blocks = [CompactSession.fromframe(df.iloc[i:i + rows], IMUIDS) for i in range(0, len(df), rows)]
+    builder = PyramidBuilder()
+    for block in blocks:
+        builder.add(block)
+    pyramid = builder.finish()
+    expected = buildpyramid(CompactSession.fromframe(df, IMUIDS))
+    assert pyramid.keys() == expected.keys()
+    for seconds, level in expected.items():
+        for name, values in level.items():
+            assert np.array_equal(pyramid[seconds][name], values)
+    assert CompactSession.concat(blocks).toframe().equals(df)
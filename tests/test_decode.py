@@ -0,0 +1,73 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from imu import align
+from imu.align import (decodelogs, decodelogs_parallel, convertlogs, loaddata_convert, loadlogs,
+                       chunkranges, datastart, RAWDTYPE)
+from bench import reference
+
+DATA = pathlib.Path(__file__).resolve().parent.parent.joinpath("data")
+LOGS = sorted(DATA.glob("S12_*.txt"))
+NIMUS = 3
+
+HEADER = b"ID Patient: Test\n\nRecording started at: 29:06:10:37:11:706\n\nSTART:\n"
+LINES = [b"[04],[00],[00],[00],[00],[47],[64],[03],29:06:10:37:11:706",
+         b"[01],[5C],[00],[00],[3F],[12],[94],[FF],29:06:10:37:11:813",
+         b"[02],[00],[FF],[00],[00],[00],[00],[00],29:06:10:37:11:879",
+         b"[02],[5B],[00],[01],[80],[7F],[00],[01],29:06:10:37:11:946"]
+
+
+@pytest.mark.parametrize("fname", LOGS, ids=lambda f: f.name)
+def test_convertlogs_matches_reference(fname):
+    text = fname.read_text()
+    assert convertlogs(text, NIMUS) == reference.convertlogs(text, NIMUS)
+
+@pytest.mark.parametrize("fname", LOGS, ids=lambda f: f.name)
+def test_loaddata_convert_matches_text(fname):
+    assert loaddata_convert(str(fname), NIMUS) == convertlogs(fname.read_text(), NIMUS)
+
+def test_decode_fields():
+    decoded = decodelogs(HEADER + b"\n".join(LINES) + b"\n")
+    assert sorted(decoded) == [1, 2, 4]
+    readings = decoded[2]
+    # the BLANK reading is dropped
+    assert len(readings) == 1
+    assert readings.dtype == RAWDTYPE
+    assert readings["BATTERY"][0] == 0x5B
+    assert readings["NTH"][0] == 1
+    assert readings["Q"][0].tolist() == [-128, 127, 0, 1]
+
+def test_truncated_and_blank_lines_skipped():
+    text = HEADER + LINES[1] + b"\n\n" + LINES[3][:30] + b"\n" + LINES[3]
+    decoded = decodelogs(text)
+    assert len(decoded[1]) == 1 and len(decoded[2]) == 1
+
+def test_datastart():
+    text = HEADER + LINES[0]
+    assert datastart(text) == len(HEADER)
+    assert datastart(b"no data") == len(b"no data")
+    assert decodelogs(b"no data") == {}
+
+def test_parallel_matches_serial(tmp_path, monkeypatch):
+    # small chunks so that the log is split among the workers
+    monkeypatch.setattr(align, "MINCHUNK", pow(2,14))
+    text = LOGS[0].read_bytes()
+    fname = tmp_path.joinpath("log.txt")
+    fname.write_bytes(text)
+    serial = decodelogs(text)
+    for parallel in (loadlogs(str(fname), 4), decodelogs_parallel(text, 4)):
+        assert serial.keys() == parallel.keys()
+        for imuid in serial:
+            assert np.array_equal(serial[imuid], parallel[imuid])
+    assert convertlogs(text.decode(), NIMUS, 4) == convertlogs(text.decode(), NIMUS)
+
+def test_chunkranges_on_line_boundaries(monkeypatch):
+    monkeypatch.setattr(align, "MINCHUNK", pow(2,14))
+    text = LOGS[0].read_bytes()
+    ranges = chunkranges(text, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == datastart(text) and ranges[-1][1] == len(text)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and text[end - 1:end] == b"\n"
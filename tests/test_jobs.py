@@ -0,0 +1,58 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from imu import jobs, cache, align
+from imu.align import decodelogs
+from imu.cache import sessionkey
+
+LOG = pathlib.Path(__file__).resolve().parent.parent.joinpath("data", "S12_cammino.txt")
+
+
+def queuejob(jobsdir, raw, filename="log.txt"):
+    # what submitjob leaves for the workers, without starting the pool
+    jobsdir.mkdir(exist_ok=True)
+    jobid = "job" + str(len(list(jobsdir.glob("*" + jobs.STATE))))
+    jobs.jobpath(jobid, jobs.UPLOAD, jobsdir).write_bytes(raw)
+    jobs.writestate({"id": jobid, "filename": filename, "status": jobs.QUEUED, "stage": jobs.QUEUED,
+                     "progress": 0.0}, jobsdir)
+    return jobid
+
+def test_ingest(tmp_path):
+    raw = LOG.read_bytes()
+    jobid = queuejob(tmp_path, raw)
+    state = jobs.ingest(jobid, tmp_path)
+    assert state["status"] == jobs.DONE and state["progress"] == 1.0
+    assert state["key"] == sessionkey(raw)
+    assert jobs.jobstate(jobid, tmp_path) == state
+    assert cache.loadsession(state["key"]) is not None
+    assert not jobs.jobpath(jobid, jobs.UPLOAD, tmp_path).exists()
+
+def test_unsupported_format(tmp_path):
+    jobid = queuejob(tmp_path, b"", "log.bin")
+    state = jobs.ingest(jobid, tmp_path)
+    assert state["status"] == jobs.ERROR
+
+def test_cancel_queued(tmp_path):
+    jobid = queuejob(tmp_path, LOG.read_bytes())
+    assert jobs.canceljob(jobid, tmp_path)["status"] == jobs.CANCELLED
+    # the upload is dropped and the job never runs
+    assert not jobs.jobpath(jobid, jobs.UPLOAD, tmp_path).exists()
+    assert jobs.ingest(jobid, tmp_path)["status"] == jobs.CANCELLED
+
+@pytest.mark.parametrize("nworkers", [1, 2])
+def test_parsefile_matches_decodelogs(tmp_path, monkeypatch, nworkers):
+    # small chunks so that the log is split among the workers
+    monkeypatch.setattr(jobs, "MINCHUNK", pow(2,14))
+    monkeypatch.setattr(align, "MINCHUNK", pow(2,14))
+    raw = LOG.read_bytes()
+    state = {"id": "parse", "stage": jobs.QUEUED, "progress": 0.0}
+    fname = tmp_path.joinpath("log.txt")
+    fname.write_bytes(raw)
+    parsed = jobs.parsefile(fname, state, tmp_path, nworkers)
+    whole = decodelogs(raw)
+    assert parsed.keys() == whole.keys()
+    for imuid in whole:
+        assert np.array_equal(parsed[imuid], whole[imuid])
+    assert state["stage"] == "parse" and state["progress"] == 2 / len(jobs.STAGES)
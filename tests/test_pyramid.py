@@ -0,0 +1,40 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from imu.align import decodelogs, alignarrays, colnameimudata, SAMPLINGRATE
+from imu.compact import CompactSession
+from imu.pyramid import buildpyramid, windowcounts, windowstats, levelmean
+
+LOG = pathlib.Path(__file__).resolve().parent.parent.joinpath("data", "S12_cammino.txt")
+IMUS = ["01", "02", "03"]
+
+
+@pytest.fixture(scope="module")
+def session():
+    df, stats = alignarrays(decodelogs(LOG.read_bytes()), [1, 2, 3])
+    return df, stats, buildpyramid(CompactSession.fromframe(df, IMUS))
+
+def test_whole_session_matches_alignstats(session):
+    df, stats, pyramid = session
+    windowed = windowstats(pyramid, IMUS)
+    for name, value in stats.todict().items():
+        # the window is given in seconds, not by the first timestamp
+        if name not in ("timewindow", "epoch", "start"):
+            assert windowed[name] == value
+
+@pytest.mark.parametrize("start,stop", [(0, 1), (7, 613), (59, 61), (600, 1200), (0, 10000)])
+def test_window_matches_rows(session, start, stop):
+    df, stats, pyramid = session
+    rows = df.iloc[start * SAMPLINGRATE:stop * SAMPLINGRATE]
+    totals = windowcounts(pyramid, start, stop)
+    present = np.stack([rows[colnameimudata(imu)[1]].notna().to_numpy() for imu in IMUS], axis=1)
+    assert totals["nrows"] == len(rows)
+    assert totals["collected"].tolist() == present.sum(axis=0).tolist()
+    assert totals["full"] == present.all(axis=1).sum()
+    assert totals["empty"] == (~present.any(axis=1)).sum()
+    qmean, batmean = levelmean(totals)
+    for j, imu in enumerate(IMUS):
+        assert np.isclose(batmean[j], rows[colnameimudata(imu)[0]].mean())
+        assert np.allclose(qmean[j], rows[colnameimudata(imu)[1:]].mean().to_numpy())
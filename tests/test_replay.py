@@ -0,0 +1,49 @@
+import io
+import pathlib
+
+import pytest
+
+from imu.align import decodelogs, encodelogs, alignarrays
+from imu.replay import Recording, Replay, replay
+
+LOG = pathlib.Path(__file__).resolve().parent.parent.joinpath("data", "S12_cammino.txt")
+IMUIDS = [1, 2, 3]
+TSTAMP = 160 * 24 * 3600 * 1000 #replay start, in June as the recording
+
+
+@pytest.fixture(scope="module")
+def decoded():
+    return decodelogs(LOG.read_bytes())
+
+def test_encode_roundtrip(decoded):
+    for imuid, readings in decoded.items():
+        assert decodelogs(encodelogs(readings))[imuid].tobytes() == readings.tobytes()
+
+def test_replay_aligns_as_recorded(decoded):
+    recording = Recording(decoded, IMUIDS)
+    out = io.BytesIO()
+    session = Replay(recording, [out], tstamp=TSTAMP)
+    session.write(recording.nsamples)
+    assert session.done
+    df, stats = alignarrays(decoded, IMUIDS)
+    replayed, replayedstats = alignarrays(decodelogs(out.getvalue()), IMUIDS)
+    assert replayed.equals(df)
+    # the same session, moved to the replay start
+    assert replayedstats.epoch == TSTAMP
+    for name, value in stats.todict().items():
+        if name not in ("epoch", "start"):
+            assert replayedstats.todict()[name] == value
+
+def test_loop_counters(decoded):
+    # the second pass goes on with the counters and the clock
+    recording = Recording(decoded, IMUIDS)
+    out = io.BytesIO()
+    Replay(recording, [out], loop=True, tstamp=TSTAMP).write(2 * recording.nsamples)
+    once = alignarrays(decoded, IMUIDS)[0]
+    df, stats = alignarrays(decodelogs(out.getvalue()), IMUIDS)
+    assert len(df) == recording.nsamples + len(once)
+    assert df.iloc[recording.nsamples:, 2:].reset_index(drop=True).equals(once.iloc[:, 2:])
+
+def test_speed_bounds(decoded):
+    with pytest.raises(ValueError):
+        replay([], speed=0)
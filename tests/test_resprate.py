@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from imu.align import SAMPLINGRATE, SEC_IN_MIN, QSCALE
+from imu.compact import CompactSession
+from imu.resprate import respiratoryrate, nfft, WINDOWS, DECIMATE, THORAX, ABDOMEN
+
+SECONDS = 600
+RATES = (12.5, 23.3) #breaths per minute of the first and second half, between two bins
+DEPTH = 0.3 #radians
+
+
+def sinesession(rates=RATES, seconds=SECONDS):
+    # thorax and abdomen rotating back and forth at rates[0], then at rates[1] from the middle on
+    n = seconds * SAMPLINGRATE
+    t = np.arange(n) / SAMPLINGRATE
+    freq = np.where(t < seconds / 2, rates[0], rates[1]) / SEC_IN_MIN
+    angle = DEPTH * np.sin(2 * np.pi * np.cumsum(freq) / SAMPLINGRATE)
+    axis = np.array([0.6, 0.0, 0.8])
+    quat = np.column_stack((np.cos(angle / 2), np.sin(angle / 2)[:, None] * axis))
+    q = np.rint(np.repeat(quat[:, None], 3, axis=1) * QSCALE).astype(np.int8)
+    return CompactSession.fromrows(["01", "02", "03"], 0, np.arange(n) * (1000 // SAMPLINGRATE), np.arange(n),
+                                   np.zeros((n, 3), dtype=np.uint8), q, np.ones((n, 3), dtype=bool))
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_sinusoid_rate(window):
+    rates = respiratoryrate(sinesession(), window)
+    seconds = rates["seconds"]
+    # windows entirely on one side of the change
+    first = seconds + window / 2 <= SECONDS / 2
+    second = seconds - window / 2 >= SECONDS / 2
+    assert first.any() and second.any()
+    for imu in (THORAX, ABDOMEN, "rate"):
+        assert np.abs(rates[imu][first] - RATES[0]).max() < 0.3
+        assert np.abs(rates[imu][second] - RATES[1]).max() < 0.3
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_window_centers(window):
+    rates = respiratoryrate(sinesession(), window)
+    size = window * SAMPLINGRATE
+    # middle of the first window, then one step apart
+    assert rates["seconds"][0] == pytest.approx((size - 1) / 2 / SAMPLINGRATE)
+    assert np.allclose(np.diff(rates["seconds"]), rates["seconds"][1] - rates["seconds"][0])
+    assert rates["seconds"][-1] + window / 2 <= SECONDS
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_spectra_cover_window(window):
+    assert nfft(window * SAMPLINGRATE // DECIMATE) >= window * SAMPLINGRATE // DECIMATE
+
+def test_short_session():
+    with pytest.raises(ValueError):
+        respiratoryrate(sinesession(seconds=20), WINDOWS[0])
@@ -0,0 +1,60 @@
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from imu.align import decodelogs, alignarrays, datastart, LINEWIDTH
+from imu.stream import StreamAligner, streamalign, queuesize, MAXQUEUE, BLOCKSIZE
+
+DATA = pathlib.Path(__file__).resolve().parent.parent.joinpath("data")
+LOG = DATA.joinpath("S12_cammino.txt")
+IMUIDS = [1, 2, 3]
+
+
+def streamed(fname, blocksize, **kwargs):
+    aligner = StreamAligner(IMUIDS, **kwargs)
+    blocks = list(streamalign(str(fname), IMUIDS, blocksize=blocksize, aligner=aligner))
+    return pd.concat(blocks, ignore_index=True), aligner
+
+def whole(fname):
+    # the whole log pushed at once
+    aligner = StreamAligner(IMUIDS)
+    blocks = aligner.push(decodelogs(fname.read_bytes())) + aligner.flush()
+    return pd.concat(blocks, ignore_index=True), aligner
+
+def assert_same(blocks, session):
+    df, aligner = blocks
+    expected, full = session
+    assert df.columns.tolist() == expected.columns.tolist()
+    assert df["TSTAMP"].tolist() == expected["TSTAMP"].tolist()
+    assert np.array_equal(df.iloc[:, 1:].to_numpy(), expected.iloc[:, 1:].to_numpy(), equal_nan=True)
+    assert aligner.stats.todict() == full.stats.todict()
+
+
+@pytest.mark.parametrize("blocksize", [4096, 65536])
+def test_stream_matches_whole(blocksize):
+    assert_same(streamed(LOG, blocksize, blockrows=100), whole(LOG))
+
+def test_whole_matches_alignarrays():
+    df, aligner = whole(LOG)
+    expected, stats = alignarrays(decodelogs(LOG.read_bytes()), IMUIDS)
+    assert df.equals(expected)
+    assert aligner.stats.todict() == stats.todict()
+
+def test_silent_imu(tmp_path):
+    # imu 2 silent for 150 samples, about two 4096 bytes blocks
+    raw = LOG.read_bytes()
+    start = datastart(raw)
+    lines = raw[start:].split(b"\n")
+    imu2 = [i for i, line in enumerate(lines) if line.startswith(b"[02]")]
+    gap = set(imu2[1000:1150])
+    fname = tmp_path.joinpath("log.txt")
+    fname.write_bytes(raw[:start] + b"\n".join(line for i, line in enumerate(lines) if i not in gap))
+    df, aligner = streamed(fname, 4096)
+    assert_same((df, aligner), whole(fname))
+    assert df["02_1"].isna().sum() >= 150
+
+def test_queue_holds_blocks():
+    assert MAXQUEUE >= 2 * BLOCKSIZE // LINEWIDTH
+    assert queuesize(4096) >= 2 * 4096 // LINEWIDTH
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from imu.align import decodelogs, findimus, formattstamps, RAWDTYPE, RESETCOUNTER, SAMPLINGRATE, BLANK
+from imu.synth import LossModel, synthsession, synthlog, writesynth, synthimuids
+from bench import reference
+
+SECONDS = 120
+
+
+@pytest.mark.parametrize("rate,burst", [(-0.1, 4), (1, 4), (1.5, 4), (0.1, 0.5)])
+def test_bursty_out_of_range(rate, burst):
+    with pytest.raises(ValueError):
+        LossModel.bursty(rate, burst)
+
+@pytest.mark.parametrize("rate,burst", [(0.02, 4), (0.2, 10)])
+def test_bursty_rate_and_burst(rate, burst):
+    model = LossModel.bursty(rate, burst)
+    assert model.rate == pytest.approx(rate)
+    lost = model.lost(pow(10, 6), np.random.default_rng(0))
+    assert lost.mean() == pytest.approx(rate, rel=0.1)
+    # mean length of the runs of lost samples
+    edges = np.diff(lost.astype(np.int8))
+    assert lost.sum() / np.count_nonzero(edges == 1) == pytest.approx(burst, rel=0.1)
+
+def test_session_without_loss():
+    readings, events = synthsession(SECONDS, 3, seed=1)
+    assert len(readings) == 3 * SECONDS * SAMPLINGRATE
+    assert (np.diff(readings["TSTAMP"]) >= 0).all()
+    for imuid in synthimuids(3):
+        counters = readings["NTH"][readings["IMUID"] == imuid].astype(np.int64)
+        assert (np.diff(counters) % RESETCOUNTER == 1).all()
+    assert events
+
+def test_session_with_loss():
+    model = LossModel.bursty(0.2)
+    readings, events = synthsession(SECONDS, 3, loss=model, seed=1)
+    blank = readings["CHECK"] == int(BLANK, 16)
+    assert blank.any()
+    assert (readings["Q"][blank] == 0).all()
+    collected = np.count_nonzero(~blank) / (3 * SECONDS * SAMPLINGRATE)
+    assert collected == pytest.approx(1 - model.rate, abs=0.1)
+
+def test_same_seed_same_log():
+    model = LossModel.bursty(0.05)
+    assert synthlog(SECONDS, 3, model, seed=7) == synthlog(SECONDS, 3, model, seed=7)
+    assert synthlog(SECONDS, 3, model, seed=7) != synthlog(SECONDS, 3, model, seed=8)
+
+def test_imuids_skip_discard():
+    raw = synthlog(10, 8, seed=2)
+    assert findimus(decodelogs(raw)) == synthimuids(8)
+    assert 4 not in synthimuids(8)
+
+def test_writesynth_matches_synthlog(tmp_path):
+    fname = tmp_path.joinpath("synth.txt")
+    model = LossModel.bursty(0.05)
+    readings = writesynth(str(fname), SECONDS, 3, model, seed=3)
+    assert fname.read_bytes() == synthlog(SECONDS, 3, model, seed=3)
+    # BLANK readings are not decoded, the DISCARD one of the header is
+    collected = np.count_nonzero(readings["CHECK"] != int(BLANK, 16))
+    decoded = decodelogs(fname.read_bytes())
+    assert collected == sum(len(decoded[imuid]) for imuid in synthimuids(3))
+
+def test_log_read_by_reference():
+    # the first dashboard release reads the generated logs as recorded ones
+    raw = synthlog(SECONDS, 3, LossModel.bursty(0.1), seed=4)
+    decoded = decodelogs(raw)
+    parsed = reference.convertlogs(raw.decode(), 3)
+    for imuid, rows in parsed.items():
+        readings = decoded.get(imuid, np.empty(0, dtype=RAWDTYPE))
+        assert len(readings) == len(rows)
+        assert list(formattstamps(readings["TSTAMP"])) == [row[0] for row in rows]
+        assert readings["NTH"].tolist() == [row[1] for row in rows]
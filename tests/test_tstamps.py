@@ -0,0 +1,50 @@
+import numpy as np
+
+from imu.align import parsetstamps, formattstamps, tstampcalendar, decodelogs, NOTSTAMP, MS_IN_SEC
+
+MS_IN_DAY = 24 * 3600 * MS_IN_SEC
+
+
+def dataline(nth, tstamp):
+    return b"[01],[5C],[00],[%02X],[3F],[12],[94],[FF],%s\n" % (nth, tstamp)
+
+def test_format_parse_roundtrip():
+    ms = np.array([0, 1, 59 * MS_IN_DAY + 12345678, 200 * MS_IN_DAY + 999])
+    assert np.array_equal(parsetstamps(formattstamps(ms).tolist()), ms)
+
+def test_format_notstamp():
+    strs = formattstamps(np.array([NOTSTAMP, 1500]), 0)
+    assert strs.tolist() == [0, "01:01:00:00:01:500"]
+
+def test_new_year_rollover():
+    ms = parsetstamps(["31:12:23:59:59:900", "01:01:00:00:00:100", "02:01:00:00:00:000"])
+    assert np.diff(ms).tolist() == [200, MS_IN_DAY - 100]
+
+def test_no_phantom_leap_day():
+    # a session without 29:02 is in a common year
+    ms = parsetstamps(["28:02:23:59:59:900", "01:03:00:00:00:100"])
+    assert np.diff(ms).tolist() == [200]
+
+def test_leap_day():
+    ms = parsetstamps(["28:02:23:59:59:900", "29:02:00:00:00:100", "01:03:00:00:00:000"])
+    assert np.diff(ms).tolist() == [200, MS_IN_DAY - 100]
+
+def test_leap_day_after_new_year():
+    ms = parsetstamps(["31:12:23:59:59:900", "28:02:23:59:59:900", "29:02:00:00:00:100"])
+    assert np.diff(ms).tolist() == [59 * MS_IN_DAY, 200]
+
+def test_chunk_with_log_calendar():
+    # a chunk starting after the new year is placed with the whole log
+    whole = ["31:12:23:59:59:900", "01:01:00:00:00:100"]
+    calendar = (12, False)
+    assert parsetstamps(whole[1:], calendar)[0] == parsetstamps(whole)[1]
+
+def test_log_calendar():
+    raw = b"START:\n" + dataline(0, b"31:12:23:59:59:900") + dataline(1, b"01:01:00:00:00:000")
+    assert tstampcalendar(raw) == (12, False)
+    assert tstampcalendar(b"no data") is None
+    # the second chunk alone is placed with the whole log
+    cut = raw.index(b"\n[01]", raw.index(b"[01]")) + 1
+    first = decodelogs(raw, None, cut, tstampcalendar(raw))[1]
+    second = decodelogs(raw, cut, len(raw), tstampcalendar(raw))[1]
+    assert (second["TSTAMP"] - first["TSTAMP"]).tolist() == [100]